@@ -1,23 +1,47 @@
+# Первым импортом: от него отсчитывается время запуска
+from app import startup
+import json
 import logging
+import os
 import signal
+import time
 import asyncio
+from telegram import Update
 from telegram.ext import Application
-from app.bot import setup_handlers
-from app.config import config
-from app.utils import setup_logging
+from app.bot import configured_channels, setup_handlers, replay_outbox, restore_digest, publish_scheduled
+from app.channels import ChannelInfoCache
+from app.config import config, reload_config, tenant_names, use_tenant
+from app.dedup import DedupWindow, content_key
+from app import metrics, tracing
+from app.memstats import MemoryMonitor
+from app.outbox import Outbox
+from app.pressure import SEND
+from app.ratelimit import PublisherRateLimiter
+from app.scheduler import Scheduler
+from app.watchdog import Watchdog
+from app.utils import setup_logging, render_cache
+from app.warmstart import WarmState
 
 # Инициализация логирования
 setup_logging()
 logger = logging.getLogger(__name__)
+startup.mark("imports")
 
-def setup_application():
-    """Настройка приложения Telegram."""
+def setup_application(updater=True, global_pacer=None, chat_pacers=None):
+    """
+    Настройка приложения Telegram.
+
+    Args:
+        updater: Получать обновления самому; воркеры получают их от приемника.
+        global_pacer: Общий для процессов лимит бота (в режиме воркеров).
+        chat_pacers: Общие для процессов лимиты каналов: ID чата -> ограничитель (в режиме воркеров).
+    """
     if not config.BOT_TOKEN:
         logger.error("BOT_TOKEN не установлен в .env файле")
         return None
 
     # Создаем экземпляр Application
-    application = (
+    builder = (
         Application.builder()
         .token(config.BOT_TOKEN)
         .connect_timeout(30)  # Таймаут соединения
@@ -25,24 +49,229 @@ def setup_application():
         .get_updates_connect_timeout(30)  # Таймаут соединения для обновлений
         .get_updates_read_timeout(30)     # Таймаут чтения для обновлений
         .proxy(config.HTTPS_PROXY if config.HTTPS_PROXY else None)  # Прокси, если используется
-        .build()
+        .rate_limiter(PublisherRateLimiter(global_pacer=global_pacer, chat_pacers=chat_pacers))  # Соблюдение лимитов Telegram на отправку
     )
+    if not updater:
+        builder = builder.updater(None)
+    if config.TELEGRAM_API_URL:
+        # Другой сервер Bot API (локальный или поддельный для нагрузочного теста)
+        logger.info(f"Используется Bot API по адресу {config.TELEGRAM_API_URL}")
+        builder = builder.base_url(f"{config.TELEGRAM_API_URL}/bot").base_file_url(f"{config.TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
     return application
 
-async def run_bot(application):
-    """Запуск бота."""
-    try:
-        # Инициализируем приложение
-        await application.initialize()
+def register_gauges(applications):
+    """Регистрирует вычисляемые метрики размеров хранилищ и глубины очередей (суммарно по всем ботам процесса)."""
+    from app.bot import inline_cache, user_states
+
+    def total(name, size):
+        values = [size(application.bot_data[name]) for application in applications
+                  if application.bot_data.get(name) is not None]
+        return sum(values) if values else None
+
+    def cache_sizes():
+        sizes = {
+            ("user_states",): user_states.total_size(),
+            ("user_data",): sum(len(application.user_data) for application in applications),
+            ("render_blocks",): len(render_cache),
+            ("inline_previews",): len(inline_cache),
+        }
+        for name in ("dedup", "digest", "scheduler", "channels", "admission"):
+            size = total(name, len)
+            if size is not None:
+                sizes[(name,)] = size
+        return sizes
+
+    def queue_depths():
+        depths = {("updates",): sum(application.update_queue.qsize() for application in applications)}
+        pending = total("outbox", lambda outbox: outbox.pending_count())
+        if pending is not None:
+            depths[("outbox",)] = pending
+        sending = total("pressure", lambda pressure: pressure.level(SEND))
+        if sending is not None:
+            depths[("send",)] = sending
+        return depths
+
+    metrics.CACHE_SIZE.set_function(cache_sizes)
+    metrics.QUEUE_DEPTH.set_function(queue_depths)
+
+async def in_tenant(name, function, *args):
+    """
+    Выполняет функцию в отдельной задаче, привязанной к боту `name`.
+
+    Задачи, которые создаются внутри (получение обновлений, хендлеры,
+    планировщик, дайджест), наследуют контекст и работают с конфигурацией
+    и состоянием своего бота. Для единственного бота (name=None) контекст
+    не меняется.
+    """
+    async def runner():
+        if name is not None:
+            use_tenant(name)
+        result = function(*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    return await asyncio.create_task(runner())
+
+async def start_bot(application, watchdog, polling=True, data_dir=None):
+    """
+    Открывает хранилища бота, регистрирует обработчики и запускает получение обновлений.
+
+    Args:
+        application: Приложение бота.
+        watchdog: Сторож цикла событий.
+        polling: Запустить getUpdates; воркеры получают обновления от приемника.
+        data_dir: Каталог данных вместо DATA_DIR (у каждого воркера свой).
+    """
+    data_dir = data_dir or config.DATA_DIR
+
+    # Инициализируем приложение
+    await application.initialize()
+
+    # Сведения о каналах и правах бота; переживают перезапуск в снимке
+    channels = ChannelInfoCache(application.bot, ttl=config.CHANNEL_INFO_TTL)
+    application.bot_data["channels"] = channels
+
+    # Смещение обработанных обновлений и снимок кешей с прошлой остановки
+    warm = WarmState(data_dir)
+    warm.add_cache("channels", channels.dump, channels.load)
+    warm.open()
+    application.bot_data["warm"] = warm
+
+    # Открываем журнал публикаций до приема новых сообщений
+    outbox = Outbox(os.path.join(data_dir, "outbox.db"))
+    await outbox.start()
+    await outbox.prune(config.OUTBOX_RETENTION_DAYS)
+    application.bot_data["outbox"] = outbox
+
+    # Окно дедупликации заполняем недавними публикациями из outbox,
+    # чтобы повтор сразу после перезапуска тоже был подавлен
+    dedup = DedupWindow(config.DEDUP_WINDOW, config.DEDUP_MAX_KEYS)
+    now = time.time()
+    for entry in await outbox.sent_since(now - config.DEDUP_WINDOW):
+        dedup.remember(content_key(entry["target_chat_id"], entry["text"]), now - entry["updated_at"])
+    application.bot_data["dedup"] = dedup
+
+    # Сторож цикла событий один на процесс: все боты работают в одном цикле
+    application.bot_data["watchdog"] = watchdog
+
+    # Устанавливаем обработчики из bot.py
+    setup_handlers(application)
+
+    # Запуск бота
+    logger.info(f"Бот {config.TENANT} запускается..." if config.TENANT else "Бот запускается...")
+    await application.start()
 
-        # Устанавливаем обработчики из bot.py
-        setup_handlers(application)
+    # Обновления, которые не успели обработать до остановки, идут раньше новых
+    pending = warm.take_pending()
+    for data in pending:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    if pending:
+        logger.info(f"Из снимка возвращено необработанных обновлений: {len(pending)}")
 
-        # Запуск бота
-        logger.info("Бот запускается...")
-        await application.start()
+    # Фоновая проверка прав в настроенных каналах (параллельно, с повтором до истечения TTL)
+    await channels.start(lambda: [channel_id for _, channel_id in configured_channels()])
+
+    # Досылаем сообщения, принятые до перезапуска, и возвращаем в буфер посты дайджеста
+    await replay_outbox(application)
+    await restore_digest(application)
+
+    # Запускаем планировщик отложенных публикаций
+    scheduler = Scheduler(
+        os.path.join(data_dir, "schedule.db"),
+        lambda job: publish_scheduled(application, job),
+        application.bot_data["pressure"].release_capacity
+    )
+    await scheduler.start()
+    application.bot_data["scheduler"] = scheduler
+
+    if polling:
         await application.updater.start_polling()
-        logger.info("Бот успешно запущен")
+
+async def drain_updates(application, timeout):
+    """
+    Дает обработать уже полученные обновления, но не дольше `timeout` секунд.
+
+    Returns:
+        List[Update]: Обновления, которые не успели обработать (их сохраняет снимок).
+    """
+    deadline = time.monotonic() + timeout
+    while not application.update_queue.empty() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    leftover = []
+    while not application.update_queue.empty():
+        item = application.update_queue.get_nowait()
+        application.update_queue.task_done()
+        if isinstance(item, Update):
+            leftover.append(item)
+    if leftover:
+        logger.warning(f"За {timeout} с не обработано обновлений: {len(leftover)}, они сохранены в снимок")
+    return leftover
+
+async def stop_bot(application):
+    """Останавливает получение обновлений, дописывает дайджесты и закрывает хранилища бота."""
+    # Updater подтверждает Telegram все полученные обновления, поэтому
+    # необработанные к дедлайну обновления сохраняем сами
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    leftover = await drain_updates(application, config.SHUTDOWN_TIMEOUT) if application.running else []
+    if "scheduler" in application.bot_data:
+        await application.bot_data["scheduler"].close()
+    if "channels" in application.bot_data:
+        await application.bot_data["channels"].close()
+    if "digest" in application.bot_data:
+        # Публикуем накопленные дайджесты, пока бот еще может отправлять сообщения
+        await application.bot_data["digest"].close()
+    if application.running:
+        await application.stop()
+    if "warm" in application.bot_data:
+        # Снимок кешей для быстрого теплого запуска
+        warm = application.bot_data["warm"]
+        warm.save([json.loads(update.to_json()) for update in leftover])
+        warm.close()
+    await application.shutdown()
+    if "outbox" in application.bot_data:
+        await application.bot_data["outbox"].close()
+
+async def run_bots(tenants):
+    """
+    Запуск ботов в одном цикле событий.
+
+    Args:
+        tenants: Имена ботов из TENANTS_FILE или [None] для единственного бота.
+    """
+    metrics_server = None
+    applications = {}
+    watchdog = Watchdog(config.HANDLER_BUDGET, config.LOOP_LAG_THRESHOLD)
+    memory = MemoryMonitor(config.MEMSTATS_INTERVAL, config.MEMORY_TRACE)
+    try:
+        # Сторож цикла событий: задержка цикла и хендлеры, превысившие бюджет
+        await watchdog.start()
+
+        # Трассировка отобранной доли обновлений
+        tracing.configure(config.TRACE_SAMPLE_RATE, config.TRACE_FILE)
+
+        for name in tenants:
+            application = await in_tenant(name, setup_application)
+            if application is None:
+                return
+            applications[name] = application
+            await in_tenant(name, start_bot, application, watchdog)
+
+        # Учет памяти один на процесс: хранилища всех ботов и снимки tracemalloc
+        for application in applications.values():
+            application.bot_data["memory"] = memory
+        await memory.start(applications)
+
+        # Метрики: размеры хранилищ и очередей вычисляются при каждом сборе
+        register_gauges(list(applications.values()))
+        if config.METRICS_PORT:
+            metrics_server = await metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+
+        logger.info("Бот успешно запущен" if len(applications) == 1 else f"Запущено ботов: {len(applications)}")
+        startup.mark("ready")
 
         # Ожидание завершения работы (замена idle())
         stop_signal = asyncio.Event()
@@ -54,6 +283,18 @@ async def run_bot(application):
         # Регистрируем обработчики сигналов
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
+
+        def reload_handler():
+            logger.info("Получен SIGHUP, перезагружаю конфигурацию...")
+            try:
+                reload_config()
+            except ValueError as e:
+                logger.error(f"Конфигурация не перезагружена: {e}")
+
+        # SIGHUP обрабатываем в цикле событий, а не в обработчике сигнала,
+        # чтобы перезагрузка не прерывала код, удерживающий блокировку конфигурации
+        if hasattr(signal, "SIGHUP"):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_handler)
         
         # Ожидаем сигнал завершения
         logger.info("Бот работает. Нажмите Ctrl+C для остановки")
@@ -63,19 +304,31 @@ async def run_bot(application):
         logger.error(f"Ошибка при запуске бота: {e}", exc_info=True)
 
     finally:
-        # Останавливаем и завершаем работу бота
-        if application.updater.running:
-            await application.updater.stop()
-        if application.running:
-            await application.stop()
-        await application.shutdown()
+        # Останавливаем и завершаем работу ботов
+        if metrics_server:
+            metrics_server.close()
+        for name, application in applications.items():
+            try:
+                await in_tenant(name, stop_bot, application)
+            except Exception as e:
+                logger.error(f"Ошибка при остановке бота {name}: {e}" if name else f"Ошибка при остановке бота: {e}", exc_info=True)
+        await memory.stop()
+        await watchdog.stop()
+        await asyncio.to_thread(tracing.flush)
 
 async def main() -> None:
     """Основная функция для запуска бота."""
     logger.info("Инициализация бота...")
-    application = setup_application()
-    if application:
-        await run_bot(application)
+    if config.WORKERS > 1:
+        if tenant_names():
+            logger.error("Режим воркеров (WORKERS) несовместим с TENANTS_FILE")
+            return
+        # Приемник обновлений и воркеры в отдельных процессах
+        from app.sharding import run_sharded
+        await run_sharded(config.WORKERS)
+        return
+    # Несколько ботов из TENANTS_FILE делят процесс, цикл событий, правила рендеринга и кеши
+    await run_bots(tenant_names() or [None])
 
 if __name__ == "__main__":
     try:
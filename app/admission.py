@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from typing import FrozenSet, Optional
+
+from telegram import Update
+
+# Команды, доступные всем пользователям
+PUBLIC_COMMANDS = frozenset({"start", "help"})
+
+# Решения допуска (они же значения метки метрики publisher_admission_total)
+ADMITTED = "admitted"            # администратор
+PUBLIC = "public"                # публичная команда от обычного пользователя
+UNAUTHORIZED = "unauthorized"    # обычный пользователь, не публичная команда
+RATE_LIMITED = "rate_limited"    # обычный пользователь превысил лимит
+ANONYMOUS = "anonymous"          # обновление без пользователя (посты каналов, опросы)
+
+
+def command_name(update: Update) -> Optional[str]:
+    """Имя команды без разбора entities: "/start@bot arg" -> "start"."""
+    message = update.message
+    text = message.text if message is not None else None
+    if not text or text[0] != "/":
+        return None
+    return text[1:64].split(maxsplit=1)[0].split("@", 1)[0].lower() if len(text) > 1 else None
+
+
+class AdmissionGuard:
+    """
+    Допуск обновлений до хендлеров.
+
+    Решение принимается за O(1) по ID пользователя: администраторы проходят
+    всегда, обычным пользователям доступны только PUBLIC_COMMANDS, и не чаще
+    лимита (корзина токенов на пользователя). Корзины хранятся для последних
+    `max_users` пользователей, поэтому спам с множества аккаунтов не
+    раздувает память.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, max_users: int = 10000, notice_interval: float = 60.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.notice_interval = notice_interval
+        # ID пользователя -> [токены, время пополнения, время последнего уведомления об отказе]
+        self._buckets: "OrderedDict[int, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _bucket(self, user_id: int, now: float) -> list:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = [float(self.burst), now, 0.0]
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def check(self, update: Update, admins: FrozenSet[int]) -> str:
+        """
+        Решение о допуске обновления.
+
+        Args:
+            update: Входящее обновление.
+            admins: ID администраторов.
+
+        Returns:
+            str: ADMITTED, PUBLIC, UNAUTHORIZED, RATE_LIMITED или ANONYMOUS.
+        """
+        user = update.effective_user
+        if user is None:
+            return ANONYMOUS
+        if user.id in admins:
+            return ADMITTED
+        if command_name(update) not in PUBLIC_COMMANDS:
+            return UNAUTHORIZED
+        bucket = self._bucket(user.id, time.monotonic())
+        if bucket[0] < 1:
+            return RATE_LIMITED
+        bucket[0] -= 1
+        return PUBLIC
+
+    def should_notify(self, user_id: int) -> bool:
+        """Сообщать ли пользователю об отказе: не чаще раза в `notice_interval` секунд."""
+        now = time.monotonic()
+        bucket = self._bucket(user_id, now)
+        if now - bucket[2] < self.notice_interval:
+            return False
+        bucket[2] = now
+        return True
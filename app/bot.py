@@ -1,35 +1,181 @@
+import asyncio
+import functools
 import logging
 import os
 import re
 import textwrap
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Optional, List, Union
+from typing import Dict, Optional, List, Sequence, Tuple, Union
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import (
+    InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent,
+    Message, MessageEntity, Update
+)
 from telegram.constants import ParseMode
-from telegram.error import BadRequest, TelegramError
-from telegram.ext import CallbackContext, CallbackQueryHandler, CommandHandler, filters, MessageHandler, Application
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.ext import (
+    ApplicationHandlerStop, CallbackContext, CallbackQueryHandler, CommandHandler, InlineQueryHandler, filters,
+    MessageHandler, TypeHandler, Application
+)
 
 from .html import recreate_markdown_from_entities, markdown_to_html, modern_to_html
-from .config import config
+from .config import config, get_config, reload_config, TenantLocal
 # Импортируем необходимые функции из utils.py
-from .utils import format_message, format_bot_links, append_links_to_message
+from .utils import (
+    format_message, format_message_body, format_bot_links, append_links_to_message,
+    footer_entities, visible_length, ChannelUnavailableError, DuplicateMessageError, TELEGRAM_MESSAGE_LIMIT
+)
+from .admission import ADMITTED, PUBLIC, UNAUTHORIZED, AdmissionGuard, command_name
+from .channels import ChannelInfoCache
+from .pressure import RECEIVE, RENDER, SEND, Backpressure
+from .ratelimit import LANE_BULK, outbound_lane
+from .dedup import content_key
+from .scheduler import parse_schedule_time
+from .validator import prepare_html, to_plain_text
+from . import metrics, startup, tracing
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-# Словарь для хранения состояний пользователя
-user_states = {}
+# Словарь для хранения состояний пользователя (у каждого бота процесса свой)
+user_states = TenantLocal()
 
 # Константы для состояний пользователя
 STATE_AWAITING_FORMAT = 'awaiting_format'
 STATE_AWAITING_MESSAGE = 'awaiting_message'
 STATE_NORMAL = 'normal'
 STATE_TEST_MODE = 'test_mode'
+STATE_AWAITING_SCHEDULE_TIME = 'awaiting_schedule_time'
+STATE_AWAITING_EDIT = 'awaiting_edit'
 
-# Список администраторов (ID пользователей)
-ADMIN_IDS = config.ADMIN_IDS
-logger.info(f"Загружены ID администраторов: {ADMIN_IDS}")
+# Подсказка по форматам времени для отложенной публикации
+SCHEDULE_TIME_HELP = "+30m, +2h, +1d, 18:30 или 2025-03-08 09:00 (время сервера)"
+# Сколько черновиков, ожидающих выбора «Опубликовать»/«Запланировать», хранить на пользователя
+MAX_PENDING_DRAFTS = 20
+
+# Форматы inline-превью: (format_type, заголовок результата)
+INLINE_FORMATS = (
+    ("markdown", "Markdown"),
+    ("modern", "Modern"),
+    ("html", "HTML"),
+    ("plain", "Простой текст"),
+)
+# Сколько секунд ждать рендеринга превью, прежде чем ответить простым текстом
+INLINE_RENDER_TIMEOUT = 2.0
+INLINE_CACHE_SIZE = 256
+
+# Готовые inline-превью: (бот, текст запроса, версия конфигурации) -> результаты.
+# Подпись у каждого бота своя, поэтому имя бота входит в ключ
+inline_cache: "OrderedDict[Tuple[str, str, int], List[InlineQueryResultArticle]]" = OrderedDict()
+# Номер последнего inline-запроса пользователя: более старые запросы отбрасываются
+inline_sequence = TenantLocal()
+
+def instrumented(callback):
+    """
+    Оборачивает хендлер: считает обновления и время обработки по имени хендлера
+    и открывает трассу обновления, если оно попало в выборку. Сторож цикла
+    событий следит, чтобы хендлер укладывался в бюджет времени.
+    """
+    name = callback.__name__
+    
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: CallbackContext):
+        metrics.UPDATES.inc(handler=name)
+        startup.mark("first_update")
+        update_id = getattr(update, "update_id", None)
+        watchdog = context.bot_data.get("watchdog")
+        token = watchdog.handler_started(name, update_id) if watchdog is not None else None
+        trace = tracing.start_trace(name, update_id=update_id)
+        if trace and isinstance(update, Update) and update.effective_message:
+            # Сколько обновление шло до хендлера (getUpdates и очередь)
+            trace.attrs["age_ms"] = round((time.time() - update.effective_message.date.timestamp()) * 1000)
+        started = time.perf_counter()
+        try:
+            with tracing.span(f"handler.{name}"):
+                return await callback(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.HANDLER_SECONDS.observe(elapsed, handler=name)
+            pressure = context.bot_data.get("pressure")
+            if pressure is not None:
+                pressure.handled(elapsed)
+            tracing.end_trace(trace)
+            if token is not None:
+                watchdog.handler_finished(token)
+            # Смещение обработанных обновлений для теплого перезапуска
+            warm = context.bot_data.get("warm")
+            if warm is not None and update_id:
+                warm.processed(update_id)
+    
+    return wrapper
+
+def mark_deferred(update: Update, context: CallbackContext) -> None:
+    """
+    Отмечает начатым обновление, которое достанется хендлеру с block=False.
+    
+    Такой хендлер PTB запускает отдельной задачей, и он может закончить позже
+    следующих обновлений. Отметка при разборе, в порядке поступления, не дает
+    смещению теплого перезапуска пройти дальше него до завершения.
+    """
+    warm = context.bot_data.get("warm")
+    if warm is None or not update.update_id:
+        return
+    for handler in context.application.handlers.get(0, []):
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            if not handler.block:
+                warm.started(update.update_id)
+            return
+
+async def skip_processed_update(update: Update, context: CallbackContext) -> None:
+    """
+    Пропускает обновления, которые уже были обработаны до перезапуска.
+    
+    Telegram присылает пачку обновлений повторно, если процесс остановился
+    до того, как getUpdates подтвердил ее.
+    """
+    warm = context.bot_data.get("warm")
+    if warm is not None and warm.is_processed(update.update_id):
+        logger.info(f"Обновление {update.update_id} уже обработано до перезапуска, пропускаем")
+        raise ApplicationHandlerStop
+
+async def admission_filter(update: Update, context: CallbackContext) -> None:
+    """
+    Отбрасывает обновления не от администраторов до любого разбора и рендеринга.
+    
+    Обычным пользователям доступны только /start и /help в пределах лимита
+    ADMISSION_RATE. Об отказе пользователь узнает в личном чате, не чаще раза
+    в минуту; в группах обновления отбрасываются молча.
+    """
+    guard = context.bot_data["admission"]
+    decision = guard.check(update, config.ADMIN_SET)
+    metrics.ADMISSION.inc(result=decision)
+    chat = update.effective_chat
+    if decision == PUBLIC:
+        mark_deferred(update, context)
+        return
+    if decision == ADMITTED:
+        # Очередь приема переполнена: новые посты отклоняем сразу, команды пропускаем
+        pressure = context.bot_data.get("pressure")
+        if (pressure is not None and update.effective_message is not None and chat is not None
+                and command_name(update) is None and pressure.saturated(RECEIVE)):
+            pressure.note(RECEIVE, "rejected")
+            await context.bot.send_message(
+                chat_id=chat.id,
+                text=f"⏳ Бот занят, повторите через {pressure.retry_after(RECEIVE)} с."
+            )
+            raise ApplicationHandlerStop
+        mark_deferred(update, context)
+        return
+    
+    if decision == UNAUTHORIZED and chat is not None and chat.type == "private" and guard.should_notify(update.effective_user.id):
+        await context.bot.send_message(
+            chat_id=chat.id,
+            text="❌ Бот принимает сообщения только от администраторов."
+        )
+    raise ApplicationHandlerStop
 
 def check_admin(user_id: int) -> bool:
     """
@@ -41,12 +187,354 @@ def check_admin(user_id: int) -> bool:
     Returns:
         bool: True, если пользователь администратор, иначе False
     """
-    return user_id in ADMIN_IDS
+    return user_id in config.ADMIN_SET
+
+def get_channel_target(user_id: int, chat_id: int) -> Tuple[int, str]:
+    """
+    Определяет чат для публикации по одному снимку конфигурации.
+    - В тестовом режиме: TEST_CHAT_ID или текущий чат, если TEST_CHAT_ID не указан
+    - В обычном режиме: CHANNEL_ID
+    
+    Args:
+        user_id: ID пользователя.
+        chat_id: ID текущего чата.
+        
+    Returns:
+        Tuple[int, str]: ID целевого чата (0, если канал не настроен) и его описание.
+    """
+    cfg = get_config()
+    if user_states.get(user_id) == STATE_TEST_MODE:
+        target_chat_id = cfg.TEST_CHAT_ID if cfg.TEST_CHAT_ID != 0 else chat_id
+        target_name = "тестовый канал" if cfg.TEST_CHAT_ID != 0 else "текущий чат (тестовый режим)"
+    else:
+        target_chat_id = cfg.CHANNEL_ID if cfg.CHANNEL_ID != 0 else 0
+        target_name = "основной канал" if cfg.CHANNEL_ID != 0 else ""
+    return target_chat_id, target_name
 
 def create_footer() -> str:
     """Создает подпись для сообщений с использованием format_bot_links."""
     return format_bot_links('html')  # Используем HTML формат для ссылок
 
+def plain_entities(text: str, parse_mode: Optional[str]) -> Optional[List[MessageEntity]]:
+    """Ссылки подписи для текста, который уходит без разметки (None, если разметка есть)."""
+    if parse_mode is not None:
+        return None
+    entities = footer_entities(text)
+    return [MessageEntity(**entity) for entity in entities] if entities else None
+
+
+async def deliver_message(
+    context: CallbackContext,
+    target_chat_id: int,
+    formatted_text: str,
+    origin_chat_id: Optional[int] = None,
+    entry_id: Optional[int] = None,
+    source_message_id: Optional[int] = None,
+    source_text: Optional[str] = None,
+    format_type: Optional[str] = None,
+    digest_ids: Sequence[int] = ()
+) -> Message:
+    """
+    Доставляет готовый HTML-текст в целевой чат через outbox.
+    
+    Разметка проверяется и исправляется локально, чтобы Telegram не отклонил
+    сообщение с "can't parse entities"; если исправить ее нельзя, сообщение
+    уходит простым текстом, а ссылки подписи передаются через entities. Повторная публикация того же текста в тот же чат
+    в пределах окна дедупликации отклоняется до обращения к API. Запрос записывается
+    в outbox до отправки, а после ответа Telegram запись отмечается как
+    отправленная (с message_id) или неудачная.
+    
+    Args:
+        context: Контекст обратного вызова.
+        target_chat_id: ID целевого чата.
+        formatted_text: Отформатированный текст сообщения.
+        origin_chat_id: ID чата, из которого пришел запрос.
+        entry_id: ID уже существующей записи outbox (при повторной отправке).
+        source_message_id: ID черновика в чате автора (для правки через /edit).
+        source_text: Исходный текст черновика.
+        format_type: Формат, в котором черновик был отрендерен.
+        digest_ids: Посты дайджеста в outbox, из которых собрано сообщение.
+        
+    Returns:
+        Message: Отправленное сообщение.
+        
+    Raises:
+        DuplicateMessageError: Если такое сообщение уже было опубликовано.
+        ChannelUnavailableError: Если по кешу сведений о каналах бот не может писать в чат.
+    """
+    # Права бота проверяются по кешу (он обновляется в фоне), без запроса к API
+    channels = context.bot_data.get("channels")
+    if channels is not None and entry_id is None:
+        info = channels.peek(target_chat_id)
+        if info is not None and info.reason and channels.is_fresh(info):
+            metrics.CHANNEL_CHECKS.inc(result="rejected")
+            raise ChannelUnavailableError(f"Публикация в чат {target_chat_id} невозможна: {info.reason}")
+    
+    with tracing.span("validate_html"):
+        formatted_text, parse_mode, issues = prepare_html(formatted_text)
+    if parse_mode is None:
+        metrics.HTML_CHECKS.inc(result="plain")
+    elif issues:
+        metrics.HTML_CHECKS.inc(result="repaired")
+        logger.warning(f"Разметка для чата {target_chat_id} исправлена перед отправкой: {'; '.join(issues[:10])}")
+    else:
+        metrics.HTML_CHECKS.inc(result="valid")
+    
+    dedup = context.bot_data.get("dedup")
+    key = content_key(target_chat_id, formatted_text) if dedup is not None else None
+    # Записи outbox, досылаемые после перезапуска, еще не отправлялись, их не проверяем
+    if dedup is not None and entry_id is None and not dedup.reserve(key):
+        raise DuplicateMessageError(
+            f"Такое сообщение уже было опубликовано в чате {target_chat_id} за последние {dedup.window} секунд"
+        )
+    
+    outbox = context.bot_data.get("outbox")
+    try:
+        if outbox:
+            with tracing.span("outbox.write"):
+                if entry_id is None:
+                    # Новая запись сразу получает статус sending: один коммит вместо двух
+                    entry_id = await outbox.add(
+                        target_chat_id, formatted_text, origin_chat_id, parse_mode,
+                        source_message_id=source_message_id, source_text=source_text, format_type=format_type,
+                        sending=True, digest_ids=digest_ids
+                    )
+                else:
+                    await outbox.mark_sending(entry_id)
+        
+        try:
+            started = time.perf_counter()
+            message = await context.bot.send_message(
+                chat_id=target_chat_id,
+                text=formatted_text,
+                parse_mode=parse_mode,
+                entities=plain_entities(formatted_text, parse_mode),
+                disable_web_page_preview=True
+            )
+            metrics.SEND_SECONDS.observe(time.perf_counter() - started, chat_id=target_chat_id)
+            metrics.SENT_BYTES.observe(len(formatted_text.encode("utf-8")), chat_id=target_chat_id)
+        except Exception as e:
+            if outbox:
+                await outbox.mark_failed(entry_id, str(e))
+            if channels is not None and isinstance(e, (BadRequest, Forbidden)):
+                # Права в канале могли измениться: не ждем истечения TTL
+                channels.refresh_later(target_chat_id)
+            raise
+    except BaseException:
+        if dedup is not None:
+            dedup.release(key)
+        raise
+    
+    if dedup is not None:
+        dedup.commit(key)
+    if outbox:
+        with tracing.span("outbox.write"):
+            await outbox.mark_sent(entry_id, message.message_id)
+    return message
+
+async def replay_outbox(application: Application) -> None:
+    """
+    Досылает публикации, принятые до перезапуска, но не отправленные.
+    
+    Записи, отправка которых была прервана на середине, повторно не
+    отправляются (Telegram мог их уже принять): они отмечаются как неудачные,
+    а автор получает уведомление, чтобы проверить канал.
+    """
+    outbox = application.bot_data.get("outbox")
+    if not outbox:
+        return
+    
+    context = CallbackContext(application)
+    
+    for entry in await outbox.interrupted_entries():
+        await outbox.mark_failed(entry["id"], "Отправка прервана перезапуском, доставка не подтверждена")
+        logger.warning(f"Запись outbox {entry['id']} для чата {entry['target_chat_id']} прервана перезапуском")
+        if entry["origin_chat_id"]:
+            try:
+                await context.bot.send_message(
+                    chat_id=entry["origin_chat_id"],
+                    text=(
+                        f"⚠️ Отправка сообщения #{entry['id']} в чат {entry['target_chat_id']} была прервана перезапуском бота. "
+                        "Проверьте канал и при необходимости отправьте сообщение заново."
+                    )
+                )
+            except Exception as e:
+                logger.error(f"Не удалось уведомить чат {entry['origin_chat_id']}: {e}")
+    
+    pending = await outbox.pending_entries()
+    if pending:
+        logger.info(f"Досылаем {len(pending)} неотправленных сообщений из outbox")
+    
+    for entry in pending:
+        try:
+            # Досылка не должна задерживать ответы и публикации администраторов
+            with outbound_lane(LANE_BULK):
+                message = await deliver_message(
+                    context,
+                    entry["target_chat_id"],
+                    entry["text"],
+                    entry["origin_chat_id"],
+                    entry_id=entry["id"]
+                )
+            result = f"✅ Сообщение #{entry['id']}, принятое до перезапуска, отправлено."
+            logger.info(f"Запись outbox {entry['id']} дослана в чат {entry['target_chat_id']}. ID сообщения: {message.message_id}")
+        except Exception as e:
+            result = f"❌ Не удалось отправить сообщение #{entry['id']}, принятое до перезапуска: {str(e)}"
+            logger.error(f"Ошибка при досылке записи outbox {entry['id']}: {e}", exc_info=True)
+        
+        if entry["origin_chat_id"]:
+            try:
+                await context.bot.send_message(chat_id=entry["origin_chat_id"], text=result)
+            except Exception as e:
+                logger.error(f"Не удалось уведомить чат {entry['origin_chat_id']}: {e}")
+
+def digest_enabled(context: CallbackContext) -> bool:
+    """Проверяет, включен ли режим дайджеста."""
+    return context.bot_data.get("digest_enabled", config.DIGEST_MODE)
+
+def get_digest(application: Application) -> "DigestBuffer":
+    """
+    Буфер дайджеста бота.
+    
+    Создается при первом посте в режиме дайджеста, поэтому модуль digest
+    не загружается, пока режим не используется.
+    """
+    digest = application.bot_data.get("digest")
+    if digest is None:
+        from .digest import DigestBuffer
+        digest = DigestBuffer(
+            config.DIGEST_WINDOW,
+            lambda target_chat_id, bodies, origin_chat_ids, post_ids: publish_digest(
+                application, target_chat_id, bodies, origin_chat_ids, post_ids
+            )
+        )
+        application.bot_data["digest"] = digest
+    return digest
+
+async def add_to_digest(
+    context: CallbackContext,
+    chat_id: int,
+    target_chat_id: int,
+    message_text: str,
+    format_type: str
+) -> None:
+    """
+    Рендерит пост без подписи и добавляет его в буфер дайджеста.
+    
+    Args:
+        context: Контекст обратного вызова.
+        chat_id: ID чата автора.
+        target_chat_id: ID целевого чата.
+        message_text: Текст сообщения.
+        format_type: Тип формата.
+    """
+    # Дайджест публикуется без пользователя в контексте, поэтому пробный режим проверяем здесь
+    if dry_run_enabled(context):
+        await send_render_report(context, chat_id, message_text, format_type)
+        return
+    
+    digest = get_digest(context.application)
+    body = format_message_body(message_text, format_type).strip()
+    
+    # Пост сохраняется в outbox до ответа автору и после перезапуска возвращается в буфер
+    outbox = context.bot_data.get("outbox")
+    post_id = await outbox.add_digest_post(target_chat_id, body, chat_id) if outbox else None
+    await digest.add(target_chat_id, body, chat_id, digest_reserve(), post_id=post_id)
+    
+    queued = digest.size(target_chat_id)
+    if queued:
+        text = f"📥 Сообщение добавлено в дайджест ({queued} в очереди), публикация в течение {digest.window} с."
+    else:
+        text = "📥 Сообщение добавлено в дайджест и опубликовано."
+    await context.bot.send_message(chat_id=chat_id, text=text)
+
+def digest_reserve() -> int:
+    """Длина, которую в дайджесте нужно оставить под подпись."""
+    footer = create_footer()
+    return visible_length(footer) + 2 if footer else 0
+
+async def restore_digest(application: Application) -> None:
+    """Возвращает в буфер посты дайджеста, принятые до перезапуска, но не опубликованные."""
+    outbox = application.bot_data.get("outbox")
+    if not outbox:
+        return
+    
+    posts = await outbox.digest_posts()
+    if not posts:
+        return
+    logger.info(f"В буфер дайджеста возвращено постов, принятых до перезапуска: {len(posts)}")
+    digest = get_digest(application)
+    reserve = digest_reserve()
+    for post in posts:
+        await digest.add(
+            post["target_chat_id"], post["body"], post["origin_chat_id"], reserve,
+            post_id=post["id"], created_at=post["created_at"]
+        )
+
+async def publish_digest(
+    application: Application,
+    target_chat_id: int,
+    bodies: List[str],
+    origin_chat_ids: List[int],
+    post_ids: List[int]
+) -> None:
+    """Публикует накопленные посты одним сообщением с одной подписью."""
+    from .digest import DIGEST_SEPARATOR
+    
+    context = CallbackContext(application)
+    text = DIGEST_SEPARATOR.join(bodies)
+    footer = create_footer()
+    if footer:
+        text += f"\n\n{footer}"
+    
+    try:
+        with outbound_lane(LANE_BULK):
+            # Посты удаляются из outbox в одной транзакции с записью дайджеста
+            message = await deliver_message(context, target_chat_id, text, digest_ids=post_ids)
+        result = f"✅ Дайджест из {len(bodies)} сообщений опубликован."
+        logger.info(f"Дайджест из {len(bodies)} сообщений отправлен в чат {target_chat_id}. ID сообщения: {message.message_id}")
+    except DuplicateMessageError as e:
+        result = f"⚠️ {str(e)}. Повтор не отправлен."
+    except Exception as e:
+        result = f"❌ Ошибка при публикации дайджеста: {str(e)}"
+        logger.error(f"Ошибка при публикации дайджеста в чат {target_chat_id}: {e}", exc_info=True)
+    
+    # Если дайджест отклонен до записи в outbox (повтор, канал недоступен), посты удаляем здесь,
+    # иначе после перезапуска они были бы опубликованы снова
+    outbox = application.bot_data.get("outbox")
+    if outbox and post_ids:
+        await outbox.remove_digest_posts(post_ids)
+    
+    for origin_chat_id in dict.fromkeys(origin_chat_ids):
+        try:
+            await context.bot.send_message(chat_id=origin_chat_id, text=result)
+        except Exception as e:
+            logger.error(f"Не удалось уведомить чат {origin_chat_id}: {e}")
+
+async def reject_if_busy(context: CallbackContext, chat_id: int, target_chat_id: int) -> bool:
+    """
+    Отклоняет новую публикацию, если очередь отправки заполнена до отметки SEND_HIGH_WATER.
+    
+    Returns:
+        bool: True, если публикация отклонена и автору отправлен ответ.
+    """
+    pressure = context.bot_data.get("pressure")
+    if pressure is None or not pressure.saturated(SEND):
+        return False
+    pressure.note(SEND, "rejected")
+    retry_after = pressure.retry_after(SEND, target_chat_id)
+    logger.warning(f"Очередь отправки заполнена, публикация в чат {target_chat_id} отклонена (повтор через {retry_after} с)")
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"⏳ Очередь отправки заполнена, сообщение не опубликовано. Повторите через {retry_after} с."
+    )
+    return True
+
+def dry_run_enabled(context: CallbackContext) -> bool:
+    """Включен ли у пользователя пробный режим (у заданий планировщика и дайджестов пользователя нет)."""
+    user_data = context.user_data
+    return bool(user_data and user_data.get("dry_run"))
+
 async def send_formatted_message(
     context: CallbackContext,
     chat_id: int,
@@ -54,7 +542,9 @@ async def send_formatted_message(
     format_type: str,
     footer: str,
     test_mode_enabled: bool = False,
-    target_chat_id: Optional[int] = None
+    target_chat_id: Optional[int] = None,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    source_message_id: Optional[int] = None
 ) -> None:
     """
     Отправляет форматированное сообщение.
@@ -67,7 +557,14 @@ async def send_formatted_message(
         footer: Подпись для сообщения.
         test_mode_enabled: Флаг тестового режима.
         target_chat_id: ID целевого чата для отправки сообщения.
+        reply_markup: Клавиатура для сообщения об успешной отправке.
+        source_message_id: ID черновика, по которому пост можно будет поправить.
     """
+    # В пробном режиме ничего не публикуем, а отвечаем отчетом о рендеринге
+    if dry_run_enabled(context):
+        await send_render_report(context, chat_id, message_text, format_type)
+        return
+    
     try:
         # Используем функцию format_message из utils.py
         formatted_text = format_message(message_text, format_type)
@@ -94,11 +591,14 @@ async def send_formatted_message(
         if target_chat_id is None:
             target_chat_id = chat_id
         
-        message = await context.bot.send_message(
-            chat_id=target_chat_id,
-            text=formatted_text,
-            parse_mode=parse_mode,
-            disable_web_page_preview=True
+        message = await deliver_message(
+            context,
+            target_chat_id,
+            formatted_text,
+            origin_chat_id=chat_id,
+            source_message_id=source_message_id,
+            source_text=message_text,
+            format_type=format_type
         )
         
         success_message = "✅ Сообщение успешно отправлено."
@@ -107,9 +607,22 @@ async def send_formatted_message(
         
         await context.bot.send_message(
             chat_id=chat_id,
-            text=success_message
+            text=success_message,
+            reply_markup=reply_markup
         )
         logger.info(f"Сообщение успешно отправлено в чат {target_chat_id}. ID сообщения: {message.message_id}")
+    except DuplicateMessageError as e:
+        logger.info(f"Повторная публикация в чат {target_chat_id} подавлена: {e}")
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"⚠️ {str(e)}. Повтор не отправлен."
+        )
+    except ChannelUnavailableError as e:
+        logger.warning(str(e))
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ {str(e)}. Проверьте права бота командой /channels refresh."
+        )
     except Exception as e:
         error_message = str(e)
         logger.error(f"Ошибка при отправке сообщения в чат {target_chat_id}: {error_message}", exc_info=True)
@@ -145,16 +658,26 @@ async def start(update: Update, context: CallbackContext) -> None:
         "Чтобы выбрать формат, используйте команду /format.\n\n"
         "Команды:\n"
         "/start - Показать это сообщение\n"
-        "/help - Показать справку по форматированию\n"
-        "/format - Выбрать формат сообщения"
+        "/help - Показать справку по форматированию"
     )
     
-    # Добавляем команды администратора для админов
+    # Добавляем команды администратора для админов (остальным доступны только /start и /help)
     user_id = update.effective_user.id
     if check_admin(user_id):
-        message += "\n\nКоманды администратора:\n"
+        message += "\n/format - Выбрать формат сообщения\n"
+        message += "/edit - Исправить опубликованный пост (ответом на черновик)\n"
+        message += "\nКоманды администратора:\n"
         message += "/test - Включить/выключить тестовый режим\n"
-        message += "/setformat [тип] - Установить формат по умолчанию (markdown, html, modern)"
+        message += "/setformat [тип] - Установить формат по умолчанию (markdown, html, modern)\n"
+        message += "/reload - Перечитать конфигурацию из .env\n"
+        message += "/schedule [время] [текст] - Запланировать публикацию\n"
+        message += "/scheduled - Список запланированных публикаций\n"
+        message += "/digest - Включить/выключить режим дайджеста\n"
+        message += "/health - Задержка цикла событий и медленные хендлеры\n"
+        message += "/pressure - Заполнение очередей приема, рендеринга и отправки\n"
+        message += "/profile [секунды] - Профилирование процесса со сводкой горячих функций\n"
+        message += "/memstats [reset] - Размеры хранилищ и растущие места выделения памяти\n"
+        message += "/dryrun - Пробный рендеринг: отчет вместо публикации"
     
     # Используем функцию append_links_to_message из utils.py
     message = append_links_to_message(message, 'html')
@@ -263,6 +786,33 @@ async def test_mode(update: Update, context: CallbackContext) -> None:
     
     logger.info(f"Администратор {user_id} {'включил' if new_state == STATE_TEST_MODE else 'выключил'} тестовый режим")
 
+async def dry_run_command(update: Update, context: CallbackContext) -> None:
+    """Включает/выключает пробный режим: черновики не публикуются, в ответ приходит отчет о рендеринге."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # Проверка на право использования команды
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ Только администраторы могут использовать эту команду."
+        )
+        return
+    
+    enabled = not context.user_data.get("dry_run", False)
+    context.user_data["dry_run"] = enabled
+    
+    if enabled:
+        status_message = (
+            "🧪 Пробный режим включен: сообщения не публикуются, вместо этого бот показывает "
+            "длину, сущности, число частей, время этапов и замечания проверки разметки."
+        )
+    else:
+        status_message = "❌ Пробный режим выключен"
+    await context.bot.send_message(chat_id=chat_id, text=status_message)
+    
+    logger.info(f"Администратор {user_id} {'включил' if enabled else 'выключил'} пробный режим")
+
 async def set_format(update: Update, context: CallbackContext) -> None:
     """Устанавливает формат по умолчанию."""
     user_id = update.effective_user.id
@@ -334,6 +884,46 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
         user_states[user_id] = STATE_AWAITING_MESSAGE
         
         logger.info(f"Пользователь {user_id} выбрал формат: {format_type}")
+    
+    # Выбор для черновика: ключ черновика (ID его сообщения) передается в callback_data
+    elif callback_data.split(":", 1)[0] in ("publish_draft", "schedule_draft"):
+        action, _, key = callback_data.partition(":")
+        drafts = context.user_data.get("drafts", {})
+        draft_id = int(key) if key.isdigit() else None
+        if not check_admin(user_id) or draft_id not in drafts:
+            await query.edit_message_text(text="❌ Черновик не найден: он уже опубликован, запланирован или устарел.")
+            return
+        
+        draft = drafts[draft_id]
+        if action == "publish_draft":
+            # При перегрузке черновик и кнопки остаются: опубликовать можно позже
+            if await reject_if_busy(context, query.message.chat_id, draft["target_chat_id"]):
+                return
+            del drafts[draft_id]
+            await query.edit_message_text(text=f"📤 Черновик публикуется ({draft['target_name']}).")
+            await send_formatted_message(
+                context,
+                query.message.chat_id,
+                draft["text"],
+                draft["format_type"],
+                format_bot_links(draft["format_type"]),
+                draft["test_mode"],
+                draft["target_chat_id"],
+                source_message_id=draft_id
+            )
+            return
+        
+        context.user_data["schedule_draft_id"] = draft_id
+        context.user_data["state_before_schedule"] = user_states.get(user_id, STATE_NORMAL)
+        user_states[user_id] = STATE_AWAITING_SCHEDULE_TIME
+        
+        await query.edit_message_text(
+            text=(
+                f"🕒 Когда опубликовать черновик ({draft['target_name']})?\n"
+                f"Отправьте время: {SCHEDULE_TIME_HELP}.\n"
+                "Чтобы отменить, отправьте «отмена»."
+            )
+        )
 
 # async def handle_message(update: Update, context: CallbackContext) -> None:
     # """Обрабатывает обычные текстовые сообщения."""
@@ -387,7 +977,9 @@ async def button_handler(update: Update, context: CallbackContext) -> None:
     
 async def handle_all_messages(update: Update, context: CallbackContext) -> None:
     """Обрабатывает все типы сообщений и восстанавливает форматирование."""
-    message = update.message
+    # Исправленный черновик приходит как edited_message
+    is_edit = update.edited_message is not None
+    message = update.edited_message if is_edit else update.message
     user_id = message.from_user.id
     chat_id = message.chat_id
     
@@ -404,14 +996,32 @@ async def handle_all_messages(update: Update, context: CallbackContext) -> None:
         logger.info("Сообщение не содержит текста или подписи к медиа")
         return
     
+    # Проверяем, находится ли пользователь в состоянии ожидания сообщения
+    state = user_states.get(user_id, STATE_NORMAL)
+    
+    # Пользователь отвечает временем публикации для черновика
+    if state == STATE_AWAITING_SCHEDULE_TIME and not is_edit:
+        await schedule_draft(update, context, text)
+        return
+    
     # Восстанавливаем форматирование из entities если они есть
     if entities:
         logger.info(f"Найдены entities: {entities}")
-        text = recreate_markdown_from_entities(text, entities)
+        with tracing.span("recreate_markdown_from_entities", entities=len(entities)):
+            text = recreate_markdown_from_entities(text, entities)
         logger.info(f"Текст после восстановления форматирования: {text[:100]}...")
     
-    # Проверяем, находится ли пользователь в состоянии ожидания сообщения
-    state = user_states.get(user_id, STATE_NORMAL)
+    # Исправлен черновик, который еще ждет выбора: публикуется или планируется уже новый текст
+    drafts = context.user_data.get("drafts")
+    if is_edit and drafts and message.message_id in drafts:
+        drafts[message.message_id]["text"] = text
+        logger.info(f"Черновик {message.message_id} изменен до публикации")
+        return
+    
+    # Правка опубликованного поста: изменен черновик или прислан исправленный текст после /edit
+    if is_edit or state == STATE_AWAITING_EDIT:
+        await edit_published_post(update, context, text)
+        return
     
     # Если пользователь не в состоянии ожидания формата или сообщения, устанавливаем формат по умолчанию
     if state not in (STATE_AWAITING_FORMAT, STATE_AWAITING_MESSAGE):
@@ -428,11 +1038,44 @@ async def handle_all_messages(update: Update, context: CallbackContext) -> None:
     # Проверяем, находится ли пользователь в тестовом режиме
     test_mode_enabled = state == STATE_TEST_MODE
     
-    # Определяем целевой чат
+    # Определяем целевой чат по одному снимку конфигурации
+    cfg = get_config()
     if test_mode_enabled:
-        target_chat_id = config.TEST_CHAT_ID if config.TEST_CHAT_ID != 0 else chat_id
+        target_chat_id = cfg.TEST_CHAT_ID if cfg.TEST_CHAT_ID != 0 else chat_id
     else:
-        target_chat_id = config.CHANNEL_ID if config.CHANNEL_ID != 0 else chat_id
+        target_chat_id = cfg.CHANNEL_ID if cfg.CHANNEL_ID != 0 else chat_id
+    
+    # В режиме дайджеста посты в канал копятся и публикуются одним сообщением
+    if not test_mode_enabled and target_chat_id != chat_id and digest_enabled(context):
+        await add_to_digest(context, chat_id, target_chat_id, text, format_type)
+        return
+    
+    # Администратор выбирает, опубликовать черновик сейчас или запланировать
+    if cfg.DRAFT_CONFIRM and check_admin(user_id) and not dry_run_enabled(context):
+        if test_mode_enabled:
+            target_name = "тестовый канал" if cfg.TEST_CHAT_ID != 0 else "текущий чат (тестовый режим)"
+        else:
+            target_name = "основной канал" if cfg.CHANNEL_ID != 0 else "текущий чат"
+        drafts = context.user_data.setdefault("drafts", OrderedDict())
+        drafts[message.message_id] = {
+            "text": text,
+            "format_type": format_type,
+            "test_mode": test_mode_enabled,
+            "target_chat_id": target_chat_id,
+            "target_name": target_name,
+        }
+        while len(drafts) > MAX_PENDING_DRAFTS:
+            drafts.popitem(last=False)
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"📝 Черновик получен ({target_name}). Опубликовать сейчас или запланировать?",
+            reply_to_message_id=message.message_id,
+            reply_markup=draft_keyboard(message.message_id)
+        )
+        return
+    
+    if await reject_if_busy(context, chat_id, target_chat_id):
+        return
     
     await send_formatted_message(
         context,
@@ -441,9 +1084,214 @@ async def handle_all_messages(update: Update, context: CallbackContext) -> None:
         format_type,
         footer,
         test_mode_enabled,
-        target_chat_id
+        target_chat_id,
+        source_message_id=message.message_id
     )
 
+def draft_keyboard(draft_id: int) -> InlineKeyboardMarkup:
+    """Кнопки выбора для черновика: ID его сообщения передается в callback_data."""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("📤 Опубликовать", callback_data=f"publish_draft:{draft_id}"),
+        InlineKeyboardButton("🕒 Запланировать", callback_data=f"schedule_draft:{draft_id}"),
+    ]])
+
+async def send_render_report(context: CallbackContext, chat_id: int, text: str, format_type: str) -> None:
+    """
+    Отвечает отчетом пробного рендеринга вместо публикации.
+    
+    Args:
+        context: Контекст обратного вызова.
+        chat_id: ID чата автора.
+        text: Текст черновика.
+        format_type: Тип формата.
+    """
+    try:
+        # Модуль отчетов нужен только в пробном режиме
+        from .report import render_report
+        report = render_report(text, format_type)
+    except Exception as e:
+        logger.error(f"Ошибка пробного рендеринга: {e}", exc_info=True)
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ Ошибка форматирования: {e}")
+        return
+    
+    # Без parse_mode: в замечаниях проверки встречаются теги
+    await context.bot.send_message(chat_id=chat_id, text=report.format()[:TELEGRAM_MESSAGE_LIMIT])
+
+async def update_published_post(context: CallbackContext, entry: Dict, source_text: str) -> bool:
+    """
+    Перерисовывает опубликованный пост по исправленному черновику.
+    
+    Абзацы, которые не изменились, берутся из кеша рендеринга, а
+    editMessageText вызывается, только если итоговый HTML отличается
+    от опубликованного.
+    
+    Args:
+        context: Контекст обратного вызова.
+        entry: Запись outbox опубликованного поста.
+        source_text: Исправленный текст черновика.
+        
+    Returns:
+        bool: True, если пост изменен в Telegram.
+    """
+    format_type = entry["format_type"] or "markdown"
+    formatted_text, parse_mode, issues = prepare_html(format_message(source_text, format_type))
+    if issues:
+        logger.warning(f"Разметка правки поста #{entry['id']} исправлена: {'; '.join(issues[:10])}")
+    
+    if formatted_text == entry["text"] and parse_mode == entry["parse_mode"]:
+        logger.info(f"Правка поста #{entry['id']} не меняет текст, запрос к Telegram не нужен")
+        return False
+    
+    try:
+        await context.bot.edit_message_text(
+            chat_id=entry["target_chat_id"],
+            message_id=entry["message_id"],
+            text=formatted_text,
+            parse_mode=parse_mode,
+            entities=plain_entities(formatted_text, parse_mode),
+            disable_web_page_preview=True
+        )
+        changed = True
+    except BadRequest as e:
+        # Telegram считает текст тем же (например, отличаются только незначащие пробелы)
+        if "message is not modified" not in str(e).lower():
+            raise
+        changed = False
+    
+    await context.bot_data["outbox"].update_published(entry["id"], formatted_text, parse_mode, source_text)
+    return changed
+
+async def edit_published_post(update: Update, context: CallbackContext, text: str) -> None:
+    """Применяет исправленный черновик к опубликованному посту и сообщает результат автору."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    outbox = context.bot_data.get("outbox")
+    
+    if update.edited_message is not None:
+        entry = await outbox.find_published(chat_id, update.edited_message.message_id) if outbox else None
+        if entry is None:
+            logger.info(f"Изменен черновик {update.edited_message.message_id}, который не публиковался, пропускаем")
+            return
+    else:
+        user_states[user_id] = context.user_data.pop("state_before_edit", STATE_NORMAL)
+        entry_id = context.user_data.pop("edit_entry_id", None)
+        if text.strip().lower() in ("отмена", "cancel", "-"):
+            await context.bot.send_message(chat_id=chat_id, text="Правка отменена.")
+            return
+        entry = await outbox.get(entry_id) if outbox and entry_id else None
+        if entry is None:
+            await context.bot.send_message(chat_id=chat_id, text="❌ Публикация для правки не найдена.")
+            return
+    
+    # В пробном режиме пост не меняем, а показываем отчет о рендеринге правки
+    if dry_run_enabled(context):
+        await send_render_report(context, chat_id, text, entry["format_type"] or "markdown")
+        return
+    
+    try:
+        if await update_published_post(context, entry, text):
+            result = f"✅ Пост #{entry['id']} обновлен."
+        else:
+            result = f"ℹ️ Текст поста #{entry['id']} не изменился, правка не отправлялась."
+    except Exception as e:
+        result = f"❌ Не удалось изменить пост #{entry['id']}: {str(e)}"
+        logger.error(f"Ошибка при правке поста #{entry['id']}: {e}", exc_info=True)
+    
+    await context.bot.send_message(chat_id=chat_id, text=result)
+
+async def schedule_draft(update: Update, context: CallbackContext, time_text: str) -> None:
+    """Планирует черновик, выбранный кнопкой, на время, которое пользователь прислал ответом."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    draft_id = context.user_data.get("schedule_draft_id")
+    drafts = context.user_data.get("drafts", {})
+    draft = drafts.get(draft_id)
+    
+    if time_text.strip().lower() in ("отмена", "cancel", "-") or not draft:
+        user_states[user_id] = context.user_data.pop("state_before_schedule", STATE_NORMAL)
+        context.user_data.pop("schedule_draft_id", None)
+        # Черновик остается доступным: его можно опубликовать сейчас или запланировать снова
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Планирование отменено." if draft else "❌ Черновик для планирования не найден.",
+            reply_markup=draft_keyboard(draft_id) if draft else None
+        )
+        return
+    
+    try:
+        due, _ = parse_schedule_time(time_text.split())
+    except ValueError as e:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ {str(e)}. Используйте: {SCHEDULE_TIME_HELP}, или «отмена»."
+        )
+        return
+    
+    user_states[user_id] = context.user_data.pop("state_before_schedule", STATE_NORMAL)
+    context.user_data.pop("schedule_draft_id", None)
+    if await add_scheduled_job(
+        context, chat_id, user_id, due, draft["target_chat_id"], draft["target_name"], draft["text"], draft["format_type"]
+    ):
+        del drafts[draft_id]
+    else:
+        await context.bot.send_message(
+            chat_id=chat_id, text="Черновик не запланирован.", reply_markup=draft_keyboard(draft_id)
+        )
+
+async def add_scheduled_job(
+    context: CallbackContext,
+    chat_id: int,
+    user_id: int,
+    due: float,
+    target_chat_id: int,
+    target_name: str,
+    text: str,
+    format_type: str
+) -> bool:
+    """
+    Добавляет задание в планировщик и сообщает пользователю результат.
+    
+    Returns:
+        bool: True, если задание добавлено.
+    """
+    # Задание публикуется без пользователя в контексте, поэтому пробный режим проверяем при планировании
+    if dry_run_enabled(context):
+        await send_render_report(context, chat_id, text, format_type)
+        return False
+    
+    scheduler = context.bot_data.get("scheduler")
+    if scheduler is None:
+        await context.bot.send_message(chat_id=chat_id, text="❌ Планировщик не запущен.")
+        return False
+    
+    if due <= time.time():
+        await context.bot.send_message(chat_id=chat_id, text="❌ Время публикации уже прошло.")
+        return False
+    
+    job_id = await scheduler.add(due, chat_id, target_chat_id, text, format_type, user_id)
+    due_text = datetime.fromtimestamp(due).strftime("%Y-%m-%d %H:%M")
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"🕒 Сообщение #{job_id} запланировано на {due_text} ({target_name}).\nОтменить: /unschedule {job_id}"
+    )
+    logger.info(f"Пользователь {user_id} запланировал сообщение #{job_id} в чат {target_chat_id} на {due_text}")
+    return True
+
+async def publish_scheduled(application: Application, job: Dict) -> None:
+    """Публикует задание планировщика через обычный путь отправки."""
+    context = CallbackContext(application)
+    # Пачка отложенных публикаций идет по фоновой полосе и не задерживает интерфейс
+    with outbound_lane(LANE_BULK):
+        await send_formatted_message(
+            context,
+            job["origin_chat_id"],
+            job["text"],
+            job["format_type"],
+            format_bot_links(job["format_type"]),
+            False,
+            job["target_chat_id"]
+        )
+
 async def send_to_channel(update: Update, context: CallbackContext) -> None:
     """
     Отправляет форматированное сообщение в канал.
@@ -479,12 +1327,7 @@ async def send_to_channel(update: Update, context: CallbackContext) -> None:
     test_mode_enabled = user_states.get(user_id) == STATE_TEST_MODE
     
     # Определяем целевой чат
-    if test_mode_enabled:
-        target_chat_id = config.TEST_CHAT_ID if config.TEST_CHAT_ID != 0 else chat_id
-        target_name = "тестовый канал" if config.TEST_CHAT_ID != 0 else "текущий чат (тестовый режим)"
-    else:
-        target_chat_id = config.CHANNEL_ID if config.CHANNEL_ID != 0 else 0
-        target_name = "основной канал" if config.CHANNEL_ID != 0 else ""
+    target_chat_id, target_name = get_channel_target(user_id, chat_id)
     
     if target_chat_id == 0:
         await context.bot.send_message(
@@ -497,6 +1340,14 @@ async def send_to_channel(update: Update, context: CallbackContext) -> None:
     format_type = context.user_data.get("format", context.bot_data.get("default_format", config.DEFAULT_FORMAT)).lower()
     logger.info(f"Формат сообщения для канала: {format_type}")
     
+    # В режиме дайджеста посты в канал копятся и публикуются одним сообщением
+    if not test_mode_enabled and digest_enabled(context):
+        await add_to_digest(context, chat_id, target_chat_id, message_text, format_type)
+        return
+    
+    if await reject_if_busy(context, chat_id, target_chat_id):
+        return
+    
     # Создаем подпись
     footer = format_bot_links(format_type)
     
@@ -510,14 +1361,77 @@ async def send_to_channel(update: Update, context: CallbackContext) -> None:
         target_chat_id
     )
 
-async def check_channels(update: Update, context: CallbackContext) -> None:
+async def schedule_command(update: Update, context: CallbackContext) -> None:
     """
-    Проверяет права бота в настроенных каналах и выводит информацию о них.
+    Планирует публикацию сообщения в канал.
+    
+    Использование: /schedule <время> текст сообщения
     """
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     
     # Проверяем права администратора
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для отправки сообщений в канал."
+        )
+        return
+    
+    usage = f"❌ Использование: /schedule <время> текст сообщения\nВремя: {SCHEDULE_TIME_HELP}"
+    try:
+        due, used = parse_schedule_time(context.args or [])
+    except ValueError as e:
+        await context.bot.send_message(chat_id=chat_id, text=f"{usage}\n\n{str(e)}")
+        return
+    
+    message_text = ' '.join(context.args[used:])
+    if not message_text:
+        await context.bot.send_message(chat_id=chat_id, text=usage)
+        return
+    
+    target_chat_id, target_name = get_channel_target(user_id, chat_id)
+    if target_chat_id == 0:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ ID канала не установлен в конфигурации."
+        )
+        return
+    
+    format_type = context.user_data.get("format", context.bot_data.get("default_format", config.DEFAULT_FORMAT)).lower()
+    await add_scheduled_job(context, chat_id, user_id, due, target_chat_id, target_name, message_text, format_type)
+
+async def digest_command(update: Update, context: CallbackContext) -> None:
+    """Включает/выключает режим дайджеста."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ Только администраторы могут использовать эту команду."
+        )
+        return
+    
+    enabled = not digest_enabled(context)
+    context.bot_data["digest_enabled"] = enabled
+    digest = context.bot_data.get("digest")
+    if not enabled and digest is not None:
+        # Накопленное не должно ждать следующего включения
+        await digest.close()
+    
+    status_message = (
+        f"✅ Режим дайджеста включен: посты за {config.DIGEST_WINDOW} с объединяются в одно сообщение"
+        if enabled else "❌ Режим дайджеста выключен"
+    )
+    await context.bot.send_message(chat_id=chat_id, text=status_message)
+    logger.info(f"Администратор {user_id} {'включил' if enabled else 'выключил'} режим дайджеста")
+
+async def scheduled_command(update: Update, context: CallbackContext) -> None:
+    """Показывает ближайшие запланированные публикации пользователя."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
     if not check_admin(user_id):
         await context.bot.send_message(
             chat_id=chat_id,
@@ -525,7 +1439,46 @@ async def check_channels(update: Update, context: CallbackContext) -> None:
         )
         return
     
-    # Собираем список каналов из конфигурации
+    scheduler = context.bot_data.get("scheduler")
+    jobs = scheduler.pending(user_id) if scheduler is not None else []
+    if not jobs:
+        await context.bot.send_message(chat_id=chat_id, text="Запланированных сообщений нет.")
+        return
+    
+    result = "🕒 Запланированные сообщения:\n\n"
+    for job in jobs:
+        due_text = datetime.fromtimestamp(job["due"]).strftime("%Y-%m-%d %H:%M")
+        preview = job["text"][:50] + ("..." if len(job["text"]) > 50 else "")
+        result += f"#{job['id']} {due_text} → {job['target_chat_id']}: {preview}\n"
+    
+    await context.bot.send_message(chat_id=chat_id, text=result)
+
+async def unschedule_command(update: Update, context: CallbackContext) -> None:
+    """Отменяет запланированную публикацию: /unschedule <номер>."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для выполнения этой команды."
+        )
+        return
+    
+    if not context.args or not context.args[0].lstrip("#").isdigit():
+        await context.bot.send_message(chat_id=chat_id, text="❌ Укажите номер задания: /unschedule <номер>")
+        return
+    
+    job_id = int(context.args[0].lstrip("#"))
+    scheduler = context.bot_data.get("scheduler")
+    if scheduler is not None and await scheduler.cancel(job_id, user_id):
+        await context.bot.send_message(chat_id=chat_id, text=f"✅ Сообщение #{job_id} снято с публикации.")
+        logger.info(f"Пользователь {user_id} отменил запланированное сообщение #{job_id}")
+    else:
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ Задание #{job_id} не найдено.")
+
+def configured_channels() -> List[Tuple[str, int]]:
+    """Каналы из конфигурации: (название для пользователя, ID)."""
     channels = []
     
     if hasattr(config, 'CHANNEL_ID') and config.CHANNEL_ID != 0:
@@ -534,6 +1487,29 @@ async def check_channels(update: Update, context: CallbackContext) -> None:
     if hasattr(config, 'TEST_CHAT_ID') and config.TEST_CHAT_ID != 0:
         channels.append(("Тестовый канал", config.TEST_CHAT_ID))
     
+    return channels
+
+async def check_channels(update: Update, context: CallbackContext) -> None:
+    """
+    Проверяет права бота в настроенных каналах и выводит информацию о них.
+    
+    Сведения берутся из кеша, если они свежие; `/channels refresh` проверяет
+    каналы заново. Каналы проверяются параллельно.
+    """
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # Проверяем права администратора
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для выполнения этой команды."
+        )
+        return
+    
+    # Собираем список каналов из конфигурации
+    channels = configured_channels()
+    
     if not channels:
         await context.bot.send_message(
             chat_id=chat_id,
@@ -541,34 +1517,23 @@ async def check_channels(update: Update, context: CallbackContext) -> None:
         )
         return
     
-    # Проверяем доступ к каналам
+    # Проверяем доступ к каналам (без фонового кеша, например в тестах, - одноразовый)
+    cache = context.bot_data.get("channels")
+    if cache is None:
+        cache = ChannelInfoCache(context.bot, ttl=config.CHANNEL_INFO_TTL)
+    refresh = bool(context.args) and context.args[0] == "refresh"
+    infos = await cache.get_many([channel_id for _, channel_id in channels], refresh=refresh)
+    
     result = "📊 Информация о каналах:\n\n"
+    now = time.time()
     
-    for name, channel_id in channels:
-        try:
-            # Пробуем получить информацию о чате
-            chat_info = await context.bot.get_chat(channel_id)
-            
-            # Проверяем права бота в канале
-            bot_member = await context.bot.get_chat_member(
-                chat_id=channel_id,
-                user_id=context.bot.id
-            )
-            
-            # Формируем строку статуса
-            status = "✅ Доступен"
-            if hasattr(bot_member, 'can_post_messages') and not bot_member.can_post_messages:
-                status = "⚠️ Нет прав на отправку сообщений"
-            
-            # Добавляем информацию о канале
-            result += f"{name} ({channel_id}):\n"
-            result += f"Название: {chat_info.title}\n"
-            result += f"Тип: {chat_info.type}\n"
-            result += f"Статус: {status}\n\n"
-            
-        except Exception as e:
-            result += f"{name} ({channel_id}):\n"
-            result += f"Статус: ❌ Ошибка доступа ({str(e)})\n\n"
+    for (name, channel_id), info in zip(channels, infos):
+        result += f"{name} ({channel_id}):\n"
+        if not info.error:
+            result += f"Название: {info.title}\n"
+            result += f"Тип: {info.type}\n"
+        result += f"Статус: {info.describe()}\n"
+        result += f"Проверено: {max(0, now - info.checked_at):.0f} с назад\n\n"
     
     # Отправляем результат проверки
     await context.bot.send_message(
@@ -576,10 +1541,318 @@ async def check_channels(update: Update, context: CallbackContext) -> None:
         text=result
     )
 
+async def reload_command(update: Update, context: CallbackContext) -> None:
+    """Перечитывает .env и атомарно заменяет снимок конфигурации."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # Проверяем права администратора
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для выполнения этой команды."
+        )
+        return
+    
+    try:
+        snapshot = reload_config()
+    except ValueError as e:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ Конфигурация не перезагружена: {str(e)}\nПродолжает действовать версия {get_config().version}."
+        )
+        return
+    
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"✅ Конфигурация перезагружена, версия {snapshot.version}"
+    )
+    logger.info(f"Администратор {user_id} перезагрузил конфигурацию (версия {snapshot.version})")
+
+async def edit_command(update: Update, context: CallbackContext) -> None:
+    """
+    Начинает правку опубликованного поста.
+    
+    Команда, отправленная ответом на исходный черновик, правит пост из этого
+    черновика, без ответа - последний пост из этого чата. Следующее сообщение
+    пользователя считается исправленным текстом.
+    """
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    outbox = context.bot_data.get("outbox")
+    if outbox is None:
+        await context.bot.send_message(chat_id=chat_id, text="❌ Журнал публикаций не запущен.")
+        return
+    
+    reply = update.message.reply_to_message
+    entry = await outbox.find_published(chat_id, reply.message_id if reply else None)
+    if entry is None:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ Публикация для правки не найдена. Отправьте /edit ответом на исходный черновик."
+        )
+        return
+    
+    context.user_data["edit_entry_id"] = entry["id"]
+    context.user_data["state_before_edit"] = user_states.get(user_id, STATE_NORMAL)
+    user_states[user_id] = STATE_AWAITING_EDIT
+    
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=(
+            f"✏️ Отправьте исправленный текст поста #{entry['id']} (чат {entry['target_chat_id']}).\n"
+            "Пост будет изменен на месте, без повторной публикации.\n"
+            "Чтобы отменить, отправьте «отмена»."
+        )
+    )
+
+async def health_command(update: Update, context: CallbackContext) -> None:
+    """Показывает задержку цикла событий, медленные хендлеры и снимки их стеков."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # Проверяем права администратора
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для выполнения этой команды."
+        )
+        return
+    
+    watchdog = context.bot_data.get("watchdog")
+    if watchdog is None:
+        await context.bot.send_message(chat_id=chat_id, text="Сторож цикла событий не запущен.")
+        return
+    
+    # Без parse_mode: в стеках встречаются символы, которые сломали бы разметку
+    await context.bot.send_message(chat_id=chat_id, text=watchdog.report()[:TELEGRAM_MESSAGE_LIMIT])
+
+async def pressure_command(update: Update, context: CallbackContext) -> None:
+    """Показывает заполнение очередей приема, рендеринга и отправки."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # Проверяем права администратора
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для выполнения этой команды."
+        )
+        return
+    
+    report = context.bot_data["pressure"].report()
+    outbox = context.bot_data.get("outbox")
+    if outbox:
+        report += f"\nНеотправленных записей outbox: {outbox.pending_count()}"
+    scheduler = context.bot_data.get("scheduler")
+    if scheduler is not None:
+        report += f"\nЗаданий в планировщике: {len(scheduler)}"
+    await context.bot.send_message(chat_id=chat_id, text=report)
+
+async def profile_command(update: Update, context: CallbackContext) -> None:
+    """
+    Включает статистический профилировщик на заданное число секунд.
+    
+    Использование: /profile [секунды], по умолчанию 10. Стеки пишутся в
+    LOG_DIR в формате collapsed stacks, в чат приходит сводка.
+    """
+    from .profiler import MAX_SECONDS, profiler, write_collapsed
+    
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # Проверяем права администратора
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для выполнения этой команды."
+        )
+        return
+    
+    try:
+        seconds = float(context.args[0]) if context.args else 10.0
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= MAX_SECONDS:
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ Укажите длительность от 1 до {MAX_SECONDS} секунд: /profile 10")
+        return
+    
+    if profiler.running:
+        await context.bot.send_message(chat_id=chat_id, text="⚠️ Профилирование уже идет, дождитесь результата.")
+        return
+    
+    profiler.start()
+    logger.info(f"Администратор {user_id} включил профилирование на {seconds:.0f} с")
+    await context.bot.send_message(chat_id=chat_id, text=f"🔬 Профилирование на {seconds:.0f} с...")
+    
+    async def finish() -> None:
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            result = profiler.stop()
+        # Задачу никто не ждет: без этого ее исключение попало бы в лог только при сборке мусора
+        try:
+            try:
+                path = await asyncio.to_thread(write_collapsed, result, config.LOG_DIR)
+                footer = f"\n\nСтеки: {path}"
+            except OSError as e:
+                logger.error(f"Не удалось записать профиль: {e}")
+                footer = f"\n\n❌ Стеки не записаны: {e}"
+            report = result.summary()
+            await context.bot.send_message(chat_id=chat_id, text=report[:TELEGRAM_MESSAGE_LIMIT - len(footer)] + footer)
+        except Exception as e:
+            logger.error(f"Ошибка отправки результата профилирования администратору {user_id}: {e}", exc_info=True)
+    
+    # Ответ приходит из отдельной задачи, чтобы хендлер не держал очередь обновлений
+    context.bot_data["profile_task"] = asyncio.ensure_future(finish())
+
+async def memstats_command(update: Update, context: CallbackContext) -> None:
+    """
+    Показывает размеры хранилищ в памяти и рост памяти по данным tracemalloc.
+    
+    Использование: /memstats - замерить сейчас, /memstats reset - сделать
+    следующий снимок tracemalloc базовым.
+    """
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    
+    # Проверяем права администратора
+    if not check_admin(user_id):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ У вас нет прав для выполнения этой команды."
+        )
+        return
+    
+    memory = context.bot_data.get("memory")
+    if memory is None:
+        await context.bot.send_message(chat_id=chat_id, text="❌ Учет памяти не запущен.")
+        return
+    
+    if context.args and context.args[0] == "reset":
+        memory.reset_baseline()
+        await context.bot.send_message(chat_id=chat_id, text="✅ Базовым станет следующий снимок памяти.")
+        return
+    
+    await memory.collect()
+    await context.bot.send_message(chat_id=chat_id, text=memory.report()[:TELEGRAM_MESSAGE_LIMIT])
+
+def build_inline_results(text: str) -> List[InlineQueryResultArticle]:
+    """
+    Рендерит текст во всех форматах для inline-превью.
+    
+    Args:
+        text: Текст inline-запроса
+        
+    Returns:
+        List[InlineQueryResultArticle]: По одному результату на формат
+    """
+    results = []
+    for format_type, title in INLINE_FORMATS:
+        try:
+            formatted = format_message(text, format_type)
+        except Exception as e:
+            logger.warning(f"Inline-превью: ошибка рендеринга в формате {format_type}: {e}")
+            continue
+        if not formatted:
+            continue
+        formatted, parse_mode, _ = prepare_html(formatted[:TELEGRAM_MESSAGE_LIMIT])
+        description = to_plain_text(formatted) if parse_mode else formatted
+        results.append(InlineQueryResultArticle(
+            id=format_type,
+            title=title,
+            description=description[:100],
+            input_message_content=InputTextMessageContent(
+                formatted, parse_mode=parse_mode, disable_web_page_preview=True
+            ),
+        ))
+    return results
+
+def plain_inline_result(text: str) -> List[InlineQueryResultArticle]:
+    """Результат без рендеринга на случай, если рендеринг не уложился во время."""
+    return [InlineQueryResultArticle(
+        id="raw",
+        title="Простой текст",
+        description=text[:100],
+        input_message_content=InputTextMessageContent(text, disable_web_page_preview=True),
+    )]
+
+async def inline_query(update: Update, context: CallbackContext) -> None:
+    """
+    Превью форматирования по запросу `@bot текст` в любом чате.
+    
+    Telegram присылает запрос на каждое нажатие клавиши, поэтому промахи кеша
+    ждут `INLINE_DEBOUNCE` секунд и рендерятся только если за это время не пришел
+    более новый запрос того же пользователя. Рендеринг идет в отдельном потоке
+    с ограничением по времени, результат кешируется по тексту запроса.
+    """
+    query = update.inline_query
+    user_id = query.from_user.id
+    text = query.query.strip()
+    
+    # Превью доступно только администраторам
+    if not check_admin(user_id) or not text:
+        await query.answer([], cache_time=60, is_personal=True)
+        return
+    
+    cfg = get_config()
+    key = (cfg.TENANT, text, cfg.version)
+    results = inline_cache.get(key)
+    if results is None:
+        sequence = inline_sequence.get(user_id, 0) + 1
+        inline_sequence[user_id] = sequence
+        
+        await asyncio.sleep(config.INLINE_DEBOUNCE)
+        if inline_sequence.get(user_id) != sequence:
+            metrics.INLINE_QUERIES.inc(result="superseded")
+            return
+        
+        pressure = context.bot_data.get("pressure")
+        if pressure is not None and pressure.saturated(RENDER):
+            # Потоки рендеринга заняты: отвечаем без рендеринга и не ставим новый в очередь
+            pressure.note(RENDER, "degraded")
+            metrics.INLINE_QUERIES.inc(result="degraded")
+            await query.answer(plain_inline_result(text), cache_time=5, is_personal=True)
+            return
+        
+        def render() -> List[InlineQueryResultArticle]:
+            if pressure is None:
+                return build_inline_results(text)
+            # Рендеринг учитывается, пока поток работает, даже если ответ уже ушел по таймауту
+            with pressure.rendering():
+                return build_inline_results(text)
+        
+        try:
+            results = await asyncio.wait_for(asyncio.to_thread(render), INLINE_RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Inline-превью не уложилось в {INLINE_RENDER_TIMEOUT} с, отвечаем простым текстом")
+            metrics.INLINE_QUERIES.inc(result="timeout")
+            results = plain_inline_result(text)
+        else:
+            inline_cache[key] = results
+            if len(inline_cache) > INLINE_CACHE_SIZE:
+                inline_cache.popitem(last=False)
+            metrics.INLINE_QUERIES.inc(result="rendered")
+        
+        # Пока шел рендеринг, пользователь мог продолжить ввод
+        if inline_sequence.get(user_id) != sequence:
+            metrics.INLINE_QUERIES.inc(result="superseded")
+            return
+    else:
+        inline_cache.move_to_end(key)
+        metrics.INLINE_QUERIES.inc(result="cached")
+    
+    try:
+        await query.answer(results, cache_time=30, is_personal=True)
+    except BadRequest as e:
+        # Запрос мог устареть, пока пользователь печатал
+        logger.debug(f"Не удалось ответить на inline-запрос: {e}")
+
 async def error_handler(update: Update, context: CallbackContext) -> None:
     """Обрабатывает ошибки."""
     error = context.error
     logger.error(msg=f"Произошла ошибка: {error}", exc_info=True)
+    metrics.ERRORS.inc(type=type(error).__name__)
     
     try:
         if update and update.effective_chat:
@@ -594,14 +1867,16 @@ async def error_handler(update: Update, context: CallbackContext) -> None:
             
             # Для админов показываем более подробную информацию
             user_id = update.effective_user.id if update.effective_user else None
-            if user_id and user_id in ADMIN_IDS:
+            if user_id and check_admin(user_id):
+                from .memstats import describe_mapping
                 error_message += f"\n\nДетали ошибки: {str(error)}"
                 
-                # Добавляем информацию о контексте
+                # Добавляем информацию о контексте: только ключи и размеры, содержимое
+                # (черновики целиком) раздувало бы сообщение и копию в памяти
                 if hasattr(context, 'chat_data') and context.chat_data:
-                    error_message += f"\n\nДанные чата: {str(context.chat_data)}"
+                    error_message += f"\n\nДанные чата: {describe_mapping(context.chat_data)}"
                 if hasattr(context, 'user_data') and context.user_data:
-                    error_message += f"\n\nДанные пользователя: {str(context.user_data)}"
+                    error_message += f"\n\nДанные пользователя: {describe_mapping(context.user_data)}"
              
             await context.bot.send_message(
                 chat_id=chat_id,
@@ -625,18 +1900,47 @@ def setup_handlers(application: Application) -> None:
     # Регистрируем обработчики команд для администраторов
     application.add_handler(CommandHandler("test", test_mode))
     application.add_handler(CommandHandler("setformat", set_format))
+    application.add_handler(CommandHandler("dryrun", dry_run_command))  # Пробный рендеринг без отправки
     application.add_handler(CommandHandler("send", send_to_channel))  # Команда для отправки в канал
     application.add_handler(CommandHandler("channels", check_channels))  # Команда для проверки каналов
+    application.add_handler(CommandHandler("reload", reload_command))  # Перезагрузка конфигурации
+    application.add_handler(CommandHandler("schedule", schedule_command))  # Отложенная публикация
+    application.add_handler(CommandHandler("scheduled", scheduled_command))
+    application.add_handler(CommandHandler("unschedule", unschedule_command))
+    application.add_handler(CommandHandler("digest", digest_command))  # Режим дайджеста
+    application.add_handler(CommandHandler("edit", edit_command))  # Правка опубликованного поста
+    application.add_handler(CommandHandler("health", health_command))  # Состояние цикла событий
+    application.add_handler(CommandHandler("pressure", pressure_command))  # Заполнение очередей конвейера
+    application.add_handler(CommandHandler("profile", profile_command))  # Профилирование работающего процесса
+    application.add_handler(CommandHandler("memstats", memstats_command))  # Учет памяти и поиск утечек
     
     # Регистрируем обработчик для кнопок
     application.add_handler(CallbackQueryHandler(button_handler))
     
+    # Inline-превью форматирования; block=False, чтобы ожидание debounce не задерживало другие обновления
+    application.add_handler(InlineQueryHandler(inline_query, block=False))
+    
     # Регистрируем обработчик для обычных текстовых сообщений
     #application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
     # Для полного решения можно заменить верхнюю строку на:
     application.add_handler(MessageHandler((filters.TEXT | filters.CAPTION) & ~filters.COMMAND, handle_all_messages))
     
+    # Оборачиваем все хендлеры для сбора метрик
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = instrumented(handler.callback)
+    
+    # Раньше всех хендлеров отбрасываем обновления, обработанные до перезапуска
+    application.add_handler(TypeHandler(Update, skip_processed_update), group=-100)
+    
+    # Затем обновления не от администраторов: до разбора текста и рендеринга
+    application.bot_data.setdefault("admission", AdmissionGuard(config.ADMISSION_RATE, config.ADMISSION_BURST))
+    application.bot_data.setdefault("pressure", Backpressure(
+        application, config.RECEIVE_HIGH_WATER, config.RENDER_HIGH_WATER, config.SEND_HIGH_WATER
+    ))
+    application.add_handler(TypeHandler(Update, admission_filter), group=-1)
+    
     # Регистрируем обработчик ошибок
     application.add_error_handler(error_handler)
     
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from telegram import Bot, ChatMember
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+ChatId = Union[int, str]
+
+
+@dataclass
+class ChannelInfo:
+    """Сведения о канале и правах бота в нем."""
+
+    chat_id: ChatId
+    title: Optional[str] = None
+    type: Optional[str] = None
+    status: Optional[str] = None        # Статус бота в чате: administrator, member, left...
+    can_post: Optional[bool] = None     # Может ли бот публиковать сообщения
+    error: Optional[str] = None         # Ошибка Telegram при проверке
+    checked_at: float = 0.0
+
+    @property
+    def can_publish(self) -> bool:
+        return self.error is None and self.can_post is not False
+
+    @property
+    def reason(self) -> Optional[str]:
+        """Почему бот не может публиковать в чате (None, если может)."""
+        if self.error:
+            return f"ошибка доступа ({self.error})"
+        if self.can_post is False:
+            return "нет прав на отправку сообщений"
+        return None
+
+    def describe(self) -> str:
+        """Статус для пользователя."""
+        if self.error:
+            return f"❌ Ошибка доступа ({self.error})"
+        if self.can_post is False:
+            return "⚠️ Нет прав на отправку сообщений"
+        return "✅ Доступен"
+
+
+def _can_post(chat_type: str, member: ChatMember) -> bool:
+    if member.status in (ChatMember.LEFT, ChatMember.BANNED):
+        return False
+    if chat_type == "channel":
+        # В канале публикуют только владелец и администраторы с правом публикации
+        return member.status == ChatMember.OWNER or bool(getattr(member, "can_post_messages", False))
+    if member.status == ChatMember.RESTRICTED:
+        return bool(getattr(member, "can_send_messages", True))
+    return True
+
+
+class ChannelInfoCache:
+    """
+    Кеш сведений о каналах с TTL.
+
+    Одновременные запросы одного канала объединяются в один обход API
+    (get_chat и get_chat_member идут параллельно). Фоновая задача заранее
+    обновляет сведения о всех настроенных каналах, поэтому при публикации
+    права проверяются по кешу без обращения к API.
+    """
+
+    def __init__(self, bot: Bot, ttl: float = 300.0, error_ttl: float = 30.0):
+        self.bot = bot
+        self.ttl = ttl
+        self.error_ttl = error_ttl  # Ошибки перепроверяем чаще: права могли выдать
+        self._entries: Dict[ChatId, ChannelInfo] = {}
+        self._inflight: Dict[ChatId, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, chat_id: ChatId) -> Optional[ChannelInfo]:
+        """Сведения из кеша без обращения к API (None, если канал еще не проверялся)."""
+        return self._entries.get(chat_id)
+
+    def is_fresh(self, info: ChannelInfo) -> bool:
+        ttl = self.error_ttl if info.error else self.ttl
+        return time.time() - info.checked_at < ttl
+
+    def invalidate(self, chat_id: ChatId) -> None:
+        self._entries.pop(chat_id, None)
+
+    async def get(self, chat_id: ChatId, refresh: bool = False) -> ChannelInfo:
+        """
+        Сведения о канале: из кеша, если они свежие, иначе из API.
+
+        Args:
+            chat_id: ID канала.
+            refresh: Не использовать кеш.
+        """
+        info = self._entries.get(chat_id)
+        if info is not None and not refresh and self.is_fresh(info):
+            metrics.CHANNEL_CHECKS.inc(result="cached")
+            return info
+
+        # Если канал уже проверяется, ждем тот же запрос
+        future = self._inflight.get(chat_id)
+        if future is None:
+            metrics.CHANNEL_CHECKS.inc(result="fetched")
+            future = asyncio.ensure_future(self._fetch(chat_id))
+            self._inflight[chat_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(chat_id, None))
+        else:
+            metrics.CHANNEL_CHECKS.inc(result="joined")
+        # shield: отмена одного из ожидающих не отменяет запрос для остальных
+        return await asyncio.shield(future)
+
+    async def get_many(self, chat_ids: Iterable[ChatId], refresh: bool = False) -> List[ChannelInfo]:
+        """Проверяет несколько каналов параллельно."""
+        return list(await asyncio.gather(*(self.get(chat_id, refresh) for chat_id in chat_ids)))
+
+    def refresh_later(self, chat_id: ChatId) -> None:
+        """
+        Перепроверяет известный кешу канал в фоне.
+
+        Вызывается, когда Telegram отклонил отправку: права могли измениться
+        раньше, чем истек TTL.
+        """
+        if chat_id in self._entries and chat_id not in self._inflight:
+            asyncio.ensure_future(self.get(chat_id, refresh=True))
+
+    async def _fetch(self, chat_id: ChatId) -> ChannelInfo:
+        info = ChannelInfo(chat_id)
+        try:
+            if isinstance(chat_id, int) and chat_id > 0:
+                # Личный чат (например, TEST_CHAT_ID): участников у него нет, писать можно всегда
+                chat = await self.bot.get_chat(chat_id)
+                info.can_post = True
+            else:
+                chat, member = await asyncio.gather(
+                    self.bot.get_chat(chat_id),
+                    self.bot.get_chat_member(chat_id=chat_id, user_id=self.bot.id),
+                )
+                info.status = str(member.status)
+                info.can_post = _can_post(chat.type, member)
+            info.title = chat.title or chat.full_name
+            info.type = str(chat.type)
+        except (Forbidden, BadRequest) as e:
+            # Бота удалили из канала, канал не найден и т.п.: публикация все равно не пройдет
+            info.error = str(e)
+        except TelegramError as e:
+            # Сбой сети, таймаут или 429 ничего не говорят о правах: кеш не трогаем,
+            # и публикация идет в API как обычно
+            logger.warning(f"Канал {chat_id} не проверен: {e}")
+            previous = self._entries.get(chat_id)
+            if previous is not None:
+                return previous
+            info.error = str(e)
+            info.checked_at = time.time()
+            return info
+        info.checked_at = time.time()
+        previous = self._entries.get(chat_id)
+        if previous is None or previous.can_publish != info.can_publish:
+            logger.info(f"Канал {chat_id}: {info.describe()}")
+        self._entries[chat_id] = info
+        return info
+
+    async def start(self, chat_ids: Callable[[], Iterable[ChatId]], interval: Optional[float] = None) -> None:
+        """
+        Запускает фоновое обновление.
+
+        Args:
+            chat_ids: Функция, возвращающая ID настроенных каналов (вызывается каждый раз,
+                чтобы учитывать перезагрузку конфигурации).
+            interval: Период обновления, по умолчанию чуть меньше TTL.
+        """
+        interval = interval or self.ttl * 0.8
+        self._task = asyncio.create_task(self._refresh_loop(chat_ids, interval))
+
+    async def _refresh_loop(self, chat_ids: Callable[[], Iterable[ChatId]], interval: float) -> None:
+        while True:
+            try:
+                await self.get_many(list(chat_ids()), refresh=True)
+            except Exception as e:
+                logger.error(f"Ошибка фонового обновления сведений о каналах: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def dump(self) -> List[Dict[str, Any]]:
+        """Содержимое для снимка теплого перезапуска."""
+        return [asdict(info) for info in self._entries.values()]
+
+    def load(self, entries: List[Dict[str, Any]]) -> int:
+        """Загружает сведения из снимка; устаревшие обновятся при первом обращении."""
+        for entry in entries:
+            info = ChannelInfo(**entry)
+            self._entries[info.chat_id] = info
+        return len(entries)
@@ -1,55 +1,378 @@
 import os
+import html
+import json
 import logging
-from dotenv import load_dotenv
+import threading
+from collections.abc import MutableMapping
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-# Загружаем переменные окружения из файла .env
-load_dotenv()
+# Путь к файлу .env, который перечитывается при горячей перезагрузке
+ENV_FILE = os.getenv("ENV_FILE", ".env")
+
+
+def utf16_len(text: str) -> int:
+    """Длина строки в единицах UTF-16, в которых Telegram считает смещения entities."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def read_environment(env_file: Optional[str] = None) -> Dict[str, str]:
+    """
+    Собирает переменные окружения с учетом файла .env.
+
+    Как и load_dotenv, переменные окружения процесса (`docker run -e`,
+    `environment:` в compose) имеют приоритет над файлом. Файл читается
+    заново при каждом вызове, поэтому перезагрузка меняет только значения,
+    которые заданы в нем, а не в окружении.
+    """
+    env = {}
+    path = env_file or ENV_FILE
+    if os.path.exists(path):
+        # dotenv нужен только при наличии файла
+        from dotenv import dotenv_values
+        env.update({key: value for key, value in dotenv_values(path).items() if value is not None})
+    env.update(os.environ)
+    return env
+
+
+def read_tenants(env: Mapping[str, str], path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Читает файл ботов, которые работают в одном процессе.
+
+    Файл в формате JSON: общие значения в "defaults", значения каждого бота
+    в "tenants" по его имени. Переменные бота накладываются на общие, а те -
+    на окружение процесса. Каталог данных по умолчанию у каждого бота свой:
+    DATA_DIR/<имя бота>.
+
+    Returns:
+        Dict[str, Dict[str, str]]: Переменные окружения каждого бота по имени.
+
+    Raises:
+        ValueError: Если файл не читается или в нем нет ботов.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Не удалось прочитать файл ботов {path}: {e}")
+
+    defaults = {key: str(value) for key, value in (data.get("defaults") or {}).items()}
+    tenants = data.get("tenants") or {}
+    if not tenants:
+        raise ValueError(f"В файле {path} не описано ни одного бота")
+
+    result = {}
+    for name, values in tenants.items():
+        values = {key: str(value) for key, value in values.items()}
+        tenant_env = {**env, **defaults, **values, "TENANT": name}
+        if "DATA_DIR" not in values:
+            tenant_env["DATA_DIR"] = os.path.join(tenant_env.get("DATA_DIR", "data"), name)
+        result[name] = tenant_env
+    return result
+
 
 class Config:
     """
-    Класс для хранения конфигурационных настроек бота.
+    Неизменяемый снимок конфигурационных настроек бота.
+
+    Каждый снимок имеет номер версии, который увеличивается при перезагрузке.
+    Подписи сообщений (HTML, простой текст и entities) вычисляются один раз
+    при создании снимка.
     """
 
-    def __init__(self):
+    def __init__(self, env: Optional[Mapping[str, str]] = None, version: int = 1):
+        if env is None:
+            env = os.environ
+
+        # Имя бота при запуске нескольких ботов в одном процессе (пусто - бот один)
+        self.TENANT = env.get("TENANT", "")
+
         # Основные настройки бота
-        self.BOT_TOKEN = os.getenv("BOT_TOKEN")
+        self.BOT_TOKEN = env.get("BOT_TOKEN")
         if not self.BOT_TOKEN:
             logger.error("BOT_TOKEN не установлен в .env файле")
             raise ValueError("BOT_TOKEN не установлен в .env файле")
 
-        self.ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
+        self.ADMIN_IDS = [int(x) for x in env.get("ADMIN_IDS", "").split(",") if x.strip()]
         if not self.ADMIN_IDS:
             logger.error("ADMIN_IDS не установлены в .env файле")
             raise ValueError("ADMIN_IDS не установлены в .env файле")
+        # Для проверки прав на каждом обновлении
+        self.ADMIN_SET = frozenset(self.ADMIN_IDS)
 
-        self.CHANNEL_ID = int(os.getenv("CHANNEL_ID", 0))
-        if self.CHANNEL_ID == 0 and not os.getenv("TEST_MODE", "false").lower() == "true":
+        # Лимит обращений обычных пользователей (только /start и /help): в секунду и запас
+        self.ADMISSION_RATE = float(env.get("ADMISSION_RATE") or 1)
+        self.ADMISSION_BURST = int(env.get("ADMISSION_BURST") or 5)
+
+        self.CHANNEL_ID = int(env.get("CHANNEL_ID") or 0)
+        if self.CHANNEL_ID == 0 and not env.get("TEST_MODE", "false").lower() == "true":
             logger.error("CHANNEL_ID не установлен в .env файле")
             raise ValueError("CHANNEL_ID не установлен в .env файле")
 
         # Настройки форматирования
-        self.DEFAULT_FORMAT = os.getenv("DEFAULT_FORMAT", "markdown")
-        self.MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 20 * 1024 * 1024))  # 20MB по умолчанию
+        self.DEFAULT_FORMAT = env.get("DEFAULT_FORMAT", "markdown")
+        self.MAX_FILE_SIZE = int(env.get("MAX_FILE_SIZE") or 20 * 1024 * 1024)  # 20MB по умолчанию
 
         # Ссылки для подписи сообщений
-        self.MAIN_BOT_NAME = os.getenv("MAIN_BOT_NAME", "Основной бот")
-        self.MAIN_BOT_LINK = os.getenv("MAIN_BOT_LINK", "")
-        self.SUPPORT_BOT_NAME = os.getenv("SUPPORT_BOT_NAME", "Техподдержка")
-        self.SUPPORT_BOT_LINK = os.getenv("SUPPORT_BOT_LINK", "")
-        self.CHANNEL_NAME = os.getenv("CHANNEL_NAME", "Канал проекта")
-        self.CHANNEL_LINK = os.getenv("CHANNEL_LINK", "")
+        self.MAIN_BOT_NAME = env.get("MAIN_BOT_NAME", "Основной бот")
+        self.MAIN_BOT_LINK = env.get("MAIN_BOT_LINK", "")
+        self.SUPPORT_BOT_NAME = env.get("SUPPORT_BOT_NAME", "Техподдержка")
+        self.SUPPORT_BOT_LINK = env.get("SUPPORT_BOT_LINK", "")
+        self.CHANNEL_NAME = env.get("CHANNEL_NAME", "Канал проекта")
+        self.CHANNEL_LINK = env.get("CHANNEL_LINK", "")
 
         # Тестовый режим
-        self.TEST_MODE = os.getenv("TEST_MODE", "false").lower() == "true"
-        self.TEST_CHAT_ID = int(os.getenv("TEST_CHAT_ID", 0))
+        self.TEST_MODE = env.get("TEST_MODE", "false").lower() == "true"
+        self.TEST_CHAT_ID = int(env.get("TEST_CHAT_ID") or 0)
 
         # Прокси (если нужен)
-        self.HTTPS_PROXY = os.getenv("HTTPS_PROXY")
+        self.HTTPS_PROXY = env.get("HTTPS_PROXY")
+
+        # Адрес Bot API (пусто - https://api.telegram.org), например локальный python -m app.fakeapi
+        self.TELEGRAM_API_URL = (env.get("TELEGRAM_API_URL") or "").rstrip("/")
 
-        logger.info("Конфигурация успешно загружена")
+        # Число процессов-воркеров (0 или 1 - все в одном процессе). Обновления распределяются по воркерам по ID чата
+        self.WORKERS = int(env.get("WORKERS") or 0)
 
-# Создаем экземпляр конфигурации
-config = Config()
\ No newline at end of file
+        # Сколько секунд при остановке дорабатывать полученные обновления; остальные сохраняются в снимок
+        self.SHUTDOWN_TIMEOUT = float(env.get("SHUTDOWN_TIMEOUT") or 8)
+
+        # Каталог для постоянных данных (outbox и т.п.)
+        self.DATA_DIR = env.get("DATA_DIR", "data")
+        self.OUTBOX_RETENTION_DAYS = int(env.get("OUTBOX_RETENTION_DAYS") or 30)
+
+        # Окно подавления повторных публикаций (секунды, 0 - выключено)
+        self.DEDUP_WINDOW = int(env.get("DEDUP_WINDOW") or 300)
+        self.DEDUP_MAX_KEYS = int(env.get("DEDUP_MAX_KEYS") or 10000)
+
+        # Режим дайджеста: короткие посты, пришедшие в пределах окна, объединяются в одно сообщение
+        self.DIGEST_MODE = env.get("DIGEST_MODE", "false").lower() == "true"
+        self.DIGEST_WINDOW = int(env.get("DIGEST_WINDOW") or 60)
+
+        # true - черновики администраторов ждут кнопки «Опубликовать» (рядом - «Запланировать»);
+        # по умолчанию публикуются сразу после получения
+        self.DRAFT_CONFIRM = env.get("DRAFT_CONFIRM", "false").lower() == "true"
+
+        # Задержка перед рендерингом inline-превью (секунды): пока пользователь печатает, запросы отбрасываются
+        self.INLINE_DEBOUNCE = float(env.get("INLINE_DEBOUNCE") or 0.3)
+
+        # Отметки заполнения конвейера (0 - без ограничения): обновлений в очереди приема,
+        # одновременных рендерингов и запросов, ждущих лимитов отправки
+        self.RECEIVE_HIGH_WATER = int(env.get("RECEIVE_HIGH_WATER") or 200)
+        self.RENDER_HIGH_WATER = int(env.get("RENDER_HIGH_WATER") or 4)
+        self.SEND_HIGH_WATER = int(env.get("SEND_HIGH_WATER") or 100)
+
+        # Сколько секунд считать свежими сведения о каналах и правах бота (обновляются в фоне)
+        self.CHANNEL_INFO_TTL = float(env.get("CHANNEL_INFO_TTL") or 300)
+
+        # Каталог логов
+        self.LOG_DIR = env.get("LOG_DIR", "/opt/telegram-publisher-bot/logs")
+
+        # Трассировка обновлений: доля трассируемых обновлений (0 - выключено) и файл трасс
+        self.TRACE_SAMPLE_RATE = float(env.get("TRACE_SAMPLE_RATE") or 0)
+        self.TRACE_FILE = env.get("TRACE_FILE") or os.path.join(self.LOG_DIR, "traces.jsonl")
+
+        # Сторож цикла событий: бюджет времени хендлера и допустимая задержка цикла (секунды)
+        self.HANDLER_BUDGET = float(env.get("HANDLER_BUDGET") or 1.0)
+        self.LOOP_LAG_THRESHOLD = float(env.get("LOOP_LAG_THRESHOLD") or 0.25)
+
+        # Учет памяти: период замера хранилищ (секунды, 0 - только по /memstats)
+        # и поиск утечек через tracemalloc (замедляет выделение памяти, по умолчанию выключен)
+        self.MEMSTATS_INTERVAL = float(env.get("MEMSTATS_INTERVAL") or 300)
+        self.MEMORY_TRACE = env.get("MEMORY_TRACE", "false").lower() == "true"
+
+        # HTTP-эндпоинт метрик в формате Prometheus (0 - выключен)
+        self.METRICS_HOST = env.get("METRICS_HOST", "127.0.0.1")
+        self.METRICS_PORT = int(env.get("METRICS_PORT") or 0)
+
+        # Версия снимка и предвычисленные подписи
+        self.version = version
+        self.footer_html, self.footer_plain, self.footer_entities = self._build_footers()
+
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError("Снимок конфигурации неизменяем, используйте reload_config()")
+        object.__setattr__(self, name, value)
+
+    def _footer_links(self) -> Tuple[Tuple[str, str], ...]:
+        """Пары (название, ссылка) для подписи в порядке: PUBLIC | VPNLine | SUPPORT."""
+        pairs = (
+            (self.CHANNEL_NAME, self.CHANNEL_LINK),
+            (self.MAIN_BOT_NAME, self.MAIN_BOT_LINK),
+            (self.SUPPORT_BOT_NAME, self.SUPPORT_BOT_LINK),
+        )
+        return tuple((name, url) for name, url in pairs if name and url)
+
+    def _build_footers(self) -> Tuple[str, str, Tuple[Dict[str, object], ...]]:
+        """
+        Строит подпись сообщений в трех формах.
+
+        Returns:
+            Tuple: HTML-подпись, подпись простым текстом и entities типа text_link
+            со смещениями в единицах UTF-16 относительно начала подписи.
+        """
+        html_parts = []
+        plain_parts = []
+        entities = []
+        offset = 0
+        separator = ' | '
+
+        for name, url in self._footer_links():
+            if plain_parts:
+                offset += utf16_len(separator)
+            html_parts.append(f'<a href="{html.escape(url)}">{html.escape(name)}</a>')
+            plain_parts.append(name)
+            length = utf16_len(name)
+            entities.append({"type": "text_link", "offset": offset, "length": length, "url": url})
+            offset += length
+
+        return separator.join(html_parts), separator.join(plain_parts), tuple(entities)
+
+
+class _ConfigProxy:
+    """
+    Прокси на актуальный снимок конфигурации.
+
+    Позволяет модулям использовать `config.CHANNEL_ID` и т.п. и при этом
+    видеть новые значения после перезагрузки. Если в процессе работает
+    несколько ботов, прокси отдает снимок бота, в контексте которого
+    выполняется код.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_config(), name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Снимок конфигурации неизменяем, используйте reload_config()")
+
+
+def _load(env_file: Optional[str] = None, version: int = 1) -> Tuple[Config, Dict[str, Config]]:
+    """Создает снимок процесса и снимки ботов из файла TENANTS_FILE (если он задан)."""
+    env = read_environment(env_file)
+    tenants_file = env.get("TENANTS_FILE")
+    if not tenants_file:
+        return Config(env, version), {}
+
+    tenants = {name: Config(tenant_env, version) for name, tenant_env in read_tenants(env, tenants_file).items()}
+    tokens = [snapshot.BOT_TOKEN for snapshot in tenants.values()]
+    if len(set(tokens)) != len(tokens):
+        raise ValueError(f"В файле {tenants_file} у нескольких ботов один BOT_TOKEN")
+    # Общие для процесса настройки (логи, метрики, трассировка, сторож) берутся у первого бота
+    return next(iter(tenants.values())), tenants
+
+
+# Бот, в контексте которого выполняется код (None - снимок процесса)
+_current_tenant: ContextVar[Optional[str]] = ContextVar("current_tenant", default=None)
+
+_reload_lock = threading.RLock()
+
+# Первый снимок создается при первом обращении к конфигурации, а не при импорте:
+# модули рендеринга можно импортировать без .env, а запуск не ждет разбора файла раньше времени
+_current: Optional[Config] = None
+_tenants: Dict[str, Config] = {}
+
+config = _ConfigProxy()
+
+
+def _ensure_loaded() -> Config:
+    """Загружает переменные окружения из файла .env и создает первый снимок."""
+    global _current, _tenants
+    with _reload_lock:
+        if _current is None:
+            snapshot, _tenants = _load()
+            _current = snapshot
+            logger.info("Конфигурация успешно загружена" + (f", ботов: {len(_tenants)}" if _tenants else ""))
+    return _current
+
+
+def get_config() -> Config:
+    """Возвращает текущий снимок конфигурации (бота из текущего контекста, если ботов несколько)."""
+    current = _current or _ensure_loaded()
+    tenant = _current_tenant.get()
+    if tenant is not None:
+        return _tenants[tenant]
+    return current
+
+
+def tenant_names() -> List[str]:
+    """Имена ботов из TENANTS_FILE (пустой список, если бот один)."""
+    _ensure_loaded()
+    return list(_tenants)
+
+
+def current_tenant() -> Optional[str]:
+    return _current_tenant.get()
+
+
+def use_tenant(name: str) -> None:
+    """
+    Привязывает текущий контекст к боту.
+
+    Вызывается в начале задачи, которая запускает Application бота: задачи,
+    которые она создает (получение обновлений, хендлеры, планировщик),
+    наследуют контекст и видят конфигурацию и состояние своего бота.
+    """
+    _ensure_loaded()
+    if name not in _tenants:
+        raise KeyError(f"Бот {name} не описан в TENANTS_FILE")
+    _current_tenant.set(name)
+
+
+class TenantLocal(MutableMapping):
+    """
+    Словарь, у которого для каждого бота свое содержимое.
+
+    Позволяет модульным хранилищам вроде `user_states` оставаться словарями:
+    одни и те же пользователи Telegram пишут разным ботам, и их состояния
+    не должны смешиваться.
+    """
+
+    def __init__(self):
+        self._data: Dict[Optional[str], Dict[Any, Any]] = {}
+
+    def _current(self) -> Dict[Any, Any]:
+        return self._data.setdefault(_current_tenant.get(), {})
+
+    def __getitem__(self, key):
+        return self._current()[key]
+
+    def __setitem__(self, key, value):
+        self._current()[key] = value
+
+    def __delitem__(self, key):
+        del self._current()[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self._current())
+
+    def __len__(self) -> int:
+        return len(self._current())
+
+    def total_size(self) -> int:
+        """Количество записей у всех ботов."""
+        return sum(len(data) for data in self._data.values())
+
+
+def reload_config(env_file: Optional[str] = None) -> Config:
+    """
+    Атомарно перечитывает .env и заменяет текущий снимок конфигурации.
+
+    Обработчики, которые уже получили старый снимок, дорабатывают с ним.
+    При ошибке валидации текущий снимок остается без изменений.
+
+    Raises:
+        ValueError: Если новая конфигурация некорректна.
+    """
+    global _current, _tenants
+    with _reload_lock:
+        snapshot, tenants = _load(env_file, version=_ensure_loaded().version + 1)
+        if set(tenants) != set(_tenants):
+            raise ValueError("Изменился состав ботов в TENANTS_FILE, для этого нужен перезапуск")
+        _current, _tenants = snapshot, tenants
+    logger.info(f"Конфигурация перезагружена, версия {snapshot.version}")
+    return get_config()
@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(target_chat_id: int, text: str) -> int:
+    """
+    Компактный ключ идемпотентности: 64-битный хеш пары (чат, отрендеренный текст).
+
+    Args:
+        target_chat_id: ID целевого чата.
+        text: Отрендеренный текст сообщения.
+
+    Returns:
+        int: 64-битный ключ.
+    """
+    digest = hashlib.blake2b(f"{target_chat_id}\x00{text}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class DedupWindow:
+    """
+    Окно подавления дубликатов публикаций.
+
+    Ключи хранятся в двух поколениях: текущем и предыдущем. Когда текущее
+    поколение старше окна или переполнено, оно становится предыдущим,
+    а старое предыдущее отбрасывается. Так память ограничена 2 * max_keys
+    ключами, каждый ключ живет не меньше окна (если поколение не переполнилось
+    раньше), а время публикации хранится точно, поэтому ложных срабатываний нет.
+    """
+
+    def __init__(self, window: float, max_keys: int = 10000):
+        self.window = window
+        self.max_keys = max_keys
+        self._current: Dict[int, float] = {}
+        self._previous: Dict[int, float] = {}
+        self._rotated_at = time.monotonic()
+        # Ключи, отправка которых еще не завершилась
+        self._reserved: Dict[int, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous) + len(self._reserved)
+
+    def _rotate(self, now: float) -> None:
+        if now - self._rotated_at >= self.window or len(self._current) >= self.max_keys:
+            self._previous = self._current
+            self._current = {}
+            self._rotated_at = now
+
+    def _seen_at(self, key: int) -> Optional[float]:
+        for generation in (self._reserved, self._current, self._previous):
+            seen_at = generation.get(key)
+            if seen_at is not None:
+                return seen_at
+        return None
+
+    def reserve(self, key: int) -> bool:
+        """
+        Резервирует ключ перед отправкой.
+
+        Проверка и резервирование выполняются без await, поэтому два
+        одновременных нажатия не могут оба пройти проверку.
+
+        Returns:
+            bool: False, если такая публикация уже была в пределах окна.
+        """
+        if not self.enabled:
+            return True
+
+        now = time.monotonic()
+        self._rotate(now)
+        seen_at = self._seen_at(key)
+        if seen_at is not None and now - seen_at < self.window:
+            return False
+
+        self._reserved[key] = now
+        return True
+
+    def commit(self, key: int) -> None:
+        """Подтверждает резервирование после успешной отправки."""
+        seen_at = self._reserved.pop(key, None)
+        if self.enabled:
+            self._current[key] = seen_at if seen_at is not None else time.monotonic()
+
+    def release(self, key: int) -> None:
+        """Снимает резервирование, если отправка не удалась, чтобы ее можно было повторить."""
+        self._reserved.pop(key, None)
+
+    def remember(self, key: int, age: float = 0.0) -> None:
+        """Добавляет ключ уже состоявшейся публикации (например, из outbox после перезапуска)."""
+        if self.enabled and age < self.window:
+            self._current[key] = time.monotonic() - age
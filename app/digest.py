@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from . import tracing
+from .utils import TELEGRAM_MESSAGE_LIMIT, visible_length
+
+logger = logging.getLogger(__name__)
+
+# Разделитель между постами внутри дайджеста
+DIGEST_SEPARATOR = "\n\n➖➖➖\n\n"
+
+# (целевой чат, тексты постов, чаты авторов, ID постов в outbox)
+FlushCallback = Callable[[int, List[str], List[int], List[int]], Awaitable[None]]
+
+
+class _Pending:
+    """Накопленные посты для одного целевого чата."""
+
+    def __init__(self):
+        self.bodies: List[str] = []
+        self.origin_chat_ids: List[int] = []
+        self.post_ids: List[int] = []
+        self.length = 0
+        self.timer: Optional[asyncio.Task] = None
+
+
+class DigestBuffer:
+    """
+    Буфер режима дайджеста.
+
+    Посты для одного чата, пришедшие в пределах окна, копятся и затем
+    публикуются одним сообщением с одной подписью. Буфер сбрасывается, когда
+    закрывается окно (отсчитывается от первого поста) или когда следующий
+    пост не помещается в лимит длины сообщения. Сам буфер живет в памяти:
+    посты сохраняет вызывающий код (в outbox) и после перезапуска добавляет
+    их снова с исходным временем поступления.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        flush: FlushCallback,
+        limit: int = TELEGRAM_MESSAGE_LIMIT,
+        separator: str = DIGEST_SEPARATOR
+    ):
+        self.window = window
+        self.limit = limit
+        self.separator = separator
+        self._flush = flush
+        self._separator_length = visible_length(separator)
+        self._pending: Dict[int, _Pending] = {}
+
+    def __len__(self) -> int:
+        """Количество постов, ожидающих публикации."""
+        return sum(len(pending.bodies) for pending in self._pending.values())
+
+    def size(self, target_chat_id: int) -> int:
+        """Количество постов в буфере чата."""
+        pending = self._pending.get(target_chat_id)
+        return len(pending.bodies) if pending else 0
+
+    async def add(
+        self,
+        target_chat_id: int,
+        body: str,
+        origin_chat_id: int,
+        reserve: int = 0,
+        post_id: Optional[int] = None,
+        created_at: Optional[float] = None
+    ) -> None:
+        """
+        Добавляет отрендеренный пост (без подписи) в буфер чата.
+
+        Args:
+            target_chat_id: ID целевого чата.
+            body: HTML-текст поста без подписи.
+            origin_chat_id: ID чата автора для уведомлений.
+            reserve: Длина, которую нужно оставить под подпись.
+            post_id: ID сохраненного поста в outbox.
+            created_at: Время поступления поста (unix time), если он восстановлен после перезапуска.
+        """
+        length = visible_length(body)
+        pending = self._pending.get(target_chat_id)
+
+        if pending and pending.length + self._separator_length + length + reserve > self.limit:
+            await self.flush(target_chat_id)
+            pending = None
+
+        if pending is None:
+            pending = _Pending()
+            self._pending[target_chat_id] = pending
+            # Окно отсчитывается от поступления первого поста, в том числе до перезапуска
+            delay = self.window - (time.time() - created_at) if created_at is not None else self.window
+            pending.timer = asyncio.create_task(self._flush_later(target_chat_id, pending, max(delay, 0.0)))
+        else:
+            pending.length += self._separator_length
+
+        pending.bodies.append(body)
+        pending.origin_chat_ids.append(origin_chat_id)
+        if post_id is not None:
+            pending.post_ids.append(post_id)
+        pending.length += length
+
+        # Пост, который сам по себе заполняет сообщение, ждать нет смысла
+        if pending.length + reserve >= self.limit:
+            await self.flush(target_chat_id)
+
+    async def _flush_later(self, target_chat_id: int, pending: _Pending, delay: float) -> None:
+        # Задача переживает обновление, которое ее создало: участки публикации не относятся к его трассе
+        tracing.detach()
+        await asyncio.sleep(delay)
+        if self._pending.get(target_chat_id) is pending:
+            pending.timer = None
+            await self.flush(target_chat_id)
+
+    async def flush(self, target_chat_id: int) -> None:
+        """Публикует накопленные посты чата одним сообщением."""
+        pending = self._pending.pop(target_chat_id, None)
+        if pending is None:
+            return
+        if pending.timer is not None and pending.timer is not asyncio.current_task():
+            pending.timer.cancel()
+
+        try:
+            await self._flush(target_chat_id, pending.bodies, pending.origin_chat_ids, pending.post_ids)
+        except Exception as e:
+            logger.error(f"Ошибка публикации дайджеста в чат {target_chat_id}: {e}", exc_info=True)
+
+    async def close(self) -> None:
+        """Публикует все накопленные дайджесты (при остановке бота)."""
+        for target_chat_id in list(self._pending):
+            await self.flush(target_chat_id)
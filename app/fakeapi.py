@@ -0,0 +1,401 @@
+"""
+Локальный поддельный сервер Bot API для нагрузочного тестирования на уровне сети.
+
+Реализует подмножество методов, которые использует бот, поверх HTTP/1.1 с
+keep-alive, поэтому нагрузка проходит через настоящий HTTP-клиент бота: пул
+соединений, таймауты и прокси. Поддерживает задержку ответа, внедрение ошибок
+(429 с retry_after и 400 can't parse entities) и запись запросов.
+
+Запуск сервера:  python -m app.fakeapi --port 8081 --latency 0.05 --updates 1000
+Запуск бота:     TELEGRAM_API_URL=http://127.0.0.1:8081 python -m app
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter, deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+BOT_ID = 1
+BOT_USER = {"id": BOT_ID, "is_bot": True, "first_name": "FakeBot", "username": "fake_publisher_bot"}
+
+# Методы, для которых достаточно ответа True
+NOOP_METHODS = {
+    "deleteWebhook", "setWebhook", "answerCallbackQuery", "answerInlineQuery", "setMyCommands",
+    "deleteMessage", "sendChatAction", "close", "logOut",
+}
+
+# Методы, в которых Telegram разбирает разметку и может ответить "can't parse entities"
+PARSE_METHODS = {"sendMessage", "editMessageText", "copyMessage", "sendMediaGroup"}
+
+
+class ApiError(Exception):
+    """Ответ Bot API с ошибкой."""
+
+    def __init__(self, code: int, description: str, parameters: Optional[Dict[str, Any]] = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.parameters = parameters
+
+
+def _parse_body(headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    """Разбирает параметры запроса: JSON, x-www-form-urlencoded или multipart/form-data."""
+    content_type = headers.get("content-type", "")
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and part.get_filename() is None:
+                params[name] = part.get_content()
+            elif name:
+                params[name] = f"<файл {part.get_filename()}>"
+        return params
+    return dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+
+
+def _json_param(params: Dict[str, Any], name: str, default: Any = None) -> Any:
+    """Значение параметра; вложенные объекты клиент передает строкой JSON."""
+    value = params.get(name, default)
+    if isinstance(value, str) and value[:1] in ("[", "{"):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    return value
+
+
+def _chat_id(params: Dict[str, Any]) -> Any:
+    value = params.get("chat_id", 0)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value  # @username канала
+
+
+class FakeBotAPI:
+    """
+    Поддельный сервер Bot API.
+
+    Args:
+        latency: Задержка ответа, секунды.
+        jitter: Случайная добавка к задержке, секунды.
+        rate_429: Доля запросов, на которые отвечать 429 Too Many Requests.
+        retry_after: Значение retry_after в ответе 429.
+        rate_parse_error: Доля запросов с разметкой, на которые отвечать 400 can't parse entities.
+        record_path: JSONL-файл для записи всех запросов.
+        history: Сколько последних запросов хранить в памяти.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        rate_parse_error: float = 0.0,
+        record_path: Optional[str] = None,
+        history: int = 1000
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rate_parse_error = rate_parse_error
+        self.record_path = record_path
+        self.requests: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.connections = 0
+        self.started_at = time.monotonic()
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._next_update_id = 1
+        self._message_ids: Dict[Any, int] = {}
+        self._record_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> None:
+        if self.record_path:
+            self._record_file = open(self.record_path, "a", encoding="utf-8")
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Поддельный Bot API слушает http://{host}:{port}")
+
+    async def close(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._record_file:
+            self._record_file.close()
+            self._record_file = None
+
+    def add_update(self, update: Dict[str, Any]) -> int:
+        """Ставит обновление в очередь getUpdates и возвращает его update_id."""
+        update = dict(update, update_id=self._next_update_id)
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._new_updates.set()
+        return update["update_id"]
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "channel"
+        message = {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": chat_type}}
+        if chat_type == "channel":
+            message["chat"]["title"] = f"Channel {chat_id}"
+        else:
+            message["chat"]["first_name"] = f"User{chat_id}"
+        message.update({k: v for k, v in fields.items() if v is not None})
+        return message
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        # Подтвержденные клиентом обновления больше не отдаем
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _dispatch(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method in NOOP_METHODS:
+            return True
+
+        if method in PARSE_METHODS and self.rate_parse_error and random.random() < self.rate_parse_error:
+            raise ApiError(400, "Bad Request: can't parse entities: Can't find end tag corresponding to start tag \"b\"")
+
+        chat_id = _chat_id(params)
+        if method == "sendMessage":
+            return self._message(chat_id, text=params.get("text", ""))
+        if method == "editMessageText":
+            if params.get("inline_message_id"):
+                return True
+            message = self._message(chat_id, text=params.get("text", ""))
+            message["message_id"] = int(params.get("message_id") or message["message_id"])
+            message["edit_date"] = int(time.time())
+            return message
+        if method == "copyMessage":
+            return {"message_id": self._message(chat_id)["message_id"]}
+        if method == "sendMediaGroup":
+            media = _json_param(params, "media", [])
+            if not isinstance(media, list) or not 2 <= len(media) <= 10:
+                raise ApiError(400, "Bad Request: wrong number of messages in media group")
+            return [self._message(chat_id, caption=item.get("caption")) for item in media]
+        if method == "getChat":
+            is_channel = not (isinstance(chat_id, int) and chat_id > 0)
+            return {
+                "id": chat_id,
+                "type": "channel" if is_channel else "private",
+                "title": f"Channel {chat_id}" if is_channel else None,
+                "accent_color_id": 0,
+                "max_reaction_count": 11,
+            }
+        if method == "getChatMember":
+            user_id = int(params.get("user_id") or 0)
+            if user_id == BOT_ID:
+                # Публиковать в канале может только администратор с правом публикации
+                rights = (
+                    "can_manage_chat", "can_delete_messages", "can_manage_video_chats", "can_restrict_members",
+                    "can_promote_members", "can_change_info", "can_invite_users", "can_post_stories",
+                    "can_edit_stories", "can_delete_stories", "can_post_messages", "can_edit_messages",
+                )
+                return {
+                    "status": "administrator", "user": BOT_USER, "can_be_edited": False, "is_anonymous": False,
+                    **{right: True for right in rights},
+                }
+            user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+            return {"status": "member", "user": user}
+
+        raise ApiError(404, "Not Found: method not found")
+
+    async def _call(self, method: str, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self.calls[method] += 1
+        if method != "getUpdates":
+            delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.rate_429 and random.random() < self.rate_429:
+                self.errors[429] += 1
+                return 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+        try:
+            return 200, {"ok": True, "result": await self._dispatch(method, params)}
+        except ApiError as e:
+            self.errors[e.code] += 1
+            response = {"ok": False, "error_code": e.code, "description": e.description}
+            if e.parameters:
+                response["parameters"] = e.parameters
+            return e.code, response
+
+    def _record(self, method: str, params: Dict[str, Any], status: int, started: float) -> None:
+        entry = {
+            "time": time.time(),
+            "method": method,
+            "status": status,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            "params": params,
+        }
+        self.requests.append(entry)
+        if self._record_file:
+            self._record_file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        verb, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).strip().split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        else:
+            body = await reader.readexactly(int(headers.get("content-length") or 0))
+        return verb, target, headers, body
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                verb, target, headers, body = request
+                started = time.perf_counter()
+
+                # Путь вида /bot<token>/<method>
+                parts = target.split("?", 1)[0].strip("/").split("/")
+                if len(parts) == 2 and parts[0].startswith("bot"):
+                    method = parts[1]
+                    params = _parse_body(headers, body)
+                    if "?" in target:
+                        params.update(parse_qsl(target.split("?", 1)[1]))
+                    status, response = await self._call(method, params)
+                else:
+                    method, params = target, {}
+                    status, response = 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+                self._record(method, params, status, started)
+
+                payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Сервер остановлен, пока клиент ждал getUpdates
+            pass
+        finally:
+            writer.close()
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        total = sum(count for method, count in self.calls.items() if method != "getUpdates")
+        lines = [
+            f"Время: {elapsed:.1f} с, соединений: {self.connections}, "
+            f"запросов (без getUpdates): {total}, {total / elapsed if elapsed else 0:.1f} в секунду",
+            "Вызовы: " + ", ".join(f"{method}={count}" for method, count in self.calls.most_common()),
+        ]
+        if self.errors:
+            lines.append("Ошибки: " + ", ".join(f"{code}={count}" for code, count in sorted(self.errors.items())))
+        return "\n".join(lines)
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        rate_parse_error=args.rate_parse_error,
+        record_path=args.record,
+    )
+    await api.start(args.host, args.port)
+
+    if args.updates:
+        from .loadtest import synthetic_updates
+        for update in synthetic_updates(args.updates, users=args.users):
+            api.add_update(update)
+        logger.info(f"В очереди getUpdates {args.updates} синтетических обновлений")
+
+    try:
+        while True:
+            await asyncio.sleep(args.report_interval)
+            print(api.summary(), flush=True)
+    finally:
+        await api.close()
+        print(api.summary())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Поддельный сервер Bot API для нагрузочного тестирования")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, секунды")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, секунды")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429 Too Many Requests")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument("--rate-parse-error", type=float, default=0.0, help="Доля ответов 400 can't parse entities")
+    parser.add_argument("--record", help="JSONL-файл для записи запросов")
+    parser.add_argument("--updates", type=int, default=0, help="Сколько синтетических обновлений отдать через getUpdates")
+    parser.add_argument("--users", type=int, default=50, help="Количество синтетических пользователей")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Как часто печатать сводку, секунды")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,17 @@ from .markdown import (
     process_images  # Добавлен импорт новой функции
 )
 
+from .tracing import span
+from .validator import sanitize_html
+
 logger = logging.getLogger(__name__)  # Получаем логгер
 
 def is_html_formatted(text: str) -> bool:
     """Проверяет, содержит ли текст HTML-теги, поддерживаемые Telegram API."""
     # Обновленный список тегов в соответствии с документацией Telegram API
-    html_tags_pattern = re.compile(r'<(/?)(b|strong|i|em|u|s|strike|del|code|pre|a)(\s+[^>]*)?>')
+    html_tags_pattern = re.compile(
+        r'<(/?)(b|strong|i|em|u|ins|s|strike|del|code|pre|a|blockquote|tg-spoiler|tg-emoji|span)(\s+[^>]*)?>'
+    )
     return bool(html_tags_pattern.search(text))
 
 # Функция для восстановления маркеров Markdown из объекта entities
@@ -84,40 +89,49 @@ def recreate_markdown_from_entities(text: str, entities: list) -> str:
 def format_html(text: str) -> str:
     """Форматирует текст в HTML, поддерживаемый Telegram API."""
     if is_html_formatted(text):
-        logger.info("Обнаружена HTML-разметка, пропускаем экранирование")
+        # Оставляем только теги и атрибуты, которые понимает Telegram, остальное экранируем
+        logger.info("Обнаружена HTML-разметка, очищаем по белому списку Telegram")
+        with span("render.sanitize"):
+            text = sanitize_html(text)
     else:
         logger.info("Конвертируем разметку в HTML")
-        text = html.escape(text)
+        with span("render.escape"):
+            text = html.escape(text)
         logger.info(f"Текст после экранирования HTML: {text[:100]}...")
         
         # Сначала преобразуем списки и таблицы в простой текст
-        text = format_simple_lists(text)
-        text = format_simple_tables(text)
-        text = process_simple_horizontal_rules(text)
+        with span("render.lists_tables"):
+            text = format_simple_lists(text)
+            text = format_simple_tables(text)
+            text = process_simple_horizontal_rules(text)
         
         # Применяем форматирование, поддерживаемое Telegram
-        text = process_emoji(text)
-        text = process_bold_italic_text(text)
-        logger.info(f"После обработки супержирного: {text[:100]}...")
-        text = process_bold_text(text)
-        logger.info(f"После обработки жирного: {text[:100]}...")
-        text = process_strikethrough_text(text)
-        logger.info(f"После обработки зачеркнутого: {text[:100]}...")
-        text = process_underline_text(text)
-        text = process_italic_text(text)
-        text = process_code(text)
-        text = process_links(text)
-        text = process_headers(text)
+        with span("render.inline"):
+            text = process_emoji(text)
+            text = process_bold_italic_text(text)
+            logger.info(f"После обработки супержирного: {text[:100]}...")
+            text = process_bold_text(text)
+            logger.info(f"После обработки жирного: {text[:100]}...")
+            text = process_strikethrough_text(text)
+            logger.info(f"После обработки зачеркнутого: {text[:100]}...")
+            text = process_underline_text(text)
+            text = process_italic_text(text)
+            text = process_code(text)
+            text = process_links(text)
+        with span("render.blocks"):
+            text = process_headers(text)
         
     return text
 
-def _convert_to_html(text: str, format_type: str) -> str:
+def _convert_to_html(text: str, format_type: str, fragment: bool = False) -> str:
     """
     Внутренняя функция для конвертации текста в HTML.
     
     Args:
         text: Исходный текст.
         format_type: Тип формата (markdown, modern).
+        fragment: Текст - абзац внутри сообщения: пробелы по краям сохраняются,
+            завершающие пустые строки modern не добавляются.
     
     Returns:
         str: Отформатированный текст в HTML.
@@ -130,36 +144,41 @@ def _convert_to_html(text: str, format_type: str) -> str:
         logger.info(f"Исходный текст {format_type}: {text[:100]}...")
         
         # Шаг 1-2: Сохраняем блоки кода и inline код
-        text, code_blocks = extract_and_save_placeholders(text, r'```.*?\n.*?```')
-        text, inline_code = extract_and_save_placeholders(text, r'`[^`]+`')
+        with span("render.extract_code"):
+            text, code_blocks = extract_and_save_placeholders(text, r'```.*?\n.*?```')
+            text, inline_code = extract_and_save_placeholders(text, r'`[^`]+`')
         
         # Шаг 3: Экранируем HTML-специальные символы
-        text = html.escape(text)
+        with span("render.escape"):
+            text = html.escape(text)
         logger.info(f"После экранирования HTML: {text[:100]}...")
         
         # Обработка списков и таблиц в простой текстовый формат
-        text = format_simple_lists(text)
-        text = format_simple_tables(text)
-        text = process_simple_horizontal_rules(text)
+        with span("render.lists_tables"):
+            text = format_simple_lists(text)
+            text = format_simple_tables(text)
+            text = process_simple_horizontal_rules(text)
         
         # Шаг 4: Обрабатываем эмодзи
         text = process_emoji(text)
         
         # Шаг 5: Применяем функции форматирования
         logger.info(f"Перед обработкой форматирования {format_type}: {text[:100]}...")
-        text = process_bold_italic_text(text)
-        text = process_bold_text(text)
-        logger.info(f"После обработки жирного {format_type}: {text[:100]}...")
-        text = process_strikethrough_text(text)
-        logger.info(f"После обработки зачеркнутого {format_type}: {text[:100]}...")
-        text = process_underline_text(text)
-        text = process_italic_text(text)
-        text = process_links(text)
+        with span("render.inline"):
+            text = process_bold_italic_text(text)
+            text = process_bold_text(text)
+            logger.info(f"После обработки жирного {format_type}: {text[:100]}...")
+            text = process_strikethrough_text(text)
+            logger.info(f"После обработки зачеркнутого {format_type}: {text[:100]}...")
+            text = process_underline_text(text)
+            text = process_italic_text(text)
+            text = process_links(text)
         logger.info(f"После всей обработки форматирования {format_type}: {text[:100]}...")
         
         # Шаг 6: Обработка специальных элементов
-        text = process_headers(text)
-        text = process_quotes(text)
+        with span("render.blocks"):
+            text = process_headers(text)
+            text = process_quotes(text)
         
         # Шаг 7: Восстанавливаем код
         for placeholder, code in inline_code.items():
@@ -177,9 +196,10 @@ def _convert_to_html(text: str, format_type: str) -> str:
                 text = text.replace(placeholder, html_code_block)
         
         # Шаг 8: Форматирование текста
-        text = text.strip()
-        if format_type == "modern" and not text.endswith("\n\n"):
-            text += "\n\n"
+        if not fragment:
+            text = text.strip()
+            if format_type == "modern" and not text.endswith("\n\n"):
+                text += "\n\n"
         
         logger.info(f"Конвертация {format_type} в HTML завершена")
         return text
@@ -187,10 +207,10 @@ def _convert_to_html(text: str, format_type: str) -> str:
         logger.error(f"Ошибка преобразования {format_type} в HTML: {e}", exc_info=True)
         return text
 
-def markdown_to_html(text: str) -> str:
+def markdown_to_html(text: str, fragment: bool = False) -> str:
     """Преобразует текст в формате Markdown в HTML, поддерживаемый Telegram."""
-    return _convert_to_html(text, "markdown")
+    return _convert_to_html(text, "markdown", fragment)
 
-def modern_to_html(text: str) -> str:
+def modern_to_html(text: str, fragment: bool = False) -> str:
     """Преобразует текст в формате Modern в HTML, поддерживаемый Telegram."""
-    return _convert_to_html(text, "modern")
\ No newline at end of file
+    return _convert_to_html(text, "modern", fragment)
\ No newline at end of file
@@ -0,0 +1,341 @@
+"""
+Нагрузочный тест обработки обновлений без обращения к Telegram.
+
+Синтетические обновления (текст, entities, подписи к медиа, нажатия кнопок)
+проходят через настоящие хендлеры из setup_handlers, а запросы к Bot API
+обслуживает заглушка с имитацией задержки сети. Для каждого уровня
+конкурентности выводятся пропускная способность, перцентили задержки и рост
+памяти.
+
+Запуск: python -m app.loadtest --updates 500 --concurrency 1,4,16,64 --latency 0.02
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+logger = logging.getLogger(__name__)
+
+# Первый синтетический пользователь; остальные идут подряд
+FIRST_USER_ID = 10_000
+
+SAMPLE_TEXTS = [
+    "**Новость дня**\n\nКраткое описание с *курсивом* и ~~зачеркнутым~~ текстом.",
+    "# Заголовок\n\n- первый пункт\n- второй пункт\n- третий пункт\n\n> цитата\n\n`inline code`",
+    "Таблица:\n| Колонка | Значение |\n|---|---|\n| a | 1 |\n| b | 2 |\n\n[ссылка](https://example.com)",
+    "Простой текст без разметки, но довольно длинный. " * 20,
+    "```python\nprint('hello')\n```\n\n__подчеркнутый__ и ***жирный курсив***",
+]
+
+
+class StubRequest(BaseRequest):
+    """
+    Заглушка HTTP-слоя Bot API.
+
+    Отвечает правдоподобными результатами на методы, которые вызывает бот,
+    ждет `latency` (+ случайный `jitter`) секунд на запрос и считает вызовы.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls: Counter = Counter()
+        self.sent_bytes = 0
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._message_id += 1
+        chat_id = params.get("chat_id", 0)
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if isinstance(chat_id, int) and chat_id > 0 else "channel"},
+            "text": params.get("text", ""),
+        }
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        self.sent_bytes += len(str(params.get("text", "")).encode("utf-8"))
+
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if endpoint == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+        elif endpoint in ("sendMessage", "editMessageText", "copyMessage"):
+            result = self._message(params)
+        elif endpoint == "getChat":
+            result = {"id": params.get("chat_id", 0), "type": "channel", "title": "Load test"}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+def _entities(text: str) -> List[Dict[str, Any]]:
+    """Entities форматирования для каждого второго слова (смещения в UTF-16)."""
+    entities = []
+    offset = 0
+    kinds = ("bold", "italic", "code", "underline", "strikethrough")
+    for index, word in enumerate(text.split(" ")):
+        length = len(word.encode("utf-16-le")) // 2
+        if index % 2 and length:
+            entities.append({"type": kinds[index % len(kinds)], "offset": offset, "length": length})
+        offset += length + 1
+    entities.append({"type": "text_link", "offset": 0, "length": len(text.split(" ")[0].encode("utf-16-le")) // 2,
+                     "url": "https://example.com"})
+    return entities
+
+
+def synthetic_updates(count: int, users: int = 50, seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    Генерирует обновления в формате Bot API.
+
+    Виды обновлений чередуются: текст с разметкой, текст с entities, фото с
+    подписью и entities, нажатие кнопки выбора формата.
+    """
+    rng = random.Random(seed)
+    now = int(time.time())
+    for update_id in range(1, count + 1):
+        user_id = FIRST_USER_ID + rng.randrange(users)
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        chat = {"id": user_id, "type": "private"}
+        text = rng.choice(SAMPLE_TEXTS)
+        kind = update_id % 4
+
+        if kind == 3:
+            yield {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id),
+                    "from": user,
+                    "chat_instance": str(user_id),
+                    "data": f"format_{rng.choice(('markdown', 'html', 'modern'))}",
+                    "message": {"message_id": update_id, "date": now, "chat": chat, "text": "Выберите формат"},
+                },
+            }
+            continue
+
+        message: Dict[str, Any] = {"message_id": update_id, "date": now, "chat": chat, "from": user}
+        if kind == 0:
+            message["text"] = text
+        elif kind == 1:
+            plain = " ".join(text.replace("*", "").replace("`", "").split())
+            message["text"] = plain
+            message["entities"] = _entities(plain)
+        else:
+            caption = " ".join(text.split())[:1024]
+            message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 90, "height": 90}]
+            message["caption"] = caption
+            message["caption_entities"] = _entities(caption)
+        yield {"update_id": update_id, "message": message}
+
+
+@dataclass
+class LevelResult:
+    """Результат одного уровня конкурентности."""
+
+    concurrency: int
+    updates: int
+    seconds: float
+    latencies: List[float] = field(repr=False)
+    api_calls: Dict[str, int]
+    errors: int = 0
+    memory_growth: Optional[int] = None
+    memory_peak: Optional[int] = None
+
+    @property
+    def throughput(self) -> float:
+        return self.updates / self.seconds if self.seconds else 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _prepare_environment(users: int) -> None:
+    """Значения по умолчанию, чтобы конфигурация загрузилась без настоящего .env."""
+    os.environ.setdefault("BOT_TOKEN", "123456:loadtest")
+    os.environ.setdefault("CHANNEL_ID", "-1001000000000")
+    # Половина синтетических пользователей - администраторы, чтобы пройти и их ветки
+    os.environ.setdefault("ADMIN_IDS", ",".join(str(FIRST_USER_ID + i) for i in range(0, users, 2)))
+
+
+async def _build_application(request: StubRequest, rate_limiter: bool) -> Application:
+    from .bot import setup_handlers
+    from .ratelimit import PublisherRateLimiter
+
+    builder = Application.builder().token(os.environ["BOT_TOKEN"]).request(request).get_updates_request(StubRequest())
+    if rate_limiter:
+        builder = builder.rate_limiter(PublisherRateLimiter())
+    application = builder.build()
+    await application.initialize()
+    setup_handlers(application)
+    await application.start()
+    return application
+
+
+async def run_level(
+    concurrency: int,
+    updates: int,
+    latency: float = 0.02,
+    jitter: float = 0.0,
+    users: int = 50,
+    rate_limiter: bool = False,
+    seed: int = 0
+) -> LevelResult:
+    """
+    Прогоняет `updates` синтетических обновлений через хендлеры с заданной конкурентностью.
+
+    Args:
+        concurrency: Сколько обновлений обрабатывается одновременно.
+        updates: Количество обновлений.
+        latency: Имитируемая задержка запроса к Bot API, секунды.
+        jitter: Случайная добавка к задержке, секунды.
+        users: Количество синтетических пользователей.
+        rate_limiter: Включить ограничитель частоты бота (с лимитами Telegram).
+        seed: Зерно генератора обновлений.
+
+    Returns:
+        LevelResult: Пропускная способность, задержки и вызовы API.
+    """
+    _prepare_environment(users)
+    request = StubRequest(latency, jitter)
+    application = await _build_application(request, rate_limiter)
+    pending = (Update.de_json(data, application.bot) for data in synthetic_updates(updates, users, seed))
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        for update in pending:
+            started = time.perf_counter()
+            try:
+                await application.process_update(update)
+            except Exception as e:
+                errors += 1
+                logger.debug(f"Ошибка обработки обновления {update.update_id}: {e}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    await application.shutdown()
+    return LevelResult(concurrency, updates, elapsed, latencies, dict(request.calls), errors)
+
+
+async def run_load_test(
+    levels: Sequence[int],
+    updates: int,
+    measure_memory: bool = True,
+    **options
+) -> List[LevelResult]:
+    """Прогоняет уровни конкурентности по очереди и замеряет рост памяти между ними."""
+    # Модули бота импортируем заранее, чтобы их загрузка не попала в рост памяти
+    _prepare_environment(options.get("users", 50))
+    from . import bot  # noqa: F401
+
+    if measure_memory:
+        tracemalloc.start()
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0] if measure_memory else 0
+
+    results = []
+    for concurrency in levels:
+        if measure_memory:
+            tracemalloc.reset_peak()
+        result = await run_level(concurrency, updates, **options)
+        if measure_memory:
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            # Рост относительно старта: то, что пережило уровень (состояния пользователей, кеши)
+            result.memory_growth = current - baseline
+            result.memory_peak = peak
+        results.append(result)
+
+    if measure_memory:
+        tracemalloc.stop()
+    return results
+
+
+def format_results(results: List[LevelResult]) -> str:
+    lines = [
+        f"{'конк.':>6} {'обн.':>6} {'обн/с':>8} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'макс мс':>8} "
+        f"{'API':>6} {'ошибок':>6} {'рост КиБ':>9} {'пик КиБ':>8}"
+    ]
+    for r in results:
+        growth = f"{r.memory_growth / 1024:9.0f}" if r.memory_growth is not None else f"{'-':>9}"
+        peak = f"{r.memory_peak / 1024:8.0f}" if r.memory_peak is not None else f"{'-':>8}"
+        lines.append(
+            f"{r.concurrency:6d} {r.updates:6d} {r.throughput:8.1f} "
+            f"{r.percentile(0.50) * 1000:8.1f} {r.percentile(0.95) * 1000:8.1f} {r.percentile(0.99) * 1000:8.1f} "
+            f"{max(r.latencies, default=0) * 1000:8.1f} {sum(r.api_calls.values()):6d} {r.errors:6d} {growth} {peak}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест хендлеров бота на синтетических обновлениях")
+    parser.add_argument("--updates", type=int, default=500, help="Обновлений на каждый уровень конкурентности")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Уровни конкурентности через запятую")
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка запроса к Bot API, секунды")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, секунды")
+    parser.add_argument("--users", type=int, default=50, help="Количество синтетических пользователей")
+    parser.add_argument("--rate-limiter", action="store_true", help="Включить ограничитель частоты с лимитами Telegram")
+    parser.add_argument("--no-memory", action="store_true", help="Не замерять память (tracemalloc замедляет работу)")
+    parser.add_argument("--log-level", default="WARNING", help="Уровень логирования хендлеров")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    results = asyncio.run(run_load_test(
+        levels,
+        args.updates,
+        measure_memory=not args.no_memory,
+        latency=args.latency,
+        jitter=args.jitter,
+        users=args.users,
+        rate_limiter=args.rate_limiter,
+    ))
+    print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Учет памяти процесса.
+
+Хранилища: количество записей и приблизительный размер всех хранилищ в
+памяти - модульных (`user_states`, кеши рендеринга и inline-превью) и
+каждого бота (`user_data`, `chat_data`, сервисы из `bot_data`). Размер
+считается обходом контейнеров и объектов модулей app с ограничением на
+число объектов, поэтому это оценка снизу, а не точный учет.
+
+Утечки: при MEMORY_TRACE=true включается tracemalloc. Первый снимок после
+запуска становится базовым, каждый следующий (раз в MEMSTATS_INTERVAL
+секунд) сравнивается с ним, и места выделения памяти, которые растут
+сильнее всего, пишутся в лог и показываются командой /memstats.
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+import types
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import metrics
+from .config import TenantLocal
+
+logger = logging.getLogger(__name__)
+
+# Сколько объектов обходить при оценке размера одного хранилища
+SIZE_BUDGET = 200000
+# Атрибуты, которые ведут из хранилища в приложение целиком
+_SKIP_ATTRIBUTES = frozenset({"application", "bot", "_application", "_bot"})
+_PACKAGE = __name__.split(".")[0]
+
+
+def _tracing() -> bool:
+    """Включен ли tracemalloc; сам модуль загружается только при MEMORY_TRACE=true."""
+    module = sys.modules.get("tracemalloc")
+    return module is not None and module.is_tracing()
+
+
+def deep_sizeof(obj: Any, budget: int = SIZE_BUDGET) -> Tuple[int, bool]:
+    """
+    Приблизительный размер объекта вместе с содержимым.
+
+    Обходит словари, последовательности, множества и атрибуты объектов
+    модулей app. Прочие объекты (соединения SQLite, задачи, блокировки)
+    учитываются только собственным размером.
+
+    Returns:
+        Tuple[int, bool]: Размер в байтах и признак, что обход завершен до исчерпания бюджета.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if len(seen) > budget:
+            return size, False
+        size += sys.getsizeof(item)
+        if isinstance(item, (dict, types.MappingProxyType)):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        elif type(item).__module__.split(".")[0] == _PACKAGE:
+            attributes = getattr(item, "__dict__", None)
+            if attributes is not None:
+                size += sys.getsizeof(attributes)
+                stack.extend(value for name, value in attributes.items() if name not in _SKIP_ATTRIBUTES)
+            for name in getattr(type(item), "__slots__", ()):
+                if name not in _SKIP_ATTRIBUTES and hasattr(item, name):
+                    stack.append(getattr(item, name))
+    return size, True
+
+
+def rss_bytes() -> Optional[int]:
+    """Резидентная память процесса (Linux), иначе None."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("Б", "КиБ", "МиБ"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГиБ"
+
+
+def describe_mapping(data: Dict[Any, Any]) -> str:
+    """Ключи словаря с приблизительными размерами значений, без самих значений."""
+    parts = []
+    for key, value in list(data.items())[:20]:
+        size, complete = deep_sizeof(value, budget=2000)
+        parts.append(f"{key} ({'≈' if complete else '>'}{format_bytes(size)})")
+    if len(data) > 20:
+        parts.append(f"... и еще {len(data) - 20}")
+    return ", ".join(parts)
+
+
+class MemoryMonitor:
+    """
+    Периодический учет хранилищ и снимки tracemalloc для всех ботов процесса.
+
+    Args:
+        interval: Период замеров в секундах (0 - только по команде /memstats).
+        trace: Включить tracemalloc и сравнение снимков с базовым.
+        top: Сколько растущих мест выделения памяти показывать.
+    """
+
+    def __init__(self, interval: float = 300.0, trace: bool = False, top: int = 10):
+        self.interval = interval
+        self.trace = trace
+        self.top = top
+        self.applications: Dict[Optional[str], Any] = {}
+        # Хранилище -> (записей, байт, обход завершен)
+        self.stores: Dict[str, Tuple[Optional[int], int, bool]] = {}
+        self.measured_at = 0.0
+        self.growth: List[Any] = []  # tracemalloc.StatisticDiff
+        self._baseline: Optional[Any] = None  # tracemalloc.Snapshot
+        self._baseline_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, applications: Dict[Optional[str], Any]) -> None:
+        """Запускает периодические замеры для ботов процесса (имя бота -> Application)."""
+        self.applications = applications
+        if self.trace and not _tracing():
+            import tracemalloc
+            tracemalloc.start()
+            logger.info("tracemalloc включен, базовый снимок будет снят при первом замере")
+        metrics.STORE_BYTES.set_function(lambda: {(name,): size for name, (_, size, _) in self.stores.items()})
+        metrics.MEMORY_BYTES.set_function(self._memory_metrics)
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.trace and _tracing():
+            import tracemalloc
+            tracemalloc.stop()
+
+    def _memory_metrics(self) -> Dict[Tuple[str], float]:
+        values = {}
+        rss = rss_bytes()
+        if rss is not None:
+            values[("rss",)] = rss
+        if _tracing():
+            import tracemalloc
+            values[("traced",)] = tracemalloc.get_traced_memory()[0]
+            values[("traced_growth",)] = sum(stat.size_diff for stat in self.growth)
+        return values
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect()
+            except Exception as e:
+                logger.error(f"Ошибка учета памяти: {e}", exc_info=True)
+
+    async def collect(self) -> None:
+        """Замеряет хранилища и, если включен tracemalloc, сравнивает снимок с базовым."""
+        self.stores = await self.measure_stores()
+        self.measured_at = time.time()
+        if not _tracing():
+            return
+        # Снимок тоже снимаем в потоке
+        snapshot = await asyncio.to_thread(self._take_snapshot)
+        if self._baseline is None:
+            self.reset_baseline(snapshot)
+            return
+        self.growth = [
+            stat for stat in snapshot.compare_to(self._baseline, "lineno")[:self.top * 2] if stat.size_diff > 0
+        ][:self.top]
+        if self.growth:
+            total = sum(stat.size_diff for stat in self.growth)
+            top = "; ".join(f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} +{format_bytes(stat.size_diff)}"
+                            for stat in self.growth[:3])
+            logger.info(f"Рост памяти с базового снимка: +{format_bytes(total)} в топ-{len(self.growth)} местах ({top})")
+
+    @staticmethod
+    def _take_snapshot() -> Any:
+        import tracemalloc
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def reset_baseline(self, snapshot: Optional[Any] = None) -> None:
+        """Делает базовым переданный снимок (или следующий снятый)."""
+        self._baseline = snapshot
+        self._baseline_at = time.time() if snapshot is not None else 0.0
+        self.growth = []
+
+    def _sources(self) -> Dict[str, Any]:
+        """Хранилища процесса: имя -> объект (собирается в цикле событий)."""
+        from .bot import inline_cache, inline_sequence, user_states
+        from .utils import render_cache
+
+        sources: Dict[str, Any] = {
+            "user_states": user_states,
+            "inline_sequence": inline_sequence,
+            "inline_cache": inline_cache,
+            "render_cache": render_cache,
+        }
+        for tenant, application in self.applications.items():
+            prefix = f"{tenant}:" if tenant else ""
+            sources[f"{prefix}user_data"] = application.user_data
+            sources[f"{prefix}chat_data"] = application.chat_data
+            for key, value in application.bot_data.items():
+                # Сторож и учет памяти общие для процесса, у бота их не считаем
+                if key not in ("watchdog", "memory"):
+                    sources[f"{prefix}bot_data.{key}"] = value
+        return sources
+
+    def _measure(self, sources: Dict[str, Any]) -> Dict[str, Tuple[Optional[int], int, bool]]:
+        """Записей и приблизительный размер каждого хранилища (выполняется в потоке)."""
+        stores = {}
+        for name, value in sources.items():
+            try:
+                size, complete = deep_sizeof(value)
+                entries = value.total_size() if isinstance(value, TenantLocal) else len(value)
+            except TypeError:
+                entries = None
+            except RuntimeError:
+                # Хранилище изменилось во время обхода: оставляем прошлый замер
+                if name in self.stores:
+                    stores[name] = self.stores[name]
+                continue
+            stores[name] = (entries, size, complete)
+        return stores
+
+    async def measure_stores(self) -> Dict[str, Tuple[Optional[int], int, bool]]:
+        """
+        Записей и приблизительный размер каждого хранилища.
+
+        Обход больших хранилищ занимает сотни миллисекунд, поэтому идет в потоке:
+        цикл событий тем временем обрабатывает обновления, а хранилища, изменившиеся
+        во время обхода, сохраняют прошлый замер.
+        """
+        return await asyncio.to_thread(self._measure, self._sources())
+
+    def report(self) -> str:
+        """Текст для команды /memstats."""
+        lines = ["🧠 Память процесса"]
+        rss = rss_bytes()
+        if rss is not None:
+            lines.append(f"RSS: {format_bytes(rss)}")
+        if _tracing():
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"tracemalloc: {format_bytes(current)} (пик {format_bytes(peak)})")
+
+        lines.append("")
+        lines.append("Хранилища (записей, размер):")
+        for name, (entries, size, complete) in sorted(self.stores.items(), key=lambda item: item[1][1], reverse=True):
+            count = f"{entries}, " if entries is not None else ""
+            lines.append(f"{name}: {count}{'≈' if complete else '>'}{format_bytes(size)}")
+
+        lines.append("")
+        if not _tracing():
+            lines.append("Поиск утечек выключен (MEMORY_TRACE=true включает tracemalloc).")
+        elif self._baseline is None:
+            lines.append("Базовый снимок tracemalloc еще не снят.")
+        elif not self.growth:
+            lines.append(f"С базового снимка ({time.strftime('%H:%M:%S', time.localtime(self._baseline_at))}) память не росла.")
+        else:
+            lines.append(f"Растущие места выделения с {time.strftime('%H:%M:%S', time.localtime(self._baseline_at))}:")
+            for stat in self.growth:
+                frame = stat.traceback[0]
+                lines.append(
+                    f"+{format_bytes(stat.size_diff)} ({stat.count_diff:+d} блоков) "
+                    f"{os.path.basename(frame.filename)}:{frame.lineno}"
+                )
+        return "\n".join(lines)
@@ -0,0 +1,262 @@
+import asyncio
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 2048, 4096, 8192, 16384, 65536)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Базовый класс метрики с набором меток."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Мгновенное значение.
+
+    Значение можно выставлять явно или вычислять при каждом сборе метрик
+    функцией, которая возвращает словарь {значения меток: число}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: List[Callable[[], Dict[LabelValues, float]]] = []
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]) -> None:
+        self._functions.append(function)
+
+    def collect(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            values = dict(self._values)
+        for function in self._functions:
+            try:
+                values.update(function())
+            except Exception as e:
+                logger.error(f"Ошибка вычисления метрики {self.name}: {e}", exc_info=True)
+        return values
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.collect().items()]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: счетчики корзин (последняя - +Inf) и сумма
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(key, (list(counts), total[0])) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", repr(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Текст в формате экспозиции Prometheus (text/plain; version=0.0.4)."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATES = REGISTRY.register(Counter(
+    "publisher_updates_total", "Обновления, обработанные хендлерами.", ["handler"]))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "publisher_handler_seconds", "Время работы хендлеров.", ["handler"]))
+ERRORS = REGISTRY.register(Counter(
+    "publisher_errors_total", "Ошибки, дошедшие до error_handler, по типу.", ["type"]))
+RENDER_SECONDS = REGISTRY.register(Histogram(
+    "publisher_render_seconds", "Время рендеринга сообщения.", ["format_type"]))
+SEND_SECONDS = REGISTRY.register(Histogram(
+    "publisher_send_seconds", "Время вызова send_message при публикации.", ["chat_id"]))
+SENT_BYTES = REGISTRY.register(Histogram(
+    "publisher_sent_bytes", "Размер опубликованных сообщений в байтах.", ["chat_id"], buckets=BYTES_BUCKETS))
+CACHE_SIZE = REGISTRY.register(Gauge(
+    "publisher_cache_size", "Количество записей во внутренних хранилищах и кешах.", ["cache"]))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "publisher_queue_depth", "Глубина очередей.", ["queue"]))
+HTML_CHECKS = REGISTRY.register(Counter(
+    "publisher_html_checks_total", "Проверки разметки перед отправкой: valid, repaired, plain.", ["result"]))
+LOOP_LAG = REGISTRY.register(Histogram(
+    "publisher_loop_lag_seconds", "Задержка планирования в цикле событий."))
+SLOW_HANDLERS = REGISTRY.register(Counter(
+    "publisher_slow_handlers_total", "Хендлеры, превысившие бюджет времени.", ["handler"]))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "publisher_startup_seconds", "Время от запуска процесса до этапа: imports, ready, first_update.", ["stage"]))
+INLINE_QUERIES = REGISTRY.register(Counter(
+    "publisher_inline_queries_total", "Inline-запросы: cached, rendered, superseded, timeout, degraded.", ["result"]))
+LANE_SECONDS = REGISTRY.register(Histogram(
+    "publisher_lane_seconds", "Время запроса к Bot API вместе с ожиданием лимитов, по полосам.", ["lane"]))
+ADMISSION = REGISTRY.register(Counter(
+    "publisher_admission_total",
+    "Решения допуска обновлений: admitted, public, unauthorized, rate_limited, anonymous.", ["result"]))
+BACKPRESSURE = REGISTRY.register(Counter(
+    "publisher_backpressure_total",
+    "Срабатывания обратного давления по ступеням (receive, render, send) и действиям (deferred, rejected, degraded).",
+    ["stage", "action"]))
+MEMORY_BYTES = REGISTRY.register(Gauge(
+    "publisher_memory_bytes",
+    "Память процесса: rss, traced (учтенная tracemalloc), traced_growth (рост растущих мест с базового снимка).",
+    ["kind"]))
+STORE_BYTES = REGISTRY.register(Gauge(
+    "publisher_store_bytes", "Приблизительный размер хранилищ в памяти на момент последнего замера.", ["store"]))
+CHANNEL_CHECKS = REGISTRY.register(Counter(
+    "publisher_channel_checks_total",
+    "Проверки каналов: cached, fetched, joined (ждали уже идущий запрос), rejected (публикация отклонена по кешу).",
+    ["result"]))
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их надо дочитать
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+            status = "200 OK"
+            body = REGISTRY.render().encode("utf-8")
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """
+    Запускает HTTP-сервер с метриками в формате Prometheus на /metrics.
+
+    Args:
+        host: Адрес для прослушивания.
+        port: Порт.
+    """
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Статусы записей в outbox
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+# Параметры группового коммита
+BATCH_DELAY = 0.005  # Сколько ждать попутные операции перед коммитом (секунды)
+BATCH_SIZE = 256     # Максимум операций в одной транзакции
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target_chat_id INTEGER NOT NULL,
+    origin_chat_id INTEGER,
+    text TEXT NOT NULL,
+    parse_mode TEXT,
+    status TEXT NOT NULL,
+    message_id INTEGER,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status);
+CREATE TABLE IF NOT EXISTS digest (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target_chat_id INTEGER NOT NULL,
+    origin_chat_id INTEGER,
+    body TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Колонки, добавленные после первой версии схемы: источник публикации для /edit
+_MIGRATIONS = {
+    "source_message_id": "INTEGER",
+    "source_text": "TEXT",
+    "format_type": "TEXT",
+}
+
+
+class Outbox:
+    """
+    Журнал публикаций (write-ahead outbox) в SQLite.
+
+    Каждый запрос на публикацию записывается до отправки, а статус
+    (pending/sending/sent/failed) и message_id обновляются по ходу доставки.
+    Посты режима дайджеста до публикации хранятся в отдельной таблице digest.
+    Записи от одновременно работающих обработчиков объединяются в одну
+    транзакцию, поэтому стоимость fsync делится между ними. Чтение и запись
+    идут в рабочих потоках, цикл событий на SQLite не блокируется.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._reader: Optional[sqlite3.Connection] = None
+        # Соединение для чтения используется из разных рабочих потоков
+        self._reader_lock = threading.Lock()
+        # Записей, ожидающих доставки: пересчитывается после каждого коммита
+        self._pending = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Открывает базу и запускает фоновую задачу группового коммита."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL synchronous=NORMAL переживает падение процесса, а этого достаточно
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        # Отдельное соединение для чтения, чтобы не вмешиваться в транзакции писателя
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+        self._pending = self._count_pending(self._conn)
+
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        logger.info(f"Outbox открыт: {self.path}")
+
+    def _migrate(self) -> None:
+        """Добавляет недостающие колонки в базу, созданную старой версией бота."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        for name, kind in _MIGRATIONS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE outbox ADD COLUMN {name} {kind}")
+                logger.info(f"Outbox: добавлена колонка {name}")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_source ON outbox (origin_chat_id, source_message_id)"
+        )
+
+    async def close(self) -> None:
+        """Дописывает накопленные операции и закрывает базу."""
+        if self._writer:
+            await self._queue.join()
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    async def _submit(self, sql: str, params: Tuple[Any, ...]) -> int:
+        """Ставит операцию в очередь и ждет коммита транзакции, в которую она попала."""
+        return await self._submit_all([(sql, params)])
+
+    async def _submit_all(self, statements: List[Tuple[str, Tuple[Any, ...]]]) -> int:
+        """Ставит несколько запросов одной операцией: они попадают в одну транзакцию. Результат - первого запроса."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((statements, future))
+        return await future
+
+    async def _write_loop(self) -> None:
+        """Собирает операции в пачки и коммитит их одной транзакцией."""
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(BATCH_DELAY)
+            while len(batch) < BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                results = await asyncio.to_thread(self._commit_batch, batch)
+            except Exception as e:
+                logger.error(f"Ошибка записи в outbox: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _commit_batch(self, batch: List[Tuple[List[Tuple[str, Tuple[Any, ...]]], asyncio.Future]]) -> List[int]:
+        """Выполняет пачку операций в одной транзакции (в рабочем потоке)."""
+        results = []
+        self._conn.execute("BEGIN")
+        try:
+            for statements, _ in batch:
+                for index, (sql, params) in enumerate(statements):
+                    cursor = self._conn.execute(sql, params)
+                    if index == 0:
+                        results.append(cursor.lastrowid if sql.lstrip().startswith("INSERT") else cursor.rowcount)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._pending = self._count_pending(self._conn)
+        return results
+
+    @staticmethod
+    def _count_pending(conn: sqlite3.Connection) -> int:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)", (STATUS_PENDING, STATUS_SENDING)
+        ).fetchone()
+        return row[0]
+
+    async def add(
+        self,
+        target_chat_id: int,
+        text: str,
+        origin_chat_id: Optional[int] = None,
+        parse_mode: Optional[str] = "HTML",
+        source_message_id: Optional[int] = None,
+        source_text: Optional[str] = None,
+        format_type: Optional[str] = None,
+        sending: bool = False,
+        digest_ids: Sequence[int] = ()
+    ) -> int:
+        """
+        Записывает запрос на публикацию и возвращает его ID после коммита.
+
+        Args:
+            target_chat_id: ID чата для публикации.
+            text: Готовый к отправке текст.
+            origin_chat_id: ID чата, из которого пришел запрос.
+            parse_mode: Режим парсинга сообщения.
+            source_message_id: ID черновика в чате автора.
+            source_text: Исходный текст черновика (для повторного рендеринга при правке).
+            format_type: Формат, в котором черновик был отрендерен.
+            sending: Запись сразу передается в Telegram: статус sending ставится
+                той же операцией, без отдельного mark_sending.
+            digest_ids: Посты дайджеста, собранные в это сообщение: они удаляются
+                в той же транзакции, что и запись сообщения.
+
+        Returns:
+            int: ID записи в outbox.
+        """
+        now = time.time()
+        statements = [(
+            "INSERT INTO outbox (target_chat_id, origin_chat_id, text, parse_mode, status, attempts, "
+            "created_at, updated_at, source_message_id, source_text, format_type) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (target_chat_id, origin_chat_id, text, parse_mode, STATUS_SENDING if sending else STATUS_PENDING,
+             1 if sending else 0, now, now, source_message_id, source_text, format_type)
+        )]
+        if digest_ids:
+            statements.append(self._delete_digest_posts(digest_ids))
+        return await self._submit_all(statements)
+
+    async def add_digest_post(self, target_chat_id: int, body: str, origin_chat_id: Optional[int] = None) -> int:
+        """Сохраняет отрендеренный пост дайджеста до публикации и возвращает его ID после коммита."""
+        return await self._submit(
+            "INSERT INTO digest (target_chat_id, origin_chat_id, body, created_at) VALUES (?, ?, ?, ?)",
+            (target_chat_id, origin_chat_id, body, time.time())
+        )
+
+    async def remove_digest_posts(self, post_ids: Sequence[int]) -> None:
+        """Удаляет посты дайджеста, которые не попали в опубликованное сообщение (повтор, ошибка)."""
+        if post_ids:
+            await self._submit(*self._delete_digest_posts(post_ids))
+
+    @staticmethod
+    def _delete_digest_posts(post_ids: Sequence[int]) -> Tuple[str, Tuple[Any, ...]]:
+        placeholders = ", ".join("?" * len(post_ids))
+        return f"DELETE FROM digest WHERE id IN ({placeholders})", tuple(post_ids)
+
+    async def mark_sending(self, entry_id: int) -> None:
+        """Отмечает, что запись передается в Telegram."""
+        await self._submit(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            (STATUS_SENDING, time.time(), entry_id)
+        )
+
+    async def mark_sent(self, entry_id: int, message_id: int) -> None:
+        """Отмечает запись как доставленную и сохраняет message_id."""
+        await self._submit(
+            "UPDATE outbox SET status = ?, message_id = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (STATUS_SENT, message_id, time.time(), entry_id)
+        )
+
+    async def mark_failed(self, entry_id: int, error: str) -> None:
+        """Отмечает запись как неудачную."""
+        await self._submit(
+            "UPDATE outbox SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (STATUS_FAILED, error[:1000], time.time(), entry_id)
+        )
+
+    async def update_published(self, entry_id: int, text: str, parse_mode: Optional[str], source_text: str) -> None:
+        """Сохраняет новый текст опубликованного сообщения после правки."""
+        await self._submit(
+            "UPDATE outbox SET text = ?, parse_mode = ?, source_text = ?, updated_at = ? WHERE id = ?",
+            (text, parse_mode, source_text, time.time(), entry_id)
+        )
+
+    def _query(
+        self,
+        where: str,
+        params: Tuple[Any, ...],
+        order: str,
+        limit: Optional[int],
+        table: str = "outbox"
+    ) -> List[Dict[str, Any]]:
+        """Выполняет выборку (в рабочем потоке)."""
+        sql = f"SELECT * FROM {table} WHERE {where} ORDER BY {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._reader_lock:
+            cursor = self._reader.execute(sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    async def _select(
+        self,
+        where: str,
+        params: Tuple[Any, ...] = (),
+        order: str = "id",
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._query, where, params, order, limit)
+
+    async def pending_entries(self) -> List[Dict[str, Any]]:
+        """Записи, которые еще не передавались в Telegram."""
+        return await self._select("status = ?", (STATUS_PENDING,))
+
+    async def interrupted_entries(self) -> List[Dict[str, Any]]:
+        """Записи, отправка которых была прервана: доставлены ли они, неизвестно."""
+        return await self._select("status = ?", (STATUS_SENDING,))
+
+    async def sent_since(self, timestamp: float) -> List[Dict[str, Any]]:
+        """Записи, доставленные после указанного момента (unix time)."""
+        return await self._select("status = ? AND updated_at >= ?", (STATUS_SENT, timestamp))
+
+    async def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        """Запись outbox по ID."""
+        rows = await self._select("id = ?", (entry_id,))
+        return rows[0] if rows else None
+
+    async def find_published(
+        self,
+        origin_chat_id: int,
+        source_message_id: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Находит опубликованное сообщение по черновику.
+
+        Args:
+            origin_chat_id: ID чата автора.
+            source_message_id: ID черновика; без него возвращается последняя
+                публикация из этого чата, которую можно править.
+
+        Returns:
+            Optional[Dict[str, Any]]: Запись outbox или None.
+        """
+        where = "origin_chat_id = ? AND status = ? AND source_text IS NOT NULL"
+        params: Tuple[Any, ...] = (origin_chat_id, STATUS_SENT)
+        if source_message_id is not None:
+            where += " AND source_message_id = ?"
+            params += (source_message_id,)
+        rows = await self._select(where, params, order="id DESC", limit=1)
+        return rows[0] if rows else None
+
+    async def digest_posts(self) -> List[Dict[str, Any]]:
+        """Посты дайджеста, принятые, но еще не опубликованные (в порядке поступления)."""
+        return await asyncio.to_thread(self._query, "1", (), "id", None, "digest")
+
+    def pending_count(self) -> int:
+        """
+        Количество записей, ожидающих доставки.
+
+        Считается в потоке записи после каждого коммита, поэтому метрики
+        и /pressure получают его без запроса к базе.
+        """
+        return self._pending
+
+    async def prune(self, max_age_days: int) -> int:
+        """Удаляет доставленные и неудачные записи старше max_age_days дней."""
+        return await self._submit(
+            "DELETE FROM outbox WHERE status IN (?, ?) AND updated_at < ?",
+            (STATUS_SENT, STATUS_FAILED, time.time() - max_age_days * 86400)
+        )
@@ -0,0 +1,117 @@
+"""
+Обратное давление в конвейере публикации.
+
+Конвейер состоит из трех ступеней: прием (очередь обновлений Application),
+рендеринг (текущие рендеринги, включая inline-превью в потоках) и отправка
+(запросы, ждущие в ограничителе частоты). У каждой ступени своя отметка
+заполнения (high-water mark). Когда она достигнута:
+
+- прием: новые посты отклоняются ответом "бот занят, повторите через N с",
+  команды администраторов проходят;
+- рендеринг: inline-превью отдаются простым текстом без рендеринга;
+- отправка: новые публикации отклоняются с оценкой времени ожидания,
+  а планировщик откладывает выпуск заданий, пока очередь не разойдется.
+"""
+import math
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+from . import metrics
+
+RECEIVE = "receive"
+RENDER = "render"
+SEND = "send"
+
+
+class Backpressure:
+    """Заполнение ступеней конвейера одного бота и решения при перегрузке."""
+
+    def __init__(self, application, receive_limit: int = 200, render_limit: int = 4, send_limit: int = 100):
+        self.application = application
+        self.limits = {RECEIVE: receive_limit, RENDER: render_limit, SEND: send_limit}
+        self._rendering = 0
+        self._lock = threading.Lock()  # Рендеринг inline-превью идет в потоках
+        self._handler_seconds = 0.05   # Скользящее среднее времени хендлера
+
+    @property
+    def _limiter(self):
+        return getattr(self.application.bot, "rate_limiter", None)
+
+    def level(self, stage: str) -> int:
+        """Текущее заполнение ступени."""
+        if stage == RECEIVE:
+            return self.application.update_queue.qsize()
+        if stage == RENDER:
+            return self._rendering
+        limiter = self._limiter
+        return limiter.waiting() if limiter is not None and hasattr(limiter, "waiting") else 0
+
+    def levels(self) -> Dict[str, Tuple[int, int]]:
+        """Ступень -> (заполнение, отметка)."""
+        return {stage: (self.level(stage), limit) for stage, limit in self.limits.items()}
+
+    def saturated(self, stage: str) -> bool:
+        limit = self.limits[stage]
+        return limit > 0 and self.level(stage) >= limit
+
+    def capacity(self, stage: str) -> Optional[int]:
+        """Сколько еще можно поставить в ступень до отметки (None - без ограничения)."""
+        limit = self.limits[stage]
+        return max(0, limit - self.level(stage)) if limit > 0 else None
+
+    def release_capacity(self) -> Optional[int]:
+        """Сколько отложенных публикаций планировщик может выпустить сейчас (0 - отложить)."""
+        capacity = self.capacity(SEND)
+        if capacity == 0:
+            self.note(SEND, "deferred")
+        return capacity
+
+    def handled(self, seconds: float) -> None:
+        """Учитывает время обработки обновления (для оценки, когда разойдется очередь приема)."""
+        self._handler_seconds += (seconds - self._handler_seconds) * 0.1
+
+    def retry_after(self, stage: str = SEND, chat_id: Optional[Union[int, str]] = None) -> int:
+        """Оценка, через сколько секунд очередь ступени (для отправки - в чат `chat_id`) разойдется."""
+        if stage == RECEIVE:
+            return max(1, math.ceil(self.level(RECEIVE) * self._handler_seconds))
+        limiter = self._limiter
+        if limiter is None or not hasattr(limiter, "backlog_seconds"):
+            return 1
+        return max(1, math.ceil(limiter.backlog_seconds(chat_id)))
+
+    @contextmanager
+    def rendering(self) -> Iterator[None]:
+        """Учитывает текущий рендеринг (можно использовать в потоке)."""
+        with self._lock:
+            self._rendering += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._rendering -= 1
+
+    def note(self, stage: str, action: str) -> None:
+        """Считает срабатывание: deferred, rejected или degraded."""
+        metrics.BACKPRESSURE.inc(stage=stage, action=action)
+
+    def report(self) -> str:
+        """Текст для команды /pressure."""
+        names = {RECEIVE: "Прием", RENDER: "Рендеринг", SEND: "Отправка"}
+        lines = ["📈 Заполнение конвейера:"]
+        for stage, (level, limit) in self.levels().items():
+            if limit <= 0:
+                state = "без ограничения"
+            elif level >= limit:
+                state = "🔴 перегрузка"
+            elif level >= limit * 0.75:
+                state = "🟡 близко к отметке"
+            else:
+                state = "🟢"
+            lines.append(f"{names[stage]}: {level} из {limit if limit > 0 else '∞'} {state}")
+        limiter = self._limiter
+        if limiter is not None and hasattr(limiter, "waiting"):
+            lanes = ", ".join(f"{lane} {limiter.waiting(lane)}" for lane in limiter.lanes)
+            lines.append(f"Ожидают отправки по полосам: {lanes}")
+            lines.append(f"Очередь отправки разойдется примерно за {limiter.backlog_seconds():.0f} с")
+        return "\n".join(lines)
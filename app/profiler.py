@@ -0,0 +1,209 @@
+"""
+Статистический профилировщик для работающего процесса.
+
+Пока профилирование включено, каждые `interval` секунд снимаются стеки
+потока цикла событий (хендлеры) и потоков рендеринга (asyncio.to_thread).
+Стек цикла снимает обработчик SIGPROF (таймер процессорного времени): он
+прерывает цикл в произвольном месте байткода. Поток-сэмплер видел бы цикл
+в основном в ожидании ввода-вывода, потому что получает GIL именно там.
+Остальные потоки снимает поток-сэмплер через sys._current_frames(). Код бота
+не инструментируется, а когда профилирование выключено, таймера и потока
+нет и накладных расходов тоже нет.
+
+Результат пишется в формате collapsed stacks (строка на уникальный стек:
+`поток;функция;...;функция число_сэмплов`), который читают flamegraph.pl,
+speedscope и inferno.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Частота по умолчанию: 100 сэмплов в секунду
+SAMPLE_INTERVAL = 0.01
+MAX_DEPTH = 64
+MAX_SECONDS = 120
+
+# Верхние кадры (функция и файл), означающие, что поток ничего не делает: ждет событий или задач
+_IDLE_FRAMES = frozenset({
+    "select (selectors.py",      # цикл событий ждет ввода-вывода
+    "wait (threading.py",        # потоки сторожа и профилировщика, Event.wait
+    "_worker (thread.py",        # свободный поток пула asyncio.to_thread
+    "get (queue.py",
+    "_recv (connection.py",      # воркер ждет обновлений от приемника
+})
+
+
+class ProfileResult:
+    """Собранные сэмплы."""
+
+    def __init__(self, stacks: Counter, samples: int, duration: float, interval: float):
+        self.stacks = stacks  # (поток, кадр, ..., кадр) -> число сэмплов
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+
+    @staticmethod
+    def is_idle(stack: Tuple[str, ...]) -> bool:
+        return stack[-1].rsplit(":", 1)[0] in _IDLE_FRAMES
+
+    def collapsed(self) -> str:
+        """Стеки в формате collapsed stacks."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int = 10) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """
+        Самые горячие функции без учета простоя.
+
+        Returns:
+            Tuple[List, List]: (функция, сэмплы) по собственному времени и по времени с вызовами.
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if self.is_idle(stack):
+                continue
+            own[stack[-1]] += count
+            for frame in set(stack[1:]):
+                total[frame] += count
+        return own.most_common(limit), total.most_common(limit)
+
+    def summary(self, limit: int = 10) -> str:
+        """Краткий отчет для чата."""
+        busy = sum(count for stack, count in self.stacks.items() if not self.is_idle(stack))
+        threads: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if not self.is_idle(stack):
+                threads[stack[0]] += count
+        lines = [
+            f"🔬 Профиль за {self.duration:.1f} с: снимков {self.samples} "
+            f"(каждые {self.interval * 1000:.0f} мс процессорного времени), стеков с работой {busy}",
+        ]
+        if threads:
+            lines.append("Потоки: " + ", ".join(f"{name} {count}" for name, count in threads.most_common(5)))
+        own, total = self.top(limit)
+        if not own:
+            lines.append("Процесс простаивал все время профилирования.")
+            return "\n".join(lines)
+        lines.append("")
+        lines.append("Собственное время (доля стеков с работой):")
+        lines.extend(f"{count * 100 / busy:5.1f}%  {frame}" for frame, count in own)
+        lines.append("")
+        lines.append("С вызываемыми функциями:")
+        lines.extend(f"{count * 100 / busy:5.1f}%  {frame}" for frame, count in total)
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """
+    Сэмплер стеков.
+
+    Из главного потока (в нем работает цикл событий) стек снимает обработчик
+    SIGPROF, остальные потоки - поток-сэмплер. Без setitimer или при запуске
+    не из главного потока поток-сэмплер снимает все потоки.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, max_depth: int = MAX_DEPTH):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._labels: Dict[object, str] = {}
+        self._names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._previous_handler = None
+        self._signal_thread_id: Optional[int] = None
+        self._started = 0.0
+        self.mode: Optional[str] = None  # signal или thread, пока профилировщик работает
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            # Имя функции и место определения: строки одной функции сливаются в один кадр
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _record(self, thread_id: int, frame) -> None:
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            frames.append(self._label(frame.f_code))
+            frame = frame.f_back
+        name = self._names.get(thread_id)
+        if name is None:
+            self._names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._names.get(thread_id, str(thread_id))
+        frames.append(name)
+        frames.reverse()
+        self._stacks[tuple(frames)] += 1
+
+    def _on_signal(self, signum, frame) -> None:
+        # Прерванный сигналом кадр главного потока
+        self._record(self._signal_thread_id, frame)
+        self._samples += 1
+
+    def _run(self) -> None:
+        skip = {threading.get_ident(), self._signal_thread_id}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in skip:
+                    self._record(thread_id, frame)
+            if self._signal_thread_id is None:
+                self._samples += 1
+
+    def start(self) -> None:
+        if self.running:
+            raise RuntimeError("Профилировщик уже запущен")
+        self._started = time.monotonic()
+        if hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread():
+            self._signal_thread_id = threading.get_ident()
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            self.mode = "signal"
+        else:
+            self._signal_thread_id = None
+            self.mode = "thread"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> ProfileResult:
+        """Останавливает профилирование (из того же потока, что и start) и возвращает сэмплы."""
+        if not self.running:
+            raise RuntimeError("Профилировщик не запущен")
+        if self.mode == "signal":
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.mode = None
+        result = ProfileResult(self._stacks, self._samples, time.monotonic() - self._started, self.interval)
+        self._stacks, self._samples, self._labels, self._names = Counter(), 0, {}, {}
+        return result
+
+
+# Один профилировщик на процесс: его запускают все боты процесса
+profiler = SamplingProfiler()
+
+
+def write_collapsed(result: ProfileResult, directory: str) -> str:
+    """
+    Записывает стеки в `directory/profile-ГГГГММДД-ЧЧММСС-PID.collapsed`.
+
+    Returns:
+        str: Путь к файлу.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.collapsed")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(result.collapsed())
+    return path
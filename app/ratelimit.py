@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Coroutine, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from . import metrics
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API (https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this)
+GLOBAL_RATE = 30.0          # сообщений в секунду на бота
+GROUP_RATE = 20.0 / 60.0    # сообщений в секунду в одну группу или канал
+PRIVATE_RATE = 1.0          # сообщений в секунду в личный чат
+
+# Полосы исходящих запросов. Ответы в интерфейсе (личные чаты, нажатия кнопок)
+# всегда идут первыми; оставшийся лимит публикации делят по весам
+LANE_INTERACTIVE = "interactive"  # личные чаты и ответы на нажатия кнопок
+LANE_PUBLISH = "publish"          # публикации администратора в каналы
+LANE_BULK = "bulk"                # отложенные публикации, дайджесты, досылка outbox
+LANE_WEIGHTS = {LANE_PUBLISH: 3, LANE_BULK: 1}
+
+# Лимит чата распространяется только на сообщения: отправку, правку, копирование и пересылку.
+# Чтение сведений о чате (getChat, getChatMember) идет только через общий лимит бота
+_POSTING_PREFIXES = ("send", "edit", "copy", "forward")
+_NOT_POSTING = frozenset({"sendChatAction"})
+
+# Полоса публикаций в каналы для текущей задачи (по умолчанию - публикация администратора)
+_current_lane: ContextVar[str] = ContextVar("outbound_lane", default=LANE_PUBLISH)
+
+
+@contextmanager
+def outbound_lane(lane: str) -> Iterator[None]:
+    """Отправляет запросы в каналы внутри блока по полосе `lane` (например, LANE_BULK)."""
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def chat_limits(chat_id: Union[int, str]) -> Tuple[float, int]:
+    """Лимит чата: (сообщений в секунду, запас) для группы или канала и для личного чата."""
+    if isinstance(chat_id, str) or chat_id < 0:
+        return GROUP_RATE, 20
+    return PRIVATE_RATE, 3
+
+
+def counts_toward_chat_limit(endpoint: str) -> bool:
+    """Расходует ли метод Bot API лимит сообщений чата."""
+    return endpoint.startswith(_POSTING_PREFIXES) and endpoint not in _NOT_POSTING
+
+
+def lane_for(chat_id: Optional[Union[int, str]]) -> str:
+    """Полоса запроса: без чата или в личный чат - интерфейс, иначе полоса текущей задачи."""
+    if chat_id is None or (isinstance(chat_id, int) and chat_id > 0):
+        return LANE_INTERACTIVE
+    return _current_lane.get()
+
+
+class Pacer:
+    """
+    Ограничитель частоты по алгоритму GCRA (виртуальное ведро).
+
+    Место в очереди резервируется синхронно, поэтому конкурирующие задачи
+    обслуживаются в порядке вызова, а ожидание вычисляется один раз без опроса.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * (burst - 1)
+        self._tat = 0.0  # Теоретическое время прихода следующего запроса
+
+    def reserve(self) -> float:
+        """Резервирует слот и возвращает, сколько секунд нужно подождать."""
+        now = time.monotonic()
+        tat = max(self._tat, now)
+        self._tat = tat + self.interval
+        return max(0.0, tat - self.tolerance - now)
+
+    def available_in(self) -> float:
+        """Через сколько секунд освободится слот (без резервирования)."""
+        return max(0.0, self._tat - self.tolerance - time.monotonic())
+
+    def delay(self, seconds: float) -> None:
+        """Сдвигает следующий слот (например, после ответа 429 retry_after)."""
+        self._tat = max(self._tat, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        """Запас восстановлен полностью: состояние не отличается от нового ограничителя."""
+        return self._tat <= time.monotonic()
+
+    async def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class SharedPacer(Pacer):
+    """
+    Ограничитель GCRA, общий для нескольких процессов.
+
+    Теоретическое время прихода хранится в разделяемой памяти и меняется под
+    межпроцессной блокировкой. time.monotonic в Linux общий для всех процессов,
+    поэтому воркеры делят один лимит бота.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, state=None):
+        super().__init__(rate, burst)
+        self.state = state if state is not None else multiprocessing.get_context("spawn").Value("d", 0.0)
+
+    def reserve(self) -> float:
+        with self.state.get_lock():
+            now = time.monotonic()
+            tat = max(self.state.value, now)
+            self.state.value = tat + self.interval
+        return max(0.0, tat - self.tolerance - now)
+
+    def available_in(self) -> float:
+        return max(0.0, self.state.value - self.tolerance - time.monotonic())
+
+    def idle(self) -> bool:
+        return self.state.value <= time.monotonic()
+
+    def delay(self, seconds: float) -> None:
+        with self.state.get_lock():
+            self.state.value = max(self.state.value, time.monotonic() + seconds)
+
+
+class LaneScheduler:
+    """
+    Очередь к ограничителю с полосами приоритета.
+
+    Пока слот ограничителя занят, запросы ждут в очереди своей полосы.
+    Освободившийся слот получает интерфейсная полоса, если в ней кто-то
+    ждет, а иначе полосы публикации по весам LANE_WEIGHTS (плавный
+    взвешенный round robin). Полоса выбирается в момент, когда слот уже
+    свободен, поэтому ответ пользователю, пришедший во время ожидания,
+    обгоняет накопившиеся публикации.
+    """
+
+    def __init__(self, pacer: Pacer):
+        self.pacer = pacer
+        self._queues: Dict[str, Deque[asyncio.Future]] = {
+            lane: deque() for lane in (LANE_INTERACTIVE, *LANE_WEIGHTS)
+        }
+        self._credits = {lane: 0 for lane in LANE_WEIGHTS}
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def waiting(self, lane: Optional[str] = None) -> int:
+        """Сколько запросов ждут в полосе (или во всех полосах)."""
+        queues = [self._queues[lane]] if lane else self._queues.values()
+        return sum(1 for queue in queues for future in queue if not future.done())
+
+    def backlog_seconds(self) -> float:
+        """Через сколько секунд получит слот последний из ждущих запросов."""
+        return self.pacer.available_in() + self.waiting() * self.pacer.interval
+
+    async def acquire(self, lane: str) -> None:
+        if not self.waiting() and self.pacer.available_in() == 0:
+            # Очереди нет: слот берем сразу, без диспетчера
+            wait = self.pacer.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues[lane if lane in self._queues else LANE_PUBLISH].append(future)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def _next_lane(self) -> Optional[str]:
+        for queue in self._queues.values():
+            # Отмененные запросы (например, по таймауту) слот не получают
+            while queue and queue[0].done():
+                queue.popleft()
+        if self._queues[LANE_INTERACTIVE]:
+            return LANE_INTERACTIVE
+        candidates = [lane for lane in LANE_WEIGHTS if self._queues[lane]]
+        if not candidates:
+            return None
+        for lane in candidates:
+            self._credits[lane] += LANE_WEIGHTS[lane]
+        lane = max(candidates, key=self._credits.__getitem__)
+        self._credits[lane] -= sum(LANE_WEIGHTS[candidate] for candidate in candidates)
+        return lane
+
+    async def _dispatch(self) -> None:
+        while self.waiting():
+            wait = self.pacer.available_in()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            lane = self._next_lane()
+            if lane is None:
+                break
+            future = self._queues[lane].popleft()
+            # Общий ограничитель воркеров мог отдать слот другому процессу
+            wait = self.pacer.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if not future.done():
+                future.set_result(None)
+
+
+class PublisherRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """
+    Ограничитель исходящих запросов к Bot API.
+
+    Запросы проходят через общий лимит бота, а сообщения (отправка, правка,
+    копирование, пересылка) - еще и через лимит конкретного чата (для групп
+    и каналов он заметно строже). Ограничители чатов, запас которых
+    полностью восстановился, удаляются. При ответе 429 запрос
+    повторяется после retry_after, а лимит чата сдвигается, чтобы очередь
+    за ним тоже подождала.
+
+    Оба лимита обслуживают запросы по полосам (`LaneScheduler`): полосу
+    можно задать явно через `rate_limit_args={"lane": ...}`, иначе она
+    определяется по чату и `outbound_lane`. Время запросов с ожиданием
+    пишется в метрику publisher_lane_seconds по полосам.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        global_pacer: Optional[Pacer] = None,
+        chat_pacers: Optional[Dict[Union[int, str], Pacer]] = None
+    ):
+        self.max_retries = max_retries
+        # В режиме воркеров общий лимит бота и лимиты каналов, в которые публикуют
+        # все воркеры, делят все процессы
+        self._global = LaneScheduler(global_pacer or Pacer(GLOBAL_RATE, burst=int(GLOBAL_RATE)))
+        self._shared_chats = chat_pacers or {}
+        # Чат -> ограничитель, от давно использованных к недавним
+        self._chats: "OrderedDict[Union[int, str], LaneScheduler]" = OrderedDict()
+
+    lanes = (LANE_INTERACTIVE, *LANE_WEIGHTS)
+
+    async def initialize(self) -> None:
+        pass
+
+    def waiting(self, lane: Optional[str] = None) -> int:
+        """Сколько запросов ждут лимитов (в полосе или во всех полосах)."""
+        return self._global.waiting(lane) + sum(chat.waiting(lane) for chat in self._chats.values())
+
+    def backlog_seconds(self, chat_id: Optional[Union[int, str]] = None) -> float:
+        """Оценка, через сколько секунд разойдется очередь бота (и чата `chat_id`, если задан)."""
+        backlog = self._global.backlog_seconds()
+        chat = self._chats.get(chat_id) if chat_id is not None else None
+        if chat is not None:
+            backlog = max(backlog, chat.backlog_seconds())
+        return backlog
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_pacer(self, chat_id: Union[int, str]) -> LaneScheduler:
+        pacer = self._chats.get(chat_id)
+        if pacer is not None:
+            self._chats.move_to_end(chat_id)
+            return pacer
+        # Давно не использованные ограничители, у которых нет очереди и запас восстановлен,
+        # ничего не помнят: удаляем их, чтобы словарь не рос с каждым новым чатом
+        while self._chats:
+            oldest = next(iter(self._chats.values()))
+            if oldest.waiting() or not oldest.pacer.idle():
+                break
+            self._chats.popitem(last=False)
+        # Состояние общего ограничителя хранится в разделяемой памяти и удалением не теряется
+        shared = self._shared_chats.get(chat_id)
+        if shared is None:
+            rate, burst = chat_limits(chat_id)
+            shared = Pacer(rate, burst=burst)
+        pacer = LaneScheduler(shared)
+        self._chats[chat_id] = pacer
+        return pacer
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        chat_id = data.get("chat_id")
+        chat_limited = chat_id is not None and counts_toward_chat_limit(endpoint)
+        lane = (rate_limit_args or {}).get("lane") or lane_for(chat_id)
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            with span("ratelimit.wait", lane=lane):
+                if chat_limited:
+                    await self._chat_pacer(chat_id).acquire(lane)
+                await self._global.acquire(lane)
+            try:
+                with span(f"api.{endpoint}", chat_id=chat_id):
+                    result = await callback(*args, **kwargs)
+                metrics.LANE_SECONDS.observe(time.perf_counter() - started, lane=lane)
+                return result
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                logger.warning(f"{endpoint}: превышен лимит Telegram, повтор через {retry_after} с (попытка {attempt})")
+                if chat_limited:
+                    self._chat_pacer(chat_id).pacer.delay(retry_after)
+                await asyncio.sleep(retry_after)
@@ -0,0 +1,139 @@
+"""
+Пробный рендеринг без обращения к Telegram.
+
+Текст проходит тот же путь, что и при публикации (format_message и проверка
+разметки prepare_html), но вместо отправки возвращается отчет: длина,
+которую увидит получатель, число сущностей по тегам, на сколько сообщений
+текст пришлось бы разбить, время по этапам и замечания проверки.
+
+Пакетная проверка: python -m app.report drafts/*.md --format markdown
+"""
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from . import tracing
+from .utils import TELEGRAM_MESSAGE_LIMIT, format_message, visible_length
+from .validator import prepare_html
+
+_OPEN_TAG_RE = re.compile(r'<([a-z][\w-]*)[^<>]*>')
+
+
+@dataclass
+class RenderReport:
+    """Результат пробного рендеринга одного текста."""
+
+    format_type: str
+    text: str
+    parse_mode: Optional[str]
+    length: int
+    html_length: int
+    tags: Dict[str, int]
+    parts: int
+    stages: Dict[str, float]
+    total_ms: float
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def entities(self) -> int:
+        return sum(self.tags.values())
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["entities"] = self.entities
+        return data
+
+    def format(self) -> str:
+        """Текст отчета для ответа в чате (без разметки)."""
+        lines = [
+            f"🧪 Пробный рендеринг ({self.format_type}), ничего не отправлено",
+            f"📏 Длина: {self.length} из {TELEGRAM_MESSAGE_LIMIT} (UTF-16), HTML: {self.html_length} символов",
+            f"✂️ Частей: {self.parts}",
+            f"🏷 Сущностей: {self.entities}"
+            + (" (" + ", ".join(f"{name} {count}" for name, count in sorted(self.tags.items())) + ")" if self.tags else ""),
+            f"🔤 Режим парсинга: {self.parse_mode or 'простой текст'}",
+            f"⏱ Всего: {self.total_ms:.2f} мс",
+        ]
+        lines.extend(f"    {name}: {ms:.2f} мс" for name, ms in self.stages.items())
+        if self.warnings:
+            lines.append("⚠️ Замечания:")
+            lines.extend(f"• {warning}" for warning in self.warnings[:20])
+            if len(self.warnings) > 20:
+                lines.append(f"• ... и еще {len(self.warnings) - 20}")
+        return "\n".join(lines)
+
+
+def render_report(text: str, format_type: str = 'markdown') -> RenderReport:
+    """
+    Рендерит текст так же, как перед публикацией, но ничего не отправляет.
+
+    Args:
+        text: Исходный текст черновика.
+        format_type: Тип форматирования (markdown, html, plain, modern).
+
+    Returns:
+        RenderReport: Отчет о рендеринге.
+    """
+    # Трасса нужна только для разбивки по этапам, в файл трасс она не пишется
+    trace = tracing.start_trace("dry_run", sampled=True, format_type=format_type)
+    try:
+        with tracing.span("format_message"):
+            formatted = format_message(text, format_type)
+        with tracing.span("validate_html"):
+            formatted, parse_mode, issues = prepare_html(formatted)
+    finally:
+        tracing.end_trace(trace, export=False)
+
+    warnings = list(issues)
+    if parse_mode is None and formatted:
+        warnings.append("разметку не удалось исправить, сообщение уйдет простым текстом")
+
+    length = visible_length(formatted) if parse_mode else len(formatted.encode("utf-16-le")) // 2
+    parts = max(1, -(-length // TELEGRAM_MESSAGE_LIMIT))
+    if parts > 1:
+        warnings.append(f"текст длиннее {TELEGRAM_MESSAGE_LIMIT} символов, Telegram отклонит его одним сообщением")
+    if not formatted:
+        warnings.append("после форматирования текст пуст")
+
+    tags = Counter(_OPEN_TAG_RE.findall(formatted)) if parse_mode else Counter()
+    stages = {name: round(ms, 3) for name, ms in trace.stage_times().items()}
+    return RenderReport(
+        format_type=format_type,
+        text=formatted,
+        parse_mode=parse_mode,
+        length=length,
+        html_length=len(formatted),
+        tags=dict(tags),
+        parts=parts,
+        stages=stages,
+        total_ms=round(trace.duration * 1000, 3),
+        warnings=warnings,
+    )
+
+
+def render_reports(texts: Iterable[str], format_type: str = 'markdown') -> List[RenderReport]:
+    """Пакетный пробный рендеринг: по отчету на каждый текст."""
+    return [render_report(text, format_type) for text in texts]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Пробный рендеринг черновиков без отправки в Telegram")
+    parser.add_argument("files", nargs="*", help="Файлы с текстами (по умолчанию stdin)")
+    parser.add_argument("--format", default="markdown", choices=["markdown", "modern", "html", "plain"])
+    parser.add_argument("--json", action="store_true", help="Отчеты в JSONL вместо текста")
+    args = parser.parse_args(argv)
+
+    sources = [(path, open(path, encoding="utf-8").read()) for path in args.files] or [("<stdin>", sys.stdin.read())]
+    for (name, _), report in zip(sources, render_reports([text for _, text in sources], args.format)):
+        if args.json:
+            print(json.dumps({"file": name, **report.to_dict()}, ensure_ascii=False))
+        else:
+            print(f"== {name}\n{report.format()}\n")
+
+
+if __name__ == "__main__":
+    main()
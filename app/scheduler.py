@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    due REAL NOT NULL,
+    user_id INTEGER,
+    origin_chat_id INTEGER NOT NULL,
+    target_chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    format_type TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_RELATIVE_TIME = re.compile(r'^\+(\d+)([smhd]?)$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, '': 60}
+
+
+def parse_schedule_time(args: List[str], now: Optional[datetime] = None) -> Tuple[float, int]:
+    """
+    Разбирает время публикации из аргументов команды.
+
+    Поддерживаются форматы: `+30m`, `+2h`, `+1d` (относительно текущего момента,
+    без единицы - минуты), `HH:MM` (ближайшее такое время) и `YYYY-MM-DD HH:MM`.
+    Время указывается в часовом поясе сервера.
+
+    Args:
+        args: Аргументы команды.
+        now: Текущее время (для тестов).
+
+    Returns:
+        Tuple[float, int]: Время публикации (unix time) и количество использованных аргументов.
+
+    Raises:
+        ValueError: Если время не распознано.
+    """
+    if not args:
+        raise ValueError("Не указано время публикации")
+
+    now = now or datetime.now()
+    first = args[0]
+
+    match = _RELATIVE_TIME.match(first)
+    if match:
+        seconds = int(match.group(1)) * _UNITS[match.group(2)]
+        return (now + timedelta(seconds=seconds)).timestamp(), 1
+
+    if len(args) >= 2 and re.match(r'^\d{4}-\d{2}-\d{2}$', first):
+        due = datetime.strptime(f"{first} {args[1]}", "%Y-%m-%d %H:%M")
+        return due.timestamp(), 2
+
+    if re.match(r'^\d{1,2}:\d{2}$', first):
+        clock = datetime.strptime(first, "%H:%M")
+        due = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+        if due <= now:
+            due += timedelta(days=1)
+        return due.timestamp(), 1
+
+    raise ValueError(f"Не удалось распознать время: {first}")
+
+
+class Scheduler:
+    """
+    Планировщик отложенных публикаций.
+
+    Задания хранятся в SQLite и в минимальной куче по времени публикации.
+    Фоновая задача спит до ближайшего срока, поэтому число ожидающих заданий
+    не влияет на стоимость ожидания. Задания с одинаковой секундой публикации
+    выпускаются одной пачкой, а частоту отправки ограничивает общий
+    ограничитель запросов бота. Если задана `capacity`, пачка не больше
+    свободного места в очереди отправки; когда места нет, выпуск
+    откладывается на DEFER_INTERVAL секунд. Запросы к SQLite выполняются
+    в рабочих потоках.
+    """
+
+    # Через сколько секунд повторить выпуск, если очередь отправки заполнена
+    DEFER_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        path: str,
+        release: Callable[[Dict[str, Any]], Awaitable[None]],
+        capacity: Optional[Callable[[], Optional[int]]] = None
+    ):
+        self.path = path
+        self._release = release
+        self._capacity = capacity
+        self._conn: Optional[sqlite3.Connection] = None
+        # Соединение используется из разных рабочих потоков и закрывается при остановке
+        self._conn_lock = threading.Lock()
+        self._heap: List[Tuple[float, int]] = []
+        self._jobs: Dict[int, Dict[str, Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    async def start(self) -> None:
+        """Загружает сохраненные задания и запускает фоновую задачу."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        for job in await asyncio.to_thread(self._open):
+            self._jobs[job["id"]] = job
+            self._heap.append((job["due"], job["id"]))
+        heapq.heapify(self._heap)
+
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Планировщик запущен, заданий в очереди: {len(self._jobs)}")
+
+    def _open(self) -> List[Dict[str, Any]]:
+        """Открывает базу и читает сохраненные задания (в рабочем потоке)."""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        cursor = self._conn.execute("SELECT * FROM scheduled")
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _execute(self, sql: str, params: Any) -> Optional[int]:
+        """Выполняет запрос и возвращает lastrowid (в рабочем потоке)."""
+        with self._conn_lock:
+            if self._conn is None:
+                raise RuntimeError("Планировщик остановлен")
+            return self._conn.execute(sql, params).lastrowid
+
+    def _close(self) -> None:
+        with self._conn_lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    async def close(self) -> None:
+        """
+        Останавливает фоновую задачу. Невыполненные задания остаются в базе,
+        в том числе выпущенные, но еще не переданные в отправку: при следующем
+        запуске они загружаются снова.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self._close)
+
+    async def add(
+        self,
+        due: float,
+        origin_chat_id: int,
+        target_chat_id: int,
+        text: str,
+        format_type: str,
+        user_id: Optional[int] = None
+    ) -> int:
+        """
+        Добавляет задание и возвращает его ID.
+
+        Args:
+            due: Время публикации (unix time).
+            origin_chat_id: ID чата, в который отправить результат.
+            target_chat_id: ID чата для публикации.
+            text: Исходный текст сообщения.
+            format_type: Тип формата.
+            user_id: ID пользователя, создавшего задание.
+        """
+        job = {
+            "due": due,
+            "user_id": user_id,
+            "origin_chat_id": origin_chat_id,
+            "target_chat_id": target_chat_id,
+            "text": text,
+            "format_type": format_type,
+            "created_at": time.time(),
+        }
+        job["id"] = await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO scheduled (due, user_id, origin_chat_id, target_chat_id, text, format_type, created_at) "
+            "VALUES (:due, :user_id, :origin_chat_id, :target_chat_id, :text, :format_type, :created_at)",
+            job
+        )
+        self._jobs[job["id"]] = job
+
+        # Будим фоновую задачу, только если новое задание стало ближайшим
+        if not self._heap or due < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (due, job["id"]))
+        return job["id"]
+
+    async def cancel(self, job_id: int, user_id: Optional[int] = None) -> bool:
+        """
+        Отменяет задание. Запись в куче удаляется лениво, когда до нее дойдет очередь.
+
+        Returns:
+            bool: True, если задание найдено и отменено.
+        """
+        job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job["user_id"] != user_id):
+            return False
+        del self._jobs[job_id]
+        await asyncio.to_thread(self._execute, "DELETE FROM scheduled WHERE id = ?", (job_id,))
+        return True
+
+    def pending(self, user_id: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Ближайшие задания (всех или одного пользователя), отсортированные по времени."""
+        jobs = (job for job in self._jobs.values() if user_id is None or job["user_id"] == user_id)
+        return heapq.nsmallest(limit, jobs, key=lambda job: job["due"])
+
+    def _pop_due(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Извлекает задания (не больше `limit`), срок которых наступил в ту же секунду, что и у ближайшего."""
+        batch = []
+        if not self._heap:
+            return batch
+        cutoff = max(int(self._heap[0][0]) + 1, time.time())
+        while self._heap and self._heap[0][0] < cutoff and (limit is None or len(batch) < limit):
+            _, job_id = heapq.heappop(self._heap)
+            job = self._jobs.pop(job_id, None)
+            if job is not None:  # Отмененные задания пропускаем
+                batch.append(job)
+        return batch
+
+    async def _release_job(self, job: Dict[str, Any]) -> None:
+        # При отмене (остановка бота) задание остается в базе и будет выпущено после перезапуска
+        try:
+            await self._release(job)
+        except asyncio.CancelledError:
+            logger.info(f"Выпуск задания {job['id']} прерван остановкой, оно остается в базе")
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка публикации запланированного задания {job['id']}: {e}", exc_info=True)
+        await asyncio.to_thread(self._execute, "DELETE FROM scheduled WHERE id = ?", (job["id"],))
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            limit = self._capacity() if self._capacity else None
+            if limit == 0:
+                # Очередь отправки заполнена: задания остаются в куче и базе
+                logger.debug(f"Очередь отправки заполнена, выпуск заданий отложен на {self.DEFER_INTERVAL} с")
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.DEFER_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = self._pop_due(limit)
+            if batch:
+                logger.info(f"Публикуем {len(batch)} запланированных сообщений")
+                await asyncio.gather(*(self._release_job(job) for job in batch))
@@ -0,0 +1,229 @@
+"""
+Режим нескольких процессов: один приемник обновлений и N воркеров.
+
+Приемник получает обновления через getUpdates и раскладывает их по очередям
+воркеров по ID чата (для обновлений без чата - по ID пользователя). Все
+обновления одного чата попадают в один воркер и обрабатываются в нем по
+порядку, поэтому `user_states`, outbox, отложенные публикации и правки
+постов остаются согласованными внутри воркера. Воркеры запускают хендлеры
+из `setup_handlers` и делят через разделяемую память (`SharedPacer`) общий
+лимит бота и лимиты каналов из конфигурации (`CHANNEL_ID`, `TEST_CHAT_ID`):
+обновления распределяются по чату автора, а публикуют все воркеры в одни и
+те же каналы. Лимиты остальных чатов (личных чатов авторов) локальные,
+потому что такой чат всегда обслуживает один воркер. Каналы берутся из
+конфигурации на момент запуска.
+
+Включается переменной WORKERS > 1.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+from queue import Full
+from typing import List
+
+from telegram import Update
+
+from . import metrics, startup, tracing
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений приемник держит в очереди одного воркера, прежде чем ждать
+QUEUE_SIZE = 1000
+# Как часто приемник, ждущий места в очереди воркера, проверяет воркер и сигнал остановки (секунды)
+PUT_TIMEOUT = 1.0
+
+
+def shard_for(update: Update, workers: int) -> int:
+    """Номер воркера для обновления: по ID чата, а без чата - по ID пользователя."""
+    if update.effective_chat:
+        key = update.effective_chat.id
+    elif update.effective_user:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return key % workers
+
+
+def _worker_path(path: str, index: int) -> str:
+    """Путь к файлу воркера: traces.jsonl -> traces.w1.jsonl."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{index}{ext}"
+
+
+async def _run_worker(index: int, queue, pacer_state, chat_states) -> None:
+    # Импортируем здесь: модуль __main__ настраивает логирование при импорте,
+    # поэтому файлы логов воркера назначаем после него
+    from .__main__ import register_gauges, setup_application, start_bot, stop_bot
+    from .memstats import MemoryMonitor
+    from .ratelimit import GLOBAL_RATE, SharedPacer, chat_limits
+    from .utils import setup_logging
+    from .watchdog import Watchdog
+
+    setup_logging(suffix=f".w{index}")
+
+    loop = asyncio.get_running_loop()
+    global_pacer = SharedPacer(GLOBAL_RATE, burst=int(GLOBAL_RATE), state=pacer_state)
+    chat_pacers = {}
+    for chat_id, state in chat_states.items():
+        rate, burst = chat_limits(chat_id)
+        chat_pacers[chat_id] = SharedPacer(rate, burst=burst, state=state)
+    application = setup_application(updater=False, global_pacer=global_pacer, chat_pacers=chat_pacers)
+    watchdog = Watchdog(config.HANDLER_BUDGET, config.LOOP_LAG_THRESHOLD)
+    memory = MemoryMonitor(config.MEMSTATS_INTERVAL, config.MEMORY_TRACE)
+    metrics_server = None
+    try:
+        await watchdog.start()
+        tracing.configure(config.TRACE_SAMPLE_RATE, _worker_path(config.TRACE_FILE, index))
+        await start_bot(application, watchdog, polling=False, data_dir=os.path.join(config.DATA_DIR, f"shard-{index}"))
+        application.bot_data["memory"] = memory
+        await memory.start({None: application})
+        register_gauges([application])
+        if config.METRICS_PORT:
+            # Метрики воркера на соседнем порту: METRICS_PORT + 1 + номер воркера
+            metrics_server = await metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT + 1 + index)
+        logger.info(f"Воркер {index} запущен")
+
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    except Exception as e:
+        logger.error(f"Ошибка в воркере {index}: {e}", exc_info=True)
+    finally:
+        if metrics_server:
+            metrics_server.close()
+        await stop_bot(application)
+        await memory.stop()
+        await watchdog.stop()
+        await asyncio.to_thread(tracing.flush)
+        logger.info(f"Воркер {index} остановлен")
+
+
+def _worker_main(index: int, queue, pacer_state, chat_states) -> None:
+    """Точка входа процесса-воркера."""
+    # Останавливает воркер приемник (через очередь), а не Ctrl+C в терминале
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, queue, pacer_state, chat_states))
+
+
+async def run_sharded(workers: int) -> None:
+    """
+    Запускает воркеры и получает для них обновления.
+
+    Args:
+        workers: Число процессов-воркеров.
+    """
+    from .__main__ import setup_application
+    from .ratelimit import SharedPacer, GLOBAL_RATE
+
+    context = multiprocessing.get_context("spawn")
+    pacer_state = SharedPacer(GLOBAL_RATE).state
+    # Каналы, в которые публикуют все воркеры: у каждого общий для процессов лимит
+    chat_states = {
+        chat_id: context.Value("d", 0.0)
+        for chat_id in dict.fromkeys((config.CHANNEL_ID, config.TEST_CHAT_ID)) if chat_id
+    }
+    queues = [context.Queue(QUEUE_SIZE) for _ in range(workers)]
+    processes: List[multiprocessing.Process] = []
+    for index, queue in enumerate(queues):
+        process = context.Process(
+            target=_worker_main, args=(index, queue, pacer_state, chat_states), name=f"worker-{index}"
+        )
+        process.start()
+        processes.append(process)
+    logger.info(f"Запущено воркеров: {workers}")
+
+    loop = asyncio.get_running_loop()
+    application = setup_application()
+    stop_signal = asyncio.Event()
+    metrics_server = None
+    routed = [0] * workers
+
+    def signal_handler(sig, frame):
+        logger.info("Получен сигнал остановки, завершаю работу...")
+        loop.call_soon_threadsafe(stop_signal.set)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    async def route(index: int, data) -> bool:
+        """
+        Кладет обновление в очередь воркера, ожидая места не блокируя цикл.
+
+        Returns:
+            bool: False, если место не освободилось до сигнала остановки.
+
+        Raises:
+            RuntimeError: Если воркер завершился.
+        """
+        process = processes[index]
+        while True:
+            if not process.is_alive():
+                raise RuntimeError(f"Воркер {index} завершился с кодом {process.exitcode}")
+            try:
+                await loop.run_in_executor(None, functools.partial(queues[index].put, data, timeout=PUT_TIMEOUT))
+                return True
+            except Full:
+                if stop_signal.is_set():
+                    return False
+                logger.warning(f"Очередь воркера {index} заполнена, жду освобождения места")
+
+    try:
+        # Приемник только получает обновления: Application не запускается,
+        # очередь обновлений разбирается здесь
+        await application.initialize()
+        metrics.QUEUE_DEPTH.set_function(lambda: {
+            (f"worker_{index}",): queue.qsize() for index, queue in enumerate(queues)
+        })
+        if config.METRICS_PORT:
+            metrics_server = await metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+        await application.updater.start_polling()
+        logger.info("Приемник обновлений запущен")
+        startup.mark("ready")
+
+        stop_task = asyncio.ensure_future(stop_signal.wait())
+        while not stop_signal.is_set():
+            get_task = asyncio.ensure_future(application.update_queue.get())
+            done, _ = await asyncio.wait({get_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+            if get_task not in done:
+                get_task.cancel()
+                break
+            update = get_task.result()
+            if not isinstance(update, Update):
+                continue
+            index = shard_for(update, workers)
+            routed[index] += 1
+            # Очередь воркера ограничена: если он не успевает, приемник ждет, не блокируя цикл
+            if not await route(index, update.to_dict()):
+                logger.warning(f"Обновление {update.update_id} не передано воркеру {index}: получен сигнал остановки")
+                break
+            for process_index, process in enumerate(processes):
+                if not process.is_alive():
+                    raise RuntimeError(f"Воркер {process_index} завершился с кодом {process.exitcode}")
+    except Exception as e:
+        logger.error(f"Ошибка приемника обновлений: {e}", exc_info=True)
+    finally:
+        if metrics_server:
+            metrics_server.close()
+        if application.updater.running:
+            await application.updater.stop()
+        await application.shutdown()
+        # Воркеры дорабатывают уже полученные обновления и завершаются
+        for queue, process in zip(queues, processes):
+            if process.is_alive():
+                try:
+                    await loop.run_in_executor(None, functools.partial(queue.put, None, timeout=30))
+                except Full:
+                    logger.warning(f"Очередь воркера {process.name} переполнена")
+        for process in processes:
+            await loop.run_in_executor(None, process.join, 30)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не завершился за 30 с, останавливаю")
+                process.terminate()
+        logger.info(f"Обновлений по воркерам: {routed}")
@@ -0,0 +1,214 @@
+"""
+Профиль запуска бота.
+
+Во время работы `mark(stage)` отмечает этапы запуска: импорт модулей,
+готовность к приему обновлений и первое обработанное обновление. Время
+отсчитывается от импорта этого модуля (первая строка app/__main__.py),
+пишется в лог и в метрику publisher_startup_seconds.
+
+Отчет без Telegram:
+    python -m app.startup --top 15 --budget-ms 1500
+    python -m app.startup --first-update --first-update-budget-ms 3000
+
+Первый вариант импортирует модуль в отдельном интерпретаторе с `-X importtime`
+и показывает самые тяжелые импорты. Второй запускает бота против поддельного
+Bot API и замеряет время от запуска процесса до ответа на первое обновление.
+При превышении бюджета команда завершается с кодом 1, поэтому ее можно
+запускать в CI.
+"""
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+
+# Этап запуска -> секунды от начала запуска
+stages: Dict[str, float] = {}
+
+
+def mark(stage: str) -> None:
+    """Отмечает этап запуска (повторные отметки того же этапа игнорируются)."""
+    if stage in stages:
+        return
+    elapsed = time.perf_counter() - _started
+    stages[stage] = elapsed
+    from . import metrics
+    metrics.STARTUP_SECONDS.set(elapsed, stage=stage)
+    logger.info(f"Запуск: {stage} через {elapsed * 1000:.0f} мс")
+
+
+def isolated_env(directory: str) -> Dict[str, str]:
+    """
+    Окружение для запуска бота в замерах: без .env, с тестовым токеном и
+    каталогами данных и логов в `directory`, чтобы замер работал в чистом CI
+    и не трогал рабочие данные.
+    """
+    import os
+
+    from .loadtest import FIRST_USER_ID
+
+    env = dict(os.environ)
+    env.update({
+        "ENV_FILE": os.path.join(directory, "missing.env"),
+        "BOT_TOKEN": "123456:startup",
+        "ADMIN_IDS": str(FIRST_USER_ID),
+        "CHANNEL_ID": "-1001000000000",
+        "DATA_DIR": os.path.join(directory, "data"),
+        "LOG_DIR": os.path.join(directory, "logs"),
+        "METRICS_PORT": "0",
+        "WORKERS": "0",
+        "TENANTS_FILE": "",
+    })
+    return env
+
+
+def import_profile(module: str):
+    """
+    Импортирует модуль в отдельном интерпретаторе с `-X importtime`.
+
+    Интерпретатор получает изолированное окружение (`isolated_env`): модуль
+    app.__main__ при импорте читает конфигурацию и настраивает логи.
+
+    Returns:
+        Tuple[float, List[Tuple[str, int, int, int]]]: Время работы интерпретатора (мс)
+        и записи (модуль, собственное время мкс, суммарное время мкс, глубина вложенности).
+    """
+    import subprocess
+    import sys
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = isolated_env(directory)
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, env=env
+        )
+        wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Не удалось импортировать {module}: {errors[-1] if errors else result.returncode}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return wall_ms, entries
+
+
+def format_import_profile(module: str, wall_ms: float, entries, top: int = 15) -> str:
+    by_name = {name: cumulative for name, _, cumulative, _ in entries}
+    lines = [
+        f"Импорт {module}: {by_name.get(module, 0) / 1000:.1f} мс, "
+        f"запуск интерпретатора с импортом: {wall_ms:.1f} мс, модулей: {len(entries)}",
+        "",
+        "Пакеты верхнего уровня (суммарно, мс):",
+    ]
+    packages: Dict[str, int] = {}
+    for name, self_us, _, _ in entries:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    for package, total in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"  {total / 1000:8.1f}  {package}")
+    lines.append("")
+    lines.append("Самые медленные модули (собственное время, мс):")
+    for name, self_us, cumulative_us, _ in sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]:
+        lines.append(f"  {self_us / 1000:8.1f}  {name} (с зависимостями {cumulative_us / 1000:.1f})")
+    return "\n".join(lines)
+
+
+async def measure_first_update(timeout: float = 30.0) -> float:
+    """
+    Запускает `python -m app` против поддельного Bot API и ждет ответа на первое обновление.
+
+    Бот получает отдельные каталоги данных и логов и не читает .env, поэтому
+    замер не трогает рабочие данные.
+
+    Returns:
+        float: Секунды от запуска процесса до первого запроса бота в ответ на обновление.
+    """
+    import asyncio
+    import sys
+    import tempfile
+
+    from .fakeapi import FakeBotAPI
+    from .loadtest import FIRST_USER_ID
+
+    # Запросы, которые бот делает при запуске сам, без обновлений
+    service_methods = {"getMe", "getUpdates", "deleteWebhook", "getWebhookInfo", "setMyCommands", "close", "logOut"}
+
+    api = FakeBotAPI()
+    await api.start("127.0.0.1", 0)
+    port = api._server.sockets[0].getsockname()[1]
+    api.add_update({
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": FIRST_USER_ID, "type": "private"},
+            "from": {"id": FIRST_USER_ID, "is_bot": False, "first_name": "startup"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        }
+    })
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = isolated_env(directory)
+        env["TELEGRAM_API_URL"] = f"http://127.0.0.1:{port}"
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "app", env=env,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        try:
+            while time.perf_counter() - started < timeout:
+                if any(request["method"] not in service_methods for request in list(api.requests)):
+                    return time.perf_counter() - started
+                if process.returncode is not None:
+                    raise RuntimeError(f"Бот завершился с кодом {process.returncode} до первого обновления")
+                await asyncio.sleep(0.01)
+            raise TimeoutError(f"Бот не ответил на первое обновление за {timeout} с")
+        finally:
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+            await api.close()
+
+
+def main() -> None:
+    import argparse
+    import asyncio
+    import sys
+
+    parser = argparse.ArgumentParser(description="Профиль запуска бота")
+    parser.add_argument("--module", default="app.__main__", help="Какой модуль импортировать для профиля")
+    parser.add_argument("--top", type=int, default=15, help="Сколько модулей и пакетов показать")
+    parser.add_argument("--budget-ms", type=float, default=0, help="Бюджет времени импорта модуля (0 - без проверки)")
+    parser.add_argument("--first-update", action="store_true", help="Замерить время до ответа на первое обновление")
+    parser.add_argument("--first-update-budget-ms", type=float, default=0, help="Бюджет времени до первого обновления")
+    args = parser.parse_args()
+
+    failed = False
+    wall_ms, entries = import_profile(args.module)
+    print(format_import_profile(args.module, wall_ms, entries, args.top))
+    import_ms = next((cumulative for name, _, cumulative, _ in entries if name == args.module), 0) / 1000
+    if args.budget_ms and import_ms > args.budget_ms:
+        print(f"\n❌ Импорт {args.module} занял {import_ms:.1f} мс при бюджете {args.budget_ms:.0f} мс")
+        failed = True
+
+    if args.first_update or args.first_update_budget_ms:
+        first_update_ms = asyncio.run(measure_first_update()) * 1000
+        print(f"\nДо ответа на первое обновление: {first_update_ms:.0f} мс")
+        if args.first_update_budget_ms and first_update_ms > args.first_update_budget_ms:
+            print(f"❌ Бюджет {args.first_update_budget_ms:.0f} мс превышен")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
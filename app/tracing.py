@@ -0,0 +1,303 @@
+"""
+Легковесная трассировка обработки обновлений.
+
+Каждое отобранное обновление получает trace id, а участки кода внутри
+`span(...)` записываются с временем начала и длительностью. Готовые трассы
+пишутся буферизованно в JSONL-файл с ротацией. Если обновление не отобрано,
+`span` сводится к одной проверке контекстной переменной.
+
+Анализ трасс: python -m app.tracing /opt/telegram-publisher-bot/logs/traces.jsonl --top 10
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Трасса одного обновления: набор вложенных участков с таймингами."""
+
+    __slots__ = ("trace_id", "name", "attrs", "started_at", "_started", "duration", "spans", "_token", "_span_token")
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[Dict[str, Any]] = []
+        self._token = None
+        self._span_token = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+    def stage_times(self) -> Dict[str, float]:
+        """Суммарное время (мс) по именам участков."""
+        totals: Dict[str, float] = defaultdict(float)
+        for item in self.spans:
+            totals[item["name"]] += item["duration_ms"]
+        return dict(totals)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+# Индекс открытого участка в trace.spans. Задачи, запущенные внутри участка (asyncio.gather,
+# to_thread), получают копию контекста, поэтому у параллельных участков свои родители
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+
+
+class TraceWriter:
+    """
+    Буферизованная запись трасс в JSONL-файл с ротацией по размеру.
+
+    Готовые трассы копятся в буфере, а сериализацию и запись заполненных
+    буферов выполняет фоновый поток, чтобы диск не задерживал цикл событий.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 5 * 1024 * 1024, backup_count: int = 3, buffer_size: int = 64):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self._buffer: List[Trace] = []
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[List[Trace]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, trace: Trace) -> None:
+        with self._lock:
+            self._buffer.append(trace)
+            if len(self._buffer) < self.buffer_size:
+                return
+            traces, self._buffer = self._buffer, []
+        self._queue.put(traces)
+
+    def flush(self) -> None:
+        """Отдает буфер фоновому потоку и ждет, пока все трассы будут записаны."""
+        with self._lock:
+            traces, self._buffer = self._buffer, []
+        if traces:
+            self._queue.put(traces)
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            traces = self._queue.get()
+            try:
+                self._write_lines([json.dumps(trace.to_dict(), ensure_ascii=False, default=str) for trace in traces])
+            except Exception as e:
+                logger.error(f"Ошибка записи трасс в {self.path}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self) -> None:
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _write_lines(self, lines: List[str]) -> None:
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logger.error(f"Не удалось записать трассы в {self.path}: {e}")
+
+
+_sample_rate = 0.0
+_writer: Optional[TraceWriter] = None
+
+
+def configure(sample_rate: float, path: Optional[str] = None) -> None:
+    """
+    Включает трассировку.
+
+    Args:
+        sample_rate: Доля обновлений, которые трассируются (0 - выключено).
+        path: Путь к JSONL-файлу для готовых трасс.
+    """
+    global _sample_rate, _writer
+    _sample_rate = max(0.0, min(1.0, sample_rate))
+    if _sample_rate and path:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        _writer = TraceWriter(path)
+        logger.info(f"Трассировка включена: доля {_sample_rate}, файл {path}")
+
+
+def flush() -> None:
+    """Дописывает буфер трасс на диск и ждет записи (при остановке бота, вызывать из потока)."""
+    if _writer:
+        _writer.flush()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def start_trace(name: str, sampled: Optional[bool] = None, **attrs) -> Optional[Trace]:
+    """
+    Начинает трассу в текущем контексте.
+
+    Args:
+        name: Имя трассы (обычно имя хендлера).
+        sampled: Принудительно включить/выключить трассу; по умолчанию по доле отбора.
+
+    Returns:
+        Optional[Trace]: Трасса или None, если обновление не отобрано.
+    """
+    if sampled is None:
+        sampled = _sample_rate > 0 and random.random() < _sample_rate
+    if not sampled:
+        return None
+    trace = Trace(name, **attrs)
+    trace._token = _current_trace.set(trace)
+    trace._span_token = _current_span.set(None)
+    return trace
+
+
+def detach() -> None:
+    """
+    Отвязывает текущий контекст от трассы.
+
+    Вызывается в начале фоновой задачи, созданной из хендлера: задача получает
+    копию его контекста, но завершается позже, чем трасса будет записана.
+    """
+    _current_trace.set(None)
+    _current_span.set(None)
+
+
+def end_trace(trace: Optional[Trace], export: bool = True) -> None:
+    """Завершает трассу и отдает ее на запись."""
+    if trace is None:
+        return
+    trace.duration = time.perf_counter() - trace._started
+    if trace._token is not None:
+        _current_span.reset(trace._span_token)
+        _current_trace.reset(trace._token)
+        trace._token = trace._span_token = None
+    if export and _writer:
+        _writer.write(trace)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    """Замеряет участок кода, если текущее обновление трассируется."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    item = {
+        "name": name,
+        "parent": _current_span.get(),
+        "start_ms": round((time.perf_counter() - trace._started) * 1000, 3),
+        "duration_ms": 0.0,
+    }
+    if attrs:
+        item["attrs"] = attrs
+    trace.spans.append(item)
+    token = _current_span.set(len(trace.spans) - 1)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        item["error"] = type(e).__name__
+        raise
+    finally:
+        item["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        _current_span.reset(token)
+
+
+def _load_traces(paths: List[str]) -> List[Dict[str, Any]]:
+    traces = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        traces.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+    return traces
+
+
+def _self_times(trace: Dict[str, Any]) -> Dict[str, float]:
+    """Собственное время участков (без вложенных) по именам."""
+    spans = trace.get("spans", [])
+    own = [item["duration_ms"] for item in spans]
+    for item in spans:
+        if item.get("parent") is not None:
+            own[item["parent"]] -= item["duration_ms"]
+    totals: Dict[str, float] = defaultdict(float)
+    for item, value in zip(spans, own):
+        totals[item["name"]] += max(value, 0.0)
+    # Время вне участков относим к самой трассе
+    covered = sum(item["duration_ms"] for item in spans if item.get("parent") is None)
+    totals["(вне участков)"] = max(trace["duration_ms"] - covered, 0.0)
+    return totals
+
+
+def report(paths: List[str], top: int = 10) -> str:
+    """Текстовый отчет: самые медленные трассы и куда ушло их время."""
+    traces = _load_traces(paths)
+    if not traces:
+        return "Трассы не найдены"
+
+    traces.sort(key=lambda t: t["duration_ms"], reverse=True)
+    lines = [f"Трасс: {len(traces)}", "", f"Самые медленные ({min(top, len(traces))}):"]
+    for trace in traces[:top]:
+        attrs = " ".join(f"{k}={v}" for k, v in trace.get("attrs", {}).items())
+        lines.append(f"  {trace['duration_ms']:9.1f} мс  {trace['name']}  {trace['trace_id']}  {attrs}")
+        breakdown = sorted(_self_times(trace).items(), key=lambda kv: kv[1], reverse=True)
+        for name, value in breakdown[:5]:
+            if value > 0:
+                lines.append(f"      {value:9.1f} мс  {name}")
+
+    totals: Dict[str, float] = defaultdict(float)
+    for trace in traces:
+        for name, value in _self_times(trace).items():
+            totals[name] += value
+    grand_total = sum(totals.values()) or 1.0
+    lines += ["", "Собственное время по участкам (все трассы):"]
+    for name, value in sorted(totals.items(), key=lambda kv: kv[1], reverse=True):
+        lines.append(f"  {value:10.1f} мс  {value / grand_total:6.1%}  {name}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Анализ трасс обработки обновлений")
+    parser.add_argument("paths", nargs="+", help="JSONL-файлы с трассами")
+    parser.add_argument("--top", type=int, default=10, help="Сколько самых медленных трасс показать")
+    args = parser.parse_args()
+    print(report(args.paths, args.top))
+
+
+if __name__ == "__main__":
+    main()
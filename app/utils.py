@@ -1,15 +1,37 @@
+import hashlib
 import logging
 import os
 import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from logging.handlers import RotatingFileHandler
-import html  # Для экранирования HTML
+import html  # Для разбора HTML-сущностей
 
-from app.config import config
+from app.config import config, utf16_len
+from app import metrics
+from app.tracing import span
+from app.warmstart import register_cache
+from . import html as renderer, markdown as markdown_rules
 from .html import is_html_formatted, format_html, markdown_to_html, modern_to_html
 
 
+# Максимальная длина текста сообщения в Telegram (в единицах UTF-16 после разбора разметки)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_HTML_TAG_RE = re.compile(r'<[^>]*>')
+
+# Граница абзацев (пустая строка); разделитель сохраняется при разбиении
+_BLANK_LINE_RE = re.compile(r'(\n[ \t]*\n)')
+# Блок кода ``` (как его находит рендерер)
+_CODE_BLOCK_RE = re.compile(r'```.*?\n.*?```', re.DOTALL)
+
+# Сколько отрендеренных абзацев хранить в памяти
+RENDER_CACHE_SIZE = 2048
+
+
 class MessageFormattingError(Exception):
     """Ошибка форматирования сообщения."""
     pass
@@ -20,18 +42,29 @@ class FileSizeError(Exception):
     pass
 
 
-def setup_logging():
+class DuplicateMessageError(Exception):
+    """Такое сообщение уже было опубликовано в этом чате в пределах окна дедупликации."""
+    pass
+
+
+class ChannelUnavailableError(Exception):
+    """По кешу сведений о каналах бот не может публиковать в этом чате."""
+    pass
+
+
+def setup_logging(suffix: str = ''):
     """
     Настройка логирования с ротацией файлов.
     Создает два файла: основной лог и лог ошибок.
+    :param suffix: Суффикс имен файлов (у каждого процесса-воркера свои файлы, чтобы не мешать ротации).
     """
-    log_dir = '/opt/telegram-publisher-bot/logs'  # Используем абсолютный путь
+    log_dir = config.LOG_DIR  # По умолчанию /opt/telegram-publisher-bot/logs
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
 
     # Основной файл лога
     main_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'bot.log'),
+        os.path.join(log_dir, f'bot{suffix}.log'),
         maxBytes=1024 * 1024,  # 1 MB
         backupCount=5,
         encoding='utf-8'
@@ -39,7 +72,7 @@ def setup_logging():
 
     # Отдельный файл для ошибок
     error_handler = RotatingFileHandler(
-        os.path.join(log_dir, 'error.log'),
+        os.path.join(log_dir, f'error{suffix}.log'),
         maxBytes=1024 * 1024,  # 1 MB
         backupCount=3,
         encoding='utf-8'
@@ -76,25 +109,26 @@ def setup_logging():
 def format_bot_links(format_type: str = 'markdown') -> str:
     """
     Форматирование ссылок ботов и канала.
+    Подпись строится один раз для каждого снимка конфигурации, здесь она только берется из него.
     :param format_type: Тип форматирования (markdown, html, plain, modern).
     """
-    links = []
-
-    def format_link(name: str, url: str) -> str:
-        # Всегда используем HTML-формат для ссылок
-        name = html.escape(name)
-        url = html.escape(url)
-        return f'<a href="{url}">{name}</a>'
+    # Всегда используем HTML-формат для ссылок
+    return config.footer_html
 
-    # Добавляем ссылки в нужном порядке: PUBLIC | VPNLine | SUPPORT
-    if config.CHANNEL_LINK and config.CHANNEL_NAME:
-        links.append(format_link(config.CHANNEL_NAME, config.CHANNEL_LINK))
-    if config.MAIN_BOT_LINK and config.MAIN_BOT_NAME:
-        links.append(format_link(config.MAIN_BOT_NAME, config.MAIN_BOT_LINK))
-    if config.SUPPORT_BOT_LINK and config.SUPPORT_BOT_NAME:
-        links.append(format_link(config.SUPPORT_BOT_NAME, config.SUPPORT_BOT_LINK))
 
-    return ' | '.join(links) if links else ""
+def footer_entities(text: str) -> Optional[List[Dict[str, object]]]:
+    """
+    Ссылки подписи в виде entities для сообщения, которое уходит простым текстом.
+    Если разметку не удалось исправить, сообщение отправляется без parse_mode и от
+    HTML-подписи остаются только названия; entities возвращают им ссылки.
+    :param text: Текст сообщения без разметки.
+    :return: Entities text_link со смещениями от начала текста или None, если текст не заканчивается подписью.
+    """
+    footer = config.footer_plain
+    if not footer or not text.endswith(footer):
+        return None
+    start = utf16_len(text) - utf16_len(footer)
+    return [dict(entity, offset=entity["offset"] + start) for entity in config.footer_entities]
 
 
 def append_links_to_message(text: str, format_type: str = 'markdown') -> str:
@@ -109,9 +143,34 @@ def append_links_to_message(text: str, format_type: str = 'markdown') -> str:
     return text
 
 
+def visible_length(html_text: str) -> int:
+    """
+    Длина текста, который увидит получатель, без HTML-тегов и в единицах UTF-16.
+    Именно так Telegram применяет лимит длины сообщения.
+    :param html_text: Текст с HTML-разметкой.
+    """
+    return utf16_len(html.unescape(_HTML_TAG_RE.sub('', html_text)))
+
+
 def format_message(text: str, format_type: str = 'markdown') -> str:
     """
-    Форматирование сообщения с поддержкой разных форматов.
+    Форматирование сообщения с поддержкой разных форматов и добавлением ссылок.
+    :param text: Исходный текст.
+    :param format_type: Тип форматирования (markdown, html, plain, modern).
+    """
+    started = time.perf_counter()
+    with span("render", format_type=format_type):
+        body = format_message_body(text, format_type)
+    metrics.RENDER_SECONDS.observe(time.perf_counter() - started, format_type=format_type)
+    if not body:
+        return body
+    with span("render.footer"):
+        return append_links_to_message(body, format_type)
+
+
+def format_message_body(text: str, format_type: str = 'markdown') -> str:
+    """
+    Форматирование текста сообщения без подписи со ссылками.
     :param text: Исходный текст.
     :param format_type: Тип форматирования (markdown, html, plain, modern).
     """
@@ -131,27 +190,148 @@ def format_message(text: str, format_type: str = 'markdown') -> str:
             text = re.sub(r'\*(.*?)\*', r'\1', text)  # Убираем *курсив*
             text = re.sub(r'~~(.*?)~~', r'\1', text)  # Убираем ~~зачеркнутый~~
             text = re.sub(r'`(.*?)`', r'\1', text)  # Убираем `код`
-            return append_links_to_message(text, format_type)
+            return text
 
         if format_type == 'html':
-            text = format_html(text)
-            return append_links_to_message(text, format_type)
+            return format_html(text)
 
-        # Для markdown и modern режимов
+        # Для markdown и modern режимов рендерим по абзацам: неизменившиеся абзацы
+        # (повторные публикации, правки через /edit) берутся из кеша. Абзацы рендерятся
+        # без обрезки пробелов, а разделители остаются как в исходном тексте,
+        # поэтому результат совпадает с рендерингом всего текста целиком
         if format_type in ['markdown', 'modern']:
-            if format_type == 'markdown':
-                result = markdown_to_html(text)
-            else:
-                result = modern_to_html(text)
-
-            # Добавляем ссылки в конце сообщения
-            return append_links_to_message(result, format_type)
+            body = ''.join(render_block(block, format_type) + separator for block, separator in split_blocks(text))
+            body = body.strip()
+            if format_type == 'modern' and text:
+                body += "\n\n"
+            return body
 
     except Exception as e:
         logger.error(f"Ошибка форматирования сообщения: {e}", exc_info=True)
         raise MessageFormattingError(f"Ошибка форматирования: {str(e)}")
 
 
+def split_blocks(text: str) -> List[Tuple[str, str]]:
+    """
+    Разбивает текст на абзацы по пустым строкам, не разрывая блоки кода ```.
+    Если в тексте есть разметка, которую рендерер может продолжить за пустую
+    строку (`**` или `~~` на отдельной строке, незакрытые `~~` или `), текст
+    остается одним абзацем.
+    :param text: Исходный текст.
+    :return: Пары (абзац, разделитель после него).
+    """
+    if not _splittable(text):
+        return [(text, '')]
+
+    blocks = []
+    current = ''
+    fences = 0
+    parts = _BLANK_LINE_RE.split(text)
+    # Нечетные элементы - разделители: внутри блока кода они остаются частью абзаца
+    for index in range(0, len(parts), 2):
+        current += parts[index]
+        fences += parts[index].count('```')
+        separator = parts[index + 1] if index + 1 < len(parts) else ''
+        if fences % 2 == 0:
+            if current.strip():
+                blocks.append((current, separator))
+            elif blocks:
+                # Пустые строки подряд добавляем к разделителю предыдущего абзаца
+                blocks[-1] = (blocks[-1][0], blocks[-1][1] + current + separator)
+            current = ''
+        else:
+            current += separator
+    if current.strip():
+        blocks.append((current, ''))
+    return blocks
+
+
+def _splittable(text: str) -> bool:
+    """Можно ли рендерить текст по абзацам без изменения результата."""
+    for line in text.split('\n'):
+        # ** и ~~ на отдельной строке открывают многострочное выделение,
+        # а строка с непарными ~~ - многострочное зачеркивание
+        if line.strip() in ('**', '~~') or line.count('~~') % 2:
+            return False
+    # Инлайн-код `...` рендерер ищет по всему тексту, в том числе через пустые строки
+    for part in _BLANK_LINE_RE.split(_CODE_BLOCK_RE.sub('', text))[::2]:
+        if part.count('`') % 2:
+            return False
+    return True
+
+
+class RenderCache:
+    """
+    LRU-кеш отрендеренных абзацев: (абзац, формат) -> HTML.
+    В отличие от functools.lru_cache, содержимое можно выгрузить в снимок теплого перезапуска.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()  # inline-превью рендерятся в потоках
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple[str, str], value: str) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def dump(self) -> dict:
+        """Содержимое для снимка (от старых записей к новым) с отпечатком правил рендеринга."""
+        with self._lock:
+            entries = [(block, format_type, value) for (block, format_type), value in self._data.items()]
+        return {"renderer": renderer_fingerprint(), "entries": entries}
+
+    def load(self, content: dict) -> int:
+        """Загружает записи из снимка, если правила рендеринга с тех пор не менялись."""
+        if content.get("renderer") != renderer_fingerprint():
+            logger = logging.getLogger(__name__)
+            logger.info("Правила рендеринга изменились, кеш абзацев из снимка не используется")
+            return 0
+        for block, format_type, value in content.get("entries", []):
+            self.put((block, format_type), value)
+        return len(content.get("entries", []))
+
+
+def renderer_fingerprint() -> str:
+    """Отпечаток исходников рендеринга: кеш из снимка годится только для тех же правил."""
+    digest = hashlib.sha1()
+    for module in (renderer, markdown_rules):
+        with open(module.__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+register_cache("render", render_cache.dump, render_cache.load)
+
+
+def render_block(block: str, format_type: str) -> str:
+    """
+    Рендерит один абзац markdown/modern в HTML (с кешем по тексту абзаца и формату).
+    :param block: Абзац исходного текста.
+    :param format_type: Тип форматирования (markdown, modern).
+    """
+    key = (block, format_type)
+    rendered = render_cache.get(key)
+    if rendered is None:
+        rendered = modern_to_html(block, fragment=True) if format_type == 'modern' else markdown_to_html(block, fragment=True)
+        render_cache.put(key, rendered)
+    return rendered
+
+
 def check_file_size(size: int, max_size: Optional[int] = None) -> bool:
     """
     Проверка размера файла.
@@ -0,0 +1,278 @@
+import html
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Теги, которые понимает Telegram (https://core.telegram.org/bots/api#html-style)
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "span", "tg-spoiler", "a", "tg-emoji", "code", "pre", "blockquote",
+}
+
+# Разрешенные атрибуты тегов
+ALLOWED_ATTRIBUTES = {
+    "a": {"href"},
+    "code": {"class"},
+    "span": {"class"},
+    "tg-emoji": {"emoji-id"},
+    "blockquote": {"expandable"},
+}
+
+# Теги списков Telegram не поддерживает: сами теги убираем, пункты помечаем маркером
+_LIST_TAGS = {"ul", "ol", "li"}
+
+# Теги, внутри которых Telegram не допускает другую разметку (кроме code внутри pre)
+_VERBATIM_TAGS = {"code", "pre"}
+
+# Один проход по тексту: тег, HTML-сущность, которую понимает Telegram, или одиночный спецсимвол
+_TOKEN_RE = re.compile(
+    r'<(?P<close>/?)(?P<name>[A-Za-z][\w-]*)(?P<attrs>[^<>]*?)\s*/?>'
+    r'|(?P<entity>&(?:#\d+|#[xX][0-9a-fA-F]+|lt|gt|amp|quot);)'
+    r'|(?P<special>[<>&])'
+)
+_ATTR_RE = re.compile(r'([A-Za-z][\w-]*)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s"\'>]+))?')
+
+
+class _Open:
+    """Открытый тег в стеке балансировщика."""
+
+    __slots__ = ("name", "markup", "dropped")
+
+    def __init__(self, name: str, markup: str, dropped: bool = False):
+        self.name = name
+        self.markup = markup
+        self.dropped = dropped  # Тег выброшен: его закрывающий тег тоже не выводим
+
+
+def _parse_attributes(raw: str) -> Dict[str, Optional[str]]:
+    attributes = {}
+    for name, value in _ATTR_RE.findall(raw):
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        attributes[name.lower()] = html.unescape(value) if value else None
+    return attributes
+
+
+def _build_tag(name: str, raw_attributes: str, issues: List[str]) -> Optional[str]:
+    """
+    Собирает открывающий тег только с разрешенными атрибутами.
+
+    Returns:
+        Optional[str]: Тег или None, если без обязательного атрибута он бессмыслен.
+    """
+    attributes = _parse_attributes(raw_attributes)
+    allowed = ALLOWED_ATTRIBUTES.get(name, set())
+    extra = set(attributes) - allowed
+    if extra:
+        issues.append(f"<{name}>: удалены атрибуты {', '.join(sorted(extra))}")
+
+    if name == "a":
+        href = attributes.get("href")
+        if not href:
+            issues.append("<a> без href удален")
+            return None
+        return f'<a href="{html.escape(href, quote=True)}">'
+    if name == "span":
+        if attributes.get("class") != "tg-spoiler":
+            issues.append("<span> без class=\"tg-spoiler\" удален")
+            return None
+        return '<span class="tg-spoiler">'
+    if name == "tg-emoji":
+        emoji_id = attributes.get("emoji-id")
+        if not emoji_id or not emoji_id.isdigit():
+            issues.append("<tg-emoji> без emoji-id удален")
+            return None
+        return f'<tg-emoji emoji-id="{emoji_id}">'
+    if name == "code":
+        language = attributes.get("class") or ""
+        if language.startswith("language-") and re.fullmatch(r'language-[\w+#.-]+', language):
+            return f'<code class="{language}">'
+        return "<code>"
+    if name == "blockquote" and "expandable" in attributes:
+        return "<blockquote expandable>"
+    return f"<{name}>"
+
+
+class HtmlSanitizer:
+    """
+    Потоковый санитайзер HTML по белому списку Telegram.
+
+    Текст можно подавать частями через `feed`: каждая часть обрабатывается
+    одним проходом токенизатора, а незавершенный хвост (например, `<b` или
+    `&am` на границе частей) придерживается до следующей части. Поддерживаемые
+    теги выводятся в каноническом виде только с разрешенными атрибутами,
+    неподдерживаемые теги и одиночные `<`, `>`, `&` экранируются,
+    перекрывающиеся теги (`<b><i></b></i>`) закрываются и переоткрываются,
+    а разметка внутри `code`/`pre` и вложенные `blockquote`/`a` убираются
+    с сохранением текста. Незакрытые теги закрываются в `close`.
+    """
+
+    def __init__(self):
+        self.issues: List[str] = []
+        self._stack: List[_Open] = []
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        """Обрабатывает очередную часть текста и возвращает готовый HTML."""
+        data = self._pending + chunk
+        cut = len(data)
+        # Хвост, который может оказаться началом тега или сущности, ждет следующей части
+        last_lt = data.rfind("<")
+        if last_lt != -1 and data.find(">", last_lt) == -1:
+            cut = last_lt
+        last_amp = data.rfind("&", 0, cut)
+        if last_amp != -1 and len(data) - last_amp <= 10 and data.find(";", last_amp) == -1:
+            cut = min(cut, last_amp)
+        self._pending = data[cut:]
+        return self._process(data[:cut])
+
+    def close(self) -> str:
+        """Обрабатывает остаток текста и закрывает незакрытые теги."""
+        out = self._process(self._pending)
+        self._pending = ""
+        unclosed = [item.name for item in self._stack if not item.dropped]
+        self._stack = []
+        if unclosed:
+            self.issues.append("незакрытые теги закрыты: " + ", ".join(unclosed))
+            out += "".join(f"</{name}>" for name in reversed(unclosed))
+        return out
+
+    def _process(self, text: str) -> str:
+        out: List[str] = []
+        issues = self.issues
+        stack = self._stack
+        position = 0
+
+        for match in _TOKEN_RE.finditer(text):
+            out.append(text[position:match.start()])
+            position = match.end()
+
+            if match.group("entity"):
+                out.append(match.group("entity"))
+                continue
+
+            special = match.group("special")
+            if special:
+                out.append(html.escape(special))
+                issues.append(f"экранирован символ {special}")
+                continue
+
+            name = match.group("name").lower()
+            token = match.group(0)
+            is_close = bool(match.group("close"))
+
+            if name == "br":
+                out.append("\n")
+                issues.append("<br> заменен переводом строки")
+                continue
+
+            if name in _LIST_TAGS:
+                if name == "li" and not is_close:
+                    out.append("• ")
+                issues.append(f"тег списка {token} заменен текстом")
+                continue
+
+            if name not in ALLOWED_TAGS:
+                out.append(html.escape(token))
+                issues.append(f"неподдерживаемый тег {token} экранирован")
+                continue
+
+            if not is_close:
+                open_names = [item.name for item in stack if not item.dropped]
+                markup = _build_tag(name, match.group("attrs"), issues)
+                if markup is None:
+                    stack.append(_Open(name, "", dropped=True))
+                    continue
+                inside_verbatim = any(n in _VERBATIM_TAGS for n in open_names)
+                if inside_verbatim and not (name == "code" and open_names and open_names[-1] == "pre"):
+                    issues.append(f"<{name}> внутри code/pre удален")
+                    stack.append(_Open(name, markup, dropped=True))
+                    continue
+                if name in ("blockquote", "a") and name in open_names:
+                    issues.append(f"вложенный <{name}> удален")
+                    stack.append(_Open(name, markup, dropped=True))
+                    continue
+                stack.append(_Open(name, markup))
+                out.append(markup)
+                continue
+
+            # Закрывающий тег: ищем ближайший открытый с тем же именем
+            index = len(stack) - 1
+            while index >= 0 and stack[index].name != name:
+                index -= 1
+            if index < 0:
+                issues.append(f"лишний закрывающий тег </{name}> удален")
+                continue
+
+            reopen = stack[index + 1:]
+            if reopen:
+                issues.append(f"перекрывающиеся теги вокруг </{name}> выровнены")
+            for item in reversed(reopen):
+                if not item.dropped:
+                    out.append(f"</{item.name}>")
+            closed = stack[index]
+            if not closed.dropped:
+                out.append(f"</{closed.name}>")
+            del stack[index:]
+            for item in reopen:
+                stack.append(item)
+                if not item.dropped:
+                    out.append(item.markup)
+
+        out.append(text[position:])
+        return "".join(out)
+
+
+def repair_html(text: str) -> Tuple[str, List[str]]:
+    """
+    Приводит HTML к виду, который примет Telegram, за один проход.
+
+    Args:
+        text: HTML-текст.
+
+    Returns:
+        Tuple[str, List[str]]: Исправленный текст и список исправлений (пустой, если текст был корректен).
+    """
+    sanitizer = HtmlSanitizer()
+    result = sanitizer.feed(text) + sanitizer.close()
+    return result, sanitizer.issues
+
+
+def sanitize_html(text: str) -> str:
+    """Оставляет в пользовательском HTML только то, что поддерживает Telegram."""
+    result, issues = repair_html(text)
+    if issues:
+        logger.info(f"HTML очищен: {'; '.join(issues[:10])}")
+    return result
+
+
+def check_html(text: str) -> List[str]:
+    """Проверяет HTML без исправления и возвращает список проблем."""
+    return repair_html(text)[1]
+
+
+def to_plain_text(text: str) -> str:
+    """Убирает теги и раскрывает HTML-сущности."""
+    return html.unescape(re.sub(r'<[^<>]*>', '', text))
+
+
+def prepare_html(text: str) -> Tuple[str, Optional[str], List[str]]:
+    """
+    Готовит текст к отправке с parse_mode=HTML.
+
+    Returns:
+        Tuple[str, Optional[str], List[str]]: Текст, режим парсинга ("HTML" или None
+        для простого текста, если исправить разметку не удалось) и список исправлений.
+    """
+    repaired, issues = repair_html(text)
+    if not issues:
+        return text, "HTML", issues
+
+    # Исправленный текст должен проходить проверку без замечаний
+    remaining = check_html(repaired)
+    if remaining:
+        logger.warning(f"Разметку не удалось исправить ({'; '.join(remaining)}), отправляем простым текстом")
+        return to_plain_text(text), None, issues + remaining
+    return repaired, "HTML", issues
@@ -0,0 +1,188 @@
+"""
+Теплый перезапуск.
+
+Смещение обновлений: ID обновления, до которого включительно все обновления
+обработаны, хранится в 8-байтовом файле `update_offset`, отображенном в память,
+и обновляется после каждого хендлера без системных вызовов. Хендлеры с
+block=False могут закончить позже следующих обновлений, поэтому смещение не
+проходит дальше самого раннего незавершенного обновления: обновления,
+завершенные вне очереди, после аварийной остановки обрабатываются повторно,
+но ни одно незавершенное не считается обработанным. Если процесс убит до того,
+как getUpdates подтвердил пачку обновлений, Telegram пришлет их снова, и уже
+обработанные будут пропущены.
+
+Снимок: при штатной остановке кеши (зарегистрированные через `register_cache`
+или, для кешей одного бота, через `WarmState.add_cache`)
+и обновления, которые не успели обработать до дедлайна, пишутся в компактный
+файл `warm.snapshot` (формат marshal). При запуске файл отображается в память
+и загружается обратно, а сохраненные обновления обрабатываются раньше новых.
+"""
+import logging
+import marshal
+import mmap
+import os
+import struct
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+_OFFSET = struct.Struct("<q")
+
+# Повторно Telegram присылает только последнюю неподтвержденную пачку (до 100 обновлений).
+# ID намного меньше смещения означает, что Telegram начал нумерацию заново
+# (так бывает после недели без обновлений)
+REDELIVERY_WINDOW = 1000
+
+# Кеши, которые переживают перезапуск: имя -> (выгрузка, загрузка)
+_caches: Dict[str, Tuple[Callable[[], Any], Callable[[Any], int]]] = {}
+
+
+def register_cache(name: str, dump: Callable[[], Any], load: Callable[[Any], int]) -> None:
+    """
+    Регистрирует кеш для снимка.
+
+    Args:
+        name: Имя кеша в снимке.
+        dump: Возвращает содержимое кеша из простых типов (str, int, float, list, tuple, dict).
+        load: Загружает содержимое обратно и возвращает число восстановленных записей.
+    """
+    _caches[name] = (dump, load)
+
+
+class WarmState:
+    """Смещение обработанных обновлений и снимок кешей одного бота."""
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.offset_path = os.path.join(data_dir, "update_offset")
+        self.snapshot_path = os.path.join(data_dir, "warm.snapshot")
+        self.offset = 0  # Обновления с update_id не больше этого уже обработаны
+        # Обновления в обработке (ID -> число хендлеров) и завершенные раньше них
+        self._in_flight: Dict[int, int] = {}
+        self._completed: Set[int] = set()
+        self.caches = dict(_caches)
+        self.pending: List[Dict[str, Any]] = []
+        self._offset_file = None
+        self._offset_map: Optional[mmap.mmap] = None
+
+    def open(self) -> None:
+        """Открывает файл смещения и загружает снимок, если он есть."""
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._offset_file = open(self.offset_path, "a+b")
+        if os.path.getsize(self.offset_path) < _OFFSET.size:
+            self._offset_file.truncate(_OFFSET.size)
+        self._offset_map = mmap.mmap(self._offset_file.fileno(), _OFFSET.size)
+        self.offset = _OFFSET.unpack_from(self._offset_map)[0]
+        self._load_snapshot()
+
+    def add_cache(self, name: str, dump: Callable[[], Any], load: Callable[[Any], int]) -> None:
+        """Регистрирует кеш только этого бота (вызывать до `open`), аргументы как у `register_cache`."""
+        self.caches[name] = (dump, load)
+
+    def started(self, update_id: int) -> None:
+        """Отмечает, что обновление передано хендлеру с block=False (при разборе, до запуска задачи)."""
+        self._in_flight[update_id] = self._in_flight.get(update_id, 0) + 1
+
+    def processed(self, update_id: int) -> None:
+        """
+        Отмечает обновление как обработанное (вызывается после каждого хендлера).
+
+        Смещение переходит к самому позднему завершенному обновлению, которое
+        раньше всех еще выполняющихся. Обновление, не отмеченное через `started`,
+        считается завершенным сразу.
+        """
+        remaining = self._in_flight.pop(update_id, 0) - 1
+        if remaining > 0:
+            self._in_flight[update_id] = remaining
+            return
+        self._completed.add(update_id)
+        lowest = min(self._in_flight, default=None)
+        ready = [done for done in self._completed if lowest is None or done < lowest]
+        if not ready:
+            return
+        self._completed.difference_update(ready)
+        latest = max(ready)
+        if latest > self.offset or self.offset - latest >= REDELIVERY_WINDOW:
+            self.offset = latest
+            if self._offset_map is not None:
+                _OFFSET.pack_into(self._offset_map, 0, latest)
+
+    def is_processed(self, update_id: int) -> bool:
+        return 0 <= self.offset - update_id < REDELIVERY_WINDOW
+
+    def take_pending(self) -> List[Dict[str, Any]]:
+        """Обновления из снимка, которые нужно обработать до новых."""
+        pending, self.pending = self.pending, []
+        return [data for data in pending if not self.is_processed(data.get("update_id", 0))]
+
+    def _load_snapshot(self) -> None:
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) == 0:
+            return
+        started = time.perf_counter()
+        try:
+            with open(self.snapshot_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                snapshot = marshal.loads(data)
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            # Например, снимок записан другой версией Python
+            logger.warning(f"Снимок {self.snapshot_path} не прочитан, запуск с холодными кешами: {e}")
+            return
+        if not isinstance(snapshot, dict) or snapshot.get("format") != SNAPSHOT_FORMAT:
+            logger.warning(f"Снимок {self.snapshot_path} в неизвестном формате, пропускаем")
+            return
+
+        self.offset = max(self.offset, snapshot.get("offset", 0))
+        self.pending = list(snapshot.get("pending", []))
+        loaded = []
+        for name, content in snapshot.get("caches", {}).items():
+            if name not in self.caches:
+                continue
+            try:
+                loaded.append(f"{name} {self.caches[name][1](content)}")
+            except Exception as e:
+                logger.warning(f"Кеш {name} из снимка не загружен: {e}")
+        age = time.time() - snapshot.get("saved_at", time.time())
+        logger.info(
+            f"Снимок загружен за {(time.perf_counter() - started) * 1000:.1f} мс (возраст {age:.0f} с): "
+            f"{', '.join(loaded) or 'кеши пусты'}, необработанных обновлений {len(self.pending)}"
+        )
+
+    def save(self, pending: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Атомарно записывает снимок кешей и необработанных обновлений."""
+        caches = {}
+        for name, (dump, _) in self.caches.items():
+            try:
+                caches[name] = dump()
+            except Exception as e:
+                logger.warning(f"Кеш {name} не попал в снимок: {e}")
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "saved_at": time.time(),
+            "offset": self.offset,
+            "pending": pending or [],
+            "caches": caches,
+        }
+        temporary = self.snapshot_path + ".tmp"
+        try:
+            with open(temporary, "wb") as f:
+                marshal.dump(snapshot, f)
+            os.replace(temporary, self.snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось записать снимок {self.snapshot_path}: {e}")
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        logger.info(
+            f"Снимок записан: {os.path.getsize(self.snapshot_path)} байт, "
+            f"необработанных обновлений {len(snapshot['pending'])}, смещение {self.offset}"
+        )
+
+    def close(self) -> None:
+        if self._offset_map is not None:
+            self._offset_map.flush()
+            self._offset_map.close()
+            self._offset_map = None
+        if self._offset_file is not None:
+            self._offset_file.close()
+            self._offset_file = None
@@ -0,0 +1,234 @@
+import asyncio
+import itertools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько кадров стека сохранять в снимке
+STACK_DEPTH = 12
+
+
+class _ActiveHandler:
+    """Выполняющийся хендлер."""
+
+    __slots__ = ("name", "update_id", "started", "task", "stack", "flagged")
+
+    def __init__(self, name: str, update_id: Optional[int], task: Optional[asyncio.Task]):
+        self.name = name
+        self.update_id = update_id
+        self.started = time.monotonic()
+        self.task = task
+        self.stack: Optional[str] = None
+        self.flagged = False
+
+
+def _format_frames(frames: List[Any]) -> str:
+    """Форматирует кадры (от внешнего к внутреннему) в текст стека."""
+    summary = traceback.StackSummary.extract(((f, f.f_lineno) for f in frames[-STACK_DEPTH:]), lookup_lines=True)
+    return "".join(summary.format())
+
+
+def _thread_stack(thread_id: int) -> Optional[str]:
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return None
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return _format_frames(frames)
+
+
+def _task_stack(task: Optional[asyncio.Task]) -> Optional[str]:
+    """Стек ожидания задачи: проходим по цепочке await до самой внутренней корутины."""
+    if task is None or task.done():
+        return None
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return _format_frames(frames) if frames else None
+
+
+class Watchdog:
+    """
+    Сторож цикла событий.
+
+    Фоновая задача в цикле событий каждые `interval` секунд замеряет, насколько
+    позже запланированного она просыпается (задержка цикла), и обновляет
+    отметку жизни. Отдельный поток следит за этой отметкой и за выполняющимися
+    хендлерами: если цикл не отвечает дольше `lag_threshold` или хендлер
+    превысил бюджет `budget`, поток снимает стек потока цикла (для
+    заблокированного цикла) или корутины хендлера (если он просто долго ждет).
+    """
+
+    def __init__(self, budget: float = 1.0, lag_threshold: float = 0.25, interval: float = 0.1, history: int = 20):
+        self.budget = budget
+        self.lag_threshold = lag_threshold
+        self.interval = interval
+        self.started_at = time.time()
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.slow_handlers = 0
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self._lags: Deque[Tuple[float, float]] = deque(maxlen=600)
+        self._active: Dict[int, _ActiveHandler] = {}
+        self._ids = itertools.count()
+        self._heartbeat = time.monotonic()
+        self._stall_event: Optional[Dict[str, Any]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def start(self) -> None:
+        """Запускает замер задержки цикла и поток-наблюдатель."""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._measure_lag())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Сторож цикла событий запущен: бюджет хендлера {self.budget} с, порог задержки {self.lag_threshold} с")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def handler_started(self, name: str, update_id: Optional[int] = None) -> int:
+        """Регистрирует начало работы хендлера и возвращает токен для handler_finished."""
+        token = next(self._ids)
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        self._active[token] = _ActiveHandler(name, update_id, task)
+        return token
+
+    def handler_finished(self, token: int) -> None:
+        handler = self._active.pop(token, None)
+        if handler is None:
+            return
+        elapsed = time.monotonic() - handler.started
+        if elapsed <= self.budget:
+            return
+
+        self.slow_handlers += 1
+        metrics.SLOW_HANDLERS.inc(handler=handler.name)
+        self._record("slow_handler", elapsed, handler.stack, handler=handler.name, update_id=handler.update_id)
+        message = f"Хендлер {handler.name} (update {handler.update_id}) работал {elapsed:.2f} с при бюджете {self.budget} с"
+        if handler.stack:
+            message += f", стек во время превышения:\n{handler.stack}"
+        logger.warning(message)
+
+    def active_handlers(self) -> List[Tuple[str, float]]:
+        """Выполняющиеся хендлеры и сколько секунд они уже работают."""
+        now = time.monotonic()
+        return [(handler.name, now - handler.started) for handler in list(self._active.values())]
+
+    def recent_max_lag(self, seconds: float = 60.0) -> float:
+        """Максимальная задержка цикла за последние `seconds` секунд."""
+        cutoff = time.monotonic() - seconds
+        return max((lag for ts, lag in list(self._lags) if ts >= cutoff), default=0.0)
+
+    def _record(self, kind: str, duration: float, stack: Optional[str], **details) -> Dict[str, Any]:
+        event = {"kind": kind, "at": time.time(), "duration": duration, "stack": stack, **details}
+        self.events.append(event)
+        return event
+
+    async def _measure_lag(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - self._heartbeat - self.interval)
+            self._heartbeat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._lags.append((now, lag))
+            metrics.LOOP_LAG.observe(lag)
+
+            stall, self._stall_event = self._stall_event, None
+            if stall is not None:
+                # Поток-наблюдатель уже снял стек, здесь фиксируем итоговую длительность
+                stall["duration"] = lag
+                logger.warning(f"Цикл событий был заблокирован {lag:.2f} с")
+            elif lag > self.lag_threshold:
+                self._record("loop_lag", lag, None)
+                logger.warning(f"Задержка цикла событий {lag:.2f} с")
+
+    def _watch(self) -> None:
+        """Поток-наблюдатель: не зависит от цикла событий, поэтому видит его блокировки."""
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            blocked = now - self._heartbeat > self.interval + self.lag_threshold
+            loop_stack = None
+
+            if blocked and self._stall_event is None:
+                self.stalls += 1
+                loop_stack = _thread_stack(self._loop_thread_id)
+                self._stall_event = self._record("loop_blocked", now - self._heartbeat - self.interval, loop_stack)
+                logger.warning(f"Цикл событий не отвечает, стек потока цикла:\n{loop_stack}")
+
+            for handler in list(self._active.values()):
+                if handler.flagged or now - handler.started <= self.budget:
+                    continue
+                handler.flagged = True
+                # Если цикл заблокирован, виноват код в потоке цикла, иначе хендлер чего-то ждет
+                if blocked:
+                    handler.stack = loop_stack or _thread_stack(self._loop_thread_id)
+                else:
+                    try:
+                        handler.stack = _task_stack(handler.task)
+                    except Exception as e:
+                        handler.stack = f"<стек недоступен: {e}>"
+
+    def report(self) -> str:
+        """Текстовая сводка для команды /health."""
+        uptime = int(time.time() - self.started_at)
+        lines = [
+            f"⏱ Работает: {uptime // 3600} ч {uptime % 3600 // 60} мин",
+            f"🔄 Задержка цикла: сейчас {self.last_lag * 1000:.1f} мс, "
+            f"макс. за минуту {self.recent_max_lag() * 1000:.1f} мс, "
+            f"макс. с запуска {self.max_lag * 1000:.1f} мс",
+            f"🧱 Блокировок цикла: {self.stalls}",
+            f"🐢 Хендлеров дольше {self.budget} с: {self.slow_handlers}",
+        ]
+
+        active = self.active_handlers()
+        if active:
+            lines.append("▶️ Выполняются: " + ", ".join(f"{name} ({elapsed:.1f} с)" for name, elapsed in active))
+
+        if self.events:
+            lines.append("\nПоследние события:")
+            for event in list(self.events)[-5:]:
+                at = time.strftime("%H:%M:%S", time.localtime(event["at"]))
+                title = event.get("handler") or event["kind"]
+                lines.append(f"• {at} {title}: {event['duration']:.2f} с")
+                if event["stack"]:
+                    # Самые внутренние кадры - там, где тратится время
+                    frames = event["stack"].strip().splitlines()
+                    lines.extend("    " + line.strip() for line in frames[-4:])
+        return "\n".join(lines)